@@ -1,7 +1,17 @@
 import json
 import os
 
-from flask import Flask, jsonify, redirect, render_template, request, url_for
+from autocomplete import AutocompleteEngine
+from flask import (
+    Flask,
+    Response,
+    jsonify,
+    redirect,
+    render_template,
+    request,
+    stream_with_context,
+    url_for,
+)
 from flask_cors import CORS
 from history.history_manager import (
     add_model_response,
@@ -9,22 +19,25 @@ from history.history_manager import (
     calculate_content_statistics,
     load_history,
 )
-from llm_model import generate_response
-from pdf_processing.chunking import chunk_text
-from pdf_processing.metadata import get_pdf_title, save_knowledge_base
-from pdf_processing.pdf_extractor import extract_text_from_pdf
+from llm_model import GenerationEngine, build_prompt_prefix
+from pdf_processing.ingestion import chunk_options_from_settings, ingest_directory
+from rag.chunk_store import validate_filters
 from rag.citation import format_citation, get_citation
+from rag.reranker import CrossEncoderReranker
 from rag.retriever import OptimizedRetriever
+from scheduler import PRIORITY_AUTOCOMPLETE, PRIORITY_CHAT, GenerationScheduler, QueueFull
 from utils.constants import (
     DEFAULT_MODEL_PATH,
     DEFAULT_SETTINGS_FILE,
     HISTORY_FILE,
     KNOWLEDGE_BASE_FILE,
+    RERANKER_MODEL_NAME,
     SETTINGS_FILE,
 )
 from utils.model_download import check_and_download_default_model
 from utils.model_loader import load_model
 from utils.user_settings import load_settings, update_settings
+from warmup import Component, ComponentNotReady
 
 app = Flask(__name__)
 CORS(app) # Enable CORS for all routes
@@ -33,8 +46,8 @@ pdf_files = []
 
 pdf_info = {}
 settings = load_settings()
-model = load_model(settings["model_path"])
-retriever = None
+model = None  # set once the model component below has loaded
+retriever = None  # set once the retriever component below has loaded
 
 project_title = "Untitled Project"
 section_context = "General Context"
@@ -49,72 +62,383 @@ def get_available_models():
                 model_files.append(full_path)
     return model_files
 
+def create_retriever():
+    """Creates the retriever with the index options from user settings."""
+    current_settings = load_settings()
+    reranker = None
+    if current_settings.get("reranker_enabled", False):
+        reranker = CrossEncoderReranker(
+            model_name=current_settings.get("reranker_model", RERANKER_MODEL_NAME),
+            time_budget_ms=current_settings.get("rerank_budget_ms", 150)
+        )
+
+    retriever = OptimizedRetriever(
+        knowledge_base=KNOWLEDGE_BASE_FILE,
+        index_file="index.faiss",
+        index_type=current_settings.get("index_type", "auto"),
+        nprobe=current_settings.get("faiss_nprobe", 16),
+        ef_search=current_settings.get("faiss_ef_search", 64),
+        memory_budget_mb=current_settings.get("index_memory_budget_mb"),
+        use_mmap=current_settings.get("faiss_mmap", False),
+        retrieval_mode=current_settings.get("retrieval_mode", "hybrid"),
+        reranker=reranker,
+        rerank_candidates=current_settings.get("rerank_candidates", 20),
+        diversify=current_settings.get("diversify_results", True),
+        mmr_lambda=current_settings.get("mmr_lambda", 0.7),
+        max_per_source=current_settings.get("max_chunks_per_source", 2)
+    )
+    # Loads a saved index during warm-up rather than on the first search
+    retriever.load_or_initialize_knowledge_base()
+    return retriever
+
+def ingest_pdf_directory(directory):
+    """
+    Incrementally ingests a PDF directory and refreshes the global PDF state.
+    Only new or modified PDFs are processed, in parallel; the retriever, if
+    any, indexes documents as they finish and is then synced with removals.
+
+    Raises:
+    - ComponentNotReady: If the retriever is still loading after COMPONENT_WAIT_SECONDS.
+    """
+    global pdf_files, pdf_info
+
+    retriever = get_retriever()
+    current_settings = load_settings()
+    changes = ingest_directory(
+        directory,
+        store=retriever.store if retriever else None,
+        workers=current_settings.get("ingest_workers"),
+        on_document=retriever.index_document if retriever else None,
+        chunk_options=chunk_options_from_settings(current_settings)
+    )
+    pdf_info = changes["pdf_info"]
+    pdf_files = [info["file_path"] for info in pdf_info.values()]
+
+    if retriever:
+        retriever.apply_ingestion(changes)
+    return changes
+
 class ProjectContext:
     def __init__(self):
         self.title = "Untitled Project"
         self.keywords = []
         self.section = "General"
         self.knowledge_base_updated = False
+        self.related_chunks = {}
 
 project_context = ProjectContext()
 
+# Each model instance is owned by one scheduler worker; engines keep the
+# llama.cpp state of the shared prompt prefix between requests. They start
+# without a model and get one when the model component has loaded.
+scheduler = GenerationScheduler(
+    [GenerationEngine(None) for _ in range(max(1, int(settings.get("model_instances", 1))))],
+    max_queue=settings.get("generation_queue_size", 16)
+)
+
+def queue_full_response(error):
+    """429 response for requests rejected because the generation queue is full."""
+    return jsonify({"success": False, "error": str(error)}), 429, {"Retry-After": "1"}
+
+def refresh_prompt_prefix():
+    """Rebuilds the shared prompt prefix after the system prompt or project context changed."""
+    scheduler.set_prefix(build_prompt_prefix(
+        load_settings().get("system_prompt", ""), project_context.title, project_context.section
+    ))
+    # Cached suggestions were written for the old context
+    autocompleter.invalidate()
+
+autocompleter = AutocompleteEngine(
+    scheduler,
+    max_tokens=settings.get("autocomplete_max_tokens", 24),
+    debounce_ms=settings.get("autocomplete_debounce_ms", 50),
+    target_p95_ms=settings.get("autocomplete_target_p95_ms", 500)
+)
+
+refresh_prompt_prefix()
+
+def load_models():
+    """Loads one instance of the configured model per scheduler worker."""
+    model_path = load_settings()["model_path"]
+    return [load_model(model_path) for _ in scheduler.engines]
+
+def use_models(models):
+    global model
+    model = models[0]
+    scheduler.set_models(models)
+
+def use_retriever(loaded_retriever):
+    global retriever
+    retriever = loaded_retriever
+
+# The models and the retriever's embedding model load in background threads,
+# so the server starts answering at once
+model_component = Component("model", load_models, on_ready=use_models)
+retriever_component = Component("retriever", create_retriever, on_ready=use_retriever)
+components = [model_component, retriever_component]
+
+@app.before_request
+def start_background_work():
+    """
+    Starts the generation workers and the component loads; later calls do nothing.
+
+    Nothing is started at import time: PDF ingestion spawns worker processes,
+    which import this script again and must not load the models themselves.
+    """
+    scheduler.start()
+    for component in components:
+        component.start()
+
+# How long a request waits for a component that is still loading
+COMPONENT_WAIT_SECONDS = settings.get("component_wait_seconds", 10)
+
+def wait_for_model():
+    """
+    Waits for the model component and returns the current model.
+
+    Returns:
+    - Llama: The loaded model, or None if no model could be loaded.
+
+    Raises:
+    - ComponentNotReady: If the model is still loading after COMPONENT_WAIT_SECONDS.
+    """
+    model_component.wait(COMPONENT_WAIT_SECONDS)
+    return model
+
+def get_retriever():
+    """
+    Waits for the retriever component and returns the current retriever.
+
+    Returns:
+    - OptimizedRetriever: The loaded retriever, or None if it could not be loaded.
+
+    Raises:
+    - ComponentNotReady: If the retriever is still loading after COMPONENT_WAIT_SECONDS.
+    """
+    retriever_component.wait(COMPONENT_WAIT_SECONDS)
+    return retriever
+
+def not_ready_response(error):
+    """503 response for requests that need a component which is still loading."""
+    return jsonify({"success": False, "error": str(error)}), 503, {"Retry-After": "5"}
+
+# Upper bound on queries accepted by one /api/search request
+MAX_SEARCH_QUERIES = 64
+
 @app.route("/update_project", methods=["POST"])
 def update_project():
-    global project_context, retriever
+    global project_context
 
+    queries = []
     if "project_title" in request.form:
         project_context.title = request.form.get("project_title")
-        # Search online when project title changes
-        if retriever:
-            # Update knowledge base based on title
-            chunks = retriever.search(project_context.title)
-            retriever.add_to_knowledge_base(chunks, f"title_{project_context.title}")
-            project_context.knowledge_base_updated = True
-
+        queries.append(project_context.title)
 
     if "keywords" in request.form:
         new_keywords = request.form.get("keywords").split(',')
         project_context.keywords = [k.strip() for k in new_keywords if k.strip()]
-        # Search online for each keyword
-        if retriever:
-            for keyword in project_context.keywords:
-                retriever.add_to_knowledge_base(retriever.search(keyword), f"keyword_{keyword}")
-            project_context.knowledge_base_updated = True
+        queries.extend(project_context.keywords)
+
+    # Look up the title and every keyword in one batched search
+    try:
+        retriever = get_retriever() if queries else None
+    except ComponentNotReady as e:
+        print(f"Skipping related chunks: {e}")
+        retriever = None
+    if retriever:
+        results = retriever.search_batch(queries)
+        project_context.related_chunks.update(zip(queries, results))
+        project_context.knowledge_base_updated = True
 
     if "section_context" in request.form:
         project_context.section = request.form.get("section_context")
 
+    refresh_prompt_prefix()
     return redirect(url_for("index"))
-@app.route("/api/autocomplete", methods=["POST"])
-def api_autocomplete():
+
+@app.route("/api/search", methods=["POST"])
+def api_search():
     """
-    Endpoint for real-time autocomplete suggestions.
-    Expects JSON input: {"prompt": "user text", "max_suggestions": 1}
+    Searches the knowledge base for several queries in one request.
+    Expects JSON input: {"queries": ["...", ...], "top_k": 3, "mode": "hybrid", "filters": {...}}
+    where filters may restrict the search by source, title, author, year range,
+    ingestion batch or page range.
     """
-    pass
+    data = request.get_json(silent=True) or {}
+    queries = data.get("queries")
+    if isinstance(queries, str):
+        queries = [queries]
+    if not queries or not all(isinstance(q, str) for q in queries):
+        return jsonify({"success": False, "error": "Expected a non-empty list of query strings"}), 400
+    if len(queries) > MAX_SEARCH_QUERIES:
+        return jsonify({"success": False, "error": f"At most {MAX_SEARCH_QUERIES} queries per request"}), 400
+    try:
+        retriever = get_retriever()
+    except ComponentNotReady as e:
+        return not_ready_response(e)
+    if retriever is None:
+        return jsonify({"success": False, "error": "No knowledge base loaded"}), 409
+
+    try:
+        top_k = max(1, min(int(data.get("top_k", 3)), 50))
+    except (TypeError, ValueError):
+        return jsonify({"success": False, "error": "top_k must be an integer"}), 400
+
+    filters = data.get("filters")
+    try:
+        if filters is not None:
+            filters = validate_filters(filters)
+        results = retriever.search_batch(queries, top_k=top_k, mode=data.get("mode"), filters=filters)
+    except ValueError as e:
+        return jsonify({"success": False, "error": f"Invalid filters: {e}"}), 400
+    return jsonify({
+        "success": True,
+        "results": [{"query": query, "chunks": chunks} for query, chunks in zip(queries, results)],
+        "timings": retriever.last_search_stats
+    })
 
 @app.route("/api/autocomplete", methods=["POST"])
 def autocomplete():
     """
-    Endpoint for real-time autocomplete suggestions for the flutter app"""
-    query = request.json.get("current_text", "")
-    max_suggestions = 1
+    Endpoint for real-time autocomplete suggestions.
+    Expects JSON input: {"current_text": "user text", "session_id": "editor id"}
+    ("prompt" is accepted in place of "current_text"). A request superseded by
+    a newer one from the same session returns no suggestions and "superseded": true.
+    """
+    data = request.get_json(silent=True) or {}
+    text = data.get("current_text", data.get("prompt", ""))
+    session_id = str(data.get("session_id") or request.remote_addr)
 
-    if not model:
+    if not isinstance(text, str):
+        return jsonify({"success": False, "error": "current_text must be a string"}), 400
+    if not text.strip():
         return jsonify({"suggestions": []})
+    try:
+        if not wait_for_model():
+            return jsonify({"suggestions": []})
+    except ComponentNotReady as e:
+        return not_ready_response(e)
+
+    try:
+        result = autocompleter.complete(session_id, text)
+    except QueueFull as e:
+        return queue_full_response(e)
+
+    suggestions = [result["suggestion"]] if result["suggestion"] else []
+    return jsonify({"suggestions": suggestions, "cached": result["cached"], "superseded": result["superseded"]})
+
+def retrieve_context(query):
+    """Returns the top 3 relevant chunks for a query and their text joined as prompt context."""
+    try:
+        retriever = get_retriever()
+    except ComponentNotReady:
+        return [], ""
+    if not retriever:
+        return [], ""
+    rag_results = retriever.search(query)[:3]
+    return rag_results, "\n".join(chunk["text"] for chunk in rag_results)
+
+def sse_response(pieces, on_complete=None, extra=None):
+    """
+    Streams generated text pieces as server-sent events.
+
+    Each piece is sent as a `data: {"token": ...}` event and a final `done`
+    event carries the full text. If the client disconnects, even before the
+    first piece, `pieces` is closed, which cancels or stops generation;
+    `on_complete` is only called with the full text once the stream finished normally.
+
+    Parameters:
+    - pieces (StreamHandle): Text pieces, e.g. from `GenerationScheduler.stream`.
+    - on_complete (callable): Called with the full stripped text after the last piece.
+    - extra (dict): Additional fields for the `done` event.
+    """
+    def events():
+        parts = []
+        try:
+            for piece in pieces:
+                parts.append(piece)
+                yield f"data: {json.dumps({'token': piece})}\n\n"
+        except GeneratorExit:
+            print("Client disconnected, generation cancelled")
+            raise
+        except Exception as e:
+            yield f"event: error\ndata: {json.dumps({'error': str(e)})}\n\n"
+            return
+        finally:
+            pieces.close()
+
+        text = "".join(parts).strip()
+        if on_complete:
+            on_complete(text)
+        yield f"event: done\ndata: {json.dumps(dict(extra or {}, text=text))}\n\n"
+
+    response = Response(
+        stream_with_context(events()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+    # events() never runs its cleanup if the client is gone before the first piece
+    response.call_on_close(pieces.close)
+    return response
+
+@app.route("/api/generate/stream", methods=["POST"])
+def generate_stream():
+    """
+    Streams the answer to a query as server-sent events.
+    Expects JSON input: {"query": "user question"}
+    The query and answer are saved to the history once the stream completes.
+    """
+    query = (request.get_json(silent=True) or {}).get("query", "")
+    if not query or not isinstance(query, str):
+        return jsonify({"success": False, "error": "Missing query"}), 400
+    try:
+        if not wait_for_model():
+            return jsonify({"success": False, "error": "No model loaded"}), 409
+    except ComponentNotReady as e:
+        return not_ready_response(e)
 
-    # Generate completion based on section context
-    prompt = f"""In the {project_context.section} section of a paper about {project_context.title},
-                complete the following text: {query}"""
+    rag_results, context = retrieve_context(query)
+    sources = [{"source": chunk["source"], "score": chunk["score"], "text": chunk["text"][:200]} for chunk in rag_results]
+
+    def save_exchange(text):
+        add_user_input(query)
+        add_model_response(text)
+
+    try:
+        pieces = scheduler.stream(f"Context: {context}\nQuery: {query}", priority=PRIORITY_CHAT)
+    except QueueFull as e:
+        return queue_full_response(e)
+    return sse_response(pieces, on_complete=save_exchange, extra={"sources": sources})
 
-    suggestions = model(prompt)
-    return jsonify({"suggestions": suggestions})
+@app.route("/api/autocomplete/stream", methods=["POST"])
+def autocomplete_stream():
+    """
+    Streams an autocomplete suggestion as server-sent events.
+    Expects JSON input: {"current_text": "user text"}
+    """
+    query = (request.get_json(silent=True) or {}).get("current_text", "")
+    if not isinstance(query, str):
+        return jsonify({"success": False, "error": "current_text must be a string"}), 400
+    try:
+        if not wait_for_model():
+            return jsonify({"success": False, "error": "No model loaded"}), 409
+    except ComponentNotReady as e:
+        return not_ready_response(e)
+
+    try:
+        pieces = scheduler.stream(
+            f"Complete the following text: {query}", priority=PRIORITY_AUTOCOMPLETE,
+            max_tokens=autocompleter.max_tokens
+        )
+    except QueueFull as e:
+        return queue_full_response(e)
+    return sse_response(pieces)
 
 
 @app.route("/", methods=["GET", "POST"])
 def index():
     # global model
-    global pdf_files, project_title, section_context, retriever
+    global pdf_files, project_title, section_context
 
     response = None
     response = None
@@ -148,49 +472,28 @@ def index():
             query = request.form.get("query")
             add_user_input(query)
 
-            # Get relevant context from knowledge base if available
-            context = ""
-            if retriever:
-                relevant_chunks = retriever.search(query)
-                rag_results = relevant_chunks[:3]  # Top 3 most relevant chunks
-                context = "\n".join(chunk["text"] for chunk in rag_results)
-
-            # Generate response with context
-            prompt = f"""Project: {project_context.title}
-                        Section: {project_context.section}
-                        Context: {context}
-                        Query: {query}"""
-
-
-            response = model(prompt)
-            response = response['choices'][0]['text'].strip()
-            add_model_response(response)
+            rag_results, context = retrieve_context(query)
+            # Generate response with context; the project header is the engine's cached prefix
+            try:
+                if wait_for_model():
+                    response = scheduler.generate(f"Context: {context}\nQuery: {query}", priority=PRIORITY_CHAT)
+                    add_model_response(response)
+                else:
+                    response = "No model loaded. Please select or download a model."
+            except ComponentNotReady:
+                response = "The model is still loading. Please try again in a moment."
+            except QueueFull:
+                response = "The model is busy with other requests. Please try again in a moment."
             content_stats = calculate_content_statistics()
 
         elif "pdf_directory" in request.form:
             directory = request.form.get("pdf_directory")
             if os.path.exists(directory):
-                # Initialize retriever only when we have PDFs
-                retriever = OptimizedRetriever(
-                    knowledge_base= KNOWLEDGE_BASE_FILE,
-                    index_file="index.faiss"
-                )
-
-                pdf_files = [f for f in os.listdir(directory) if f.endswith(".pdf")]
-                knowledge_base = {}
-
-                for pdf_file in pdf_files:
-                    pdf_path = os.path.join(directory, pdf_file)
-                    text = extract_text_from_pdf(pdf_path)
-                    chunks = chunk_text(text)
-                    title = get_pdf_title(pdf_file)
-                    knowledge_base[title] = chunks
-                    pdf_info[title] = {
-                        "chunks": len(chunks),
-                        "file_path": pdf_file
-                    }
-
-                save_knowledge_base(knowledge_base)
+                # The retriever has been warming up since start-up
+                try:
+                    ingest_pdf_directory(directory)
+                except ComponentNotReady:
+                    response = "The knowledge base is still loading. Please try again in a moment."
             else:
                 # Handle invalid directory
                 print(f"Directory does not exist: {directory}")
@@ -226,15 +529,17 @@ def download_model():
 
 @app.route("/update_settings", methods=["POST"])
 def update_settings_route():
-    global model
+    global settings
 
     selected_model = request.form.get("model")
     system_prompt = request.form.get("system_prompt", "")
 
     try:
         update_settings(model_path=selected_model, system_prompt=system_prompt)
-        # settings = load_settings()
-        model = load_model(settings["model_path"])
+        settings = load_settings()
+        # Loads the new model in the background; the number of instances is fixed at start-up
+        model_component.start(reload=True)
+        refresh_prompt_prefix()
     except Exception as e:
         print(f"Error updating settings: {e}")
 
@@ -242,32 +547,11 @@ def update_settings_route():
 
 @app.route("/set_pdf_directory", methods=["POST"])
 def set_pdf_directory():
-    global pdf_files, pdf_info
-
     directory = request.form.get("pdf_directory")
-    pdf_files = [
-        os.path.join(directory, file)
-        for file in os.listdir(directory)
-        if file.endswith(".pdf")
-    ]
-
-    # Extract and chunk PDFs
-    chunked_data = {}
-    pdf_info = {}  # Remove duplicate declaration
-
-    for pdf_file in pdf_files:
-        text = extract_text_from_pdf(pdf_file)
-        chunks = chunk_text(text)
-        title = get_pdf_title(pdf_file)
-        chunked_data[title] = chunks
-
-        # Store PDF info (remove duplicate block)
-        pdf_info[title] = {
-            "chunks": len(chunks),
-            "file_path": pdf_file
-        }
-
-    save_knowledge_base(chunked_data)
+    try:
+        ingest_pdf_directory(directory)
+    except ComponentNotReady as e:
+        return not_ready_response(e)
 
     return redirect(url_for("index"))
 
@@ -287,20 +571,39 @@ def get_citation_route():
         "error": "Could not generate citation"
     })
 
+@app.route("/api/history", methods=["GET"])
+def api_history():
+    """
+    Returns one page of conversation history.
+    Query parameters: limit (default 50, at most 500) and before_id, the
+    "next_before_id" cursor of the previous response to page further back.
+    """
+    try:
+        limit = max(1, min(int(request.args.get("limit", 50)), 500))
+        before_id = request.args.get("before_id", type=int)
+    except ValueError:
+        return jsonify({"success": False, "error": "limit must be an integer"}), 400
+    return jsonify(dict(load_history(limit=limit, before_id=before_id), success=True))
+
 @app.route("/api/status", methods=["GET"])
 def get_status():
     """
     Endpoint to check backend status and loaded resources
     """
+    current_settings = load_settings()
     return jsonify({
         "success": True,
+        "ready": all(component.is_ready() for component in components),
+        "components": {component.name: component.status() for component in components},
         "model_loaded": model is not None,
         "pdfs_loaded": len(pdf_info) > 0,
         "pdf_count": len(pdf_info),
         "model_info": {
-            "name": os.path.basename(load_settings().get("model_path", "")),
-            "system_prompt": load_settings().get("system_prompt", "")
-        }
+            "name": os.path.basename(current_settings.get("model_path", "")),
+            "system_prompt": current_settings.get("system_prompt", "")
+        },
+        "generation": scheduler.stats(),
+        "autocomplete": autocompleter.stats()
     })
 
 
@@ -310,4 +613,9 @@ if __name__ == "__main__":
     #     model = load_model(settings["model_path"])
     # except Exception as e:
     #     print(f"Error loading model: {e}")
-    app.run(debug=True)
\ No newline at end of file
+    debug = True
+    # Start loading before the first request; with the reloader only in the
+    # process that serves requests, not in the one watching for file changes
+    if not debug or os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        start_background_work()
+    app.run(debug=debug)
\ No newline at end of file
@@ -0,0 +1,201 @@
+import itertools
+import threading
+import time
+from collections import OrderedDict, deque
+
+from scheduler import PRIORITY_AUTOCOMPLETE
+
+# Recent latencies kept for percentiles
+LATENCY_SAMPLES = 500
+# Only the end of the text is sent to the model; short prompts keep latency low
+MAX_PROMPT_CHARS = 500
+# How far back typed-forward text is matched against cached prefixes
+MAX_REUSE_CHARS = 200
+# Typing sessions tracked for superseding; the least recently active are forgotten
+MAX_SESSIONS = 1024
+
+
+def percentile(ordered, fraction):
+    """Returns the value at `fraction` of an already sorted list."""
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+class AutocompleteEngine:
+    def __init__(self, scheduler, max_tokens=24, debounce_ms=50, cache_size=512, target_p95_ms=500):
+        """
+        Low-latency completions for text being typed.
+
+        - Only the latest request of a session runs: a newer request closes the
+          stream of the previous one, which is then dropped from the queue or
+          stopped mid-generation.
+        - Requests wait `debounce_ms` before queueing, so bursts of keystrokes
+          only reach the model once.
+        - Completions are cached by the context they were generated from (the
+          last MAX_PROMPT_CHARS characters, all the model sees), so edits further
+          back keep the cache useful and lookups cost the same for long texts.
+          When the user types forward into a suggestion, the rest of it is
+          returned from the cache without running the model.
+        - Latencies of model runs and cache hits are recorded to check against
+          the p95 target.
+
+        Parameters:
+        - scheduler (GenerationScheduler): Scheduler the completions run on.
+        - max_tokens (int): Maximum length of a suggestion in tokens.
+        - debounce_ms (float): Delay before a request is queued.
+        - cache_size (int): Number of completions kept.
+        - target_p95_ms (float): Latency target reported by `stats`.
+        """
+        self.scheduler = scheduler
+        self.max_tokens = max_tokens
+        self.debounce_ms = debounce_ms
+        self.cache_size = cache_size
+        self.target_p95_ms = target_p95_ms
+        self._cache = OrderedDict()  # context tail -> completion
+        # session id -> (number of its latest request, its stream once queued), least recent first
+        self._sessions = OrderedDict()
+        self._request_numbers = itertools.count(1)
+        self._lock = threading.Lock()
+        self._latencies = {"model": deque(maxlen=LATENCY_SAMPLES), "cache": deque(maxlen=LATENCY_SAMPLES)}
+        self._counts = {"requests": 0, "cache_hits": 0, "superseded": 0}
+
+    def invalidate(self):
+        """Drops cached completions, e.g. after the project context changed."""
+        with self._lock:
+            self._cache.clear()
+
+    @staticmethod
+    def _context_key(text, end=None):
+        """Cache key of the text up to `end`: the tail that would be sent to the model."""
+        end = len(text) if end is None else end
+        return text[max(end - MAX_PROMPT_CHARS, 0):end]
+
+    def _cached_completion(self, text):
+        """Finds a cached completion that the text has typed forward into, returning the untyped rest."""
+        cuts = range(len(text), max(len(text) - MAX_REUSE_CHARS, 0) - 1, -1)
+        keys = [(cut, self._context_key(text, cut)) for cut in cuts]
+        with self._lock:
+            for cut, key in keys:
+                completion = self._cache.get(key)
+                if completion is None:
+                    continue
+                typed = text[cut:]
+                if completion.startswith(typed) and len(completion) > len(typed):
+                    self._cache.move_to_end(key)
+                    return completion[len(typed):]
+        return None
+
+    def _store(self, text, completion):
+        key = self._context_key(text)
+        with self._lock:
+            self._cache[key] = completion
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _is_latest(self, session_id, request_number):
+        with self._lock:
+            return self._sessions.get(session_id, (None,))[0] == request_number
+
+    def _attach_stream(self, session_id, request_number, stream):
+        """Records the stream of the session's latest request; returns False if the request was superseded."""
+        with self._lock:
+            if self._sessions.get(session_id, (None,))[0] == request_number:
+                self._sessions[session_id] = (request_number, stream)
+                return True
+        return False
+
+    def _record(self, kind, started):
+        with self._lock:
+            self._latencies[kind].append((time.perf_counter() - started) * 1000)
+
+    def complete(self, session_id, text):
+        """
+        Suggests a continuation of `text`.
+
+        Parameters:
+        - session_id (str): Identifies the typing session (one editor).
+        - text (str): Text typed so far.
+
+        Returns:
+        - dict: "suggestion" (str, or None if superseded), "cached" and "superseded".
+
+        Raises:
+        - QueueFull: If the generation queue cannot take the request.
+        """
+        started = time.perf_counter()
+        with self._lock:
+            self._counts["requests"] += 1
+            request_number = next(self._request_numbers)
+            _, previous = self._sessions.get(session_id, (None, None))
+            self._sessions[session_id] = (request_number, None)
+            self._sessions.move_to_end(session_id)
+            while len(self._sessions) > MAX_SESSIONS:
+                self._sessions.popitem(last=False)
+        if previous is not None:
+            previous.close()  # dropped if still queued, so it never reaches a worker
+
+        cached = self._cached_completion(text)
+        if cached is not None:
+            self._record("cache", started)
+            with self._lock:
+                self._counts["cache_hits"] += 1
+            return {"suggestion": cached, "cached": True, "superseded": False}
+
+        superseded = {"suggestion": None, "cached": False, "superseded": True}
+        if self.debounce_ms:
+            time.sleep(self.debounce_ms / 1000)
+        if not self._is_latest(session_id, request_number):
+            with self._lock:
+                self._counts["superseded"] += 1
+            return superseded
+
+        pieces = self.scheduler.stream(
+            f"Complete the following text: {self._context_key(text)}",
+            priority=PRIORITY_AUTOCOMPLETE,
+            max_tokens=self.max_tokens,
+            stop=["\n\n"]
+        )
+        parts = []
+        try:
+            if self._attach_stream(session_id, request_number, pieces):
+                parts.extend(pieces)  # ends early if a newer request closes the stream
+        finally:
+            pieces.close()
+        if not self._is_latest(session_id, request_number):
+            with self._lock:
+                self._counts["superseded"] += 1
+            return superseded
+
+        completion = "".join(parts).rstrip()
+        if completion:
+            self._store(text, completion)
+        self._record("model", started)
+        return {"suggestion": completion, "cached": False, "superseded": False}
+
+    def stats(self):
+        """
+        Returns autocomplete metrics.
+
+        Returns:
+        - dict: Request counters, cache hit rate and p50/p95 latency in
+          milliseconds for model runs and cache hits, with the p95 target.
+        """
+        with self._lock:
+            latencies = {}
+            for kind, samples in self._latencies.items():
+                ordered = sorted(samples)
+                latencies[kind] = {"count": len(ordered)}
+                if ordered:
+                    latencies[kind].update(
+                        p50_ms=round(percentile(ordered, 0.5), 1), p95_ms=round(percentile(ordered, 0.95), 1)
+                    )
+            overall = sorted(self._latencies["model"] + self._latencies["cache"])
+            p95 = round(percentile(overall, 0.95), 1) if overall else None
+            return {
+                **self._counts,
+                "cache_hit_rate": round(self._counts["cache_hits"] / max(self._counts["requests"], 1), 3),
+                "latency": latencies,
+                "p95_ms": p95,
+                "target_p95_ms": self.target_p95_ms,
+                "within_target": p95 is not None and p95 <= self.target_p95_ms,
+            }
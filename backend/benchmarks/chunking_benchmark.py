@@ -0,0 +1,82 @@
+"""
+Micro-benchmark of the streaming chunker against the original `chunk_text`.
+
+Run from the backend directory:
+    python -m benchmarks.chunking_benchmark [--tokenizer]
+"""
+import argparse
+import random
+import time
+
+from pdf_processing.chunking import count_words, iter_chunks, make_token_counter
+from utils.constants import EMBEDDING_MODEL_NAME
+
+VOCABULARY = [
+    "model", "retrieval", "thesis", "transformer", "gradient", "dataset", "evaluation",
+    "robot", "control", "language", "vision", "attention", "embedding", "corpus", "a", "of",
+]
+
+
+def legacy_chunk_text(text, chunk_size=500):
+    """The original chunker, which re-sums the current chunk for every word."""
+    words = text.split()
+    chunks = []
+    current_chunk = []
+
+    for word in words:
+        if sum(len(w) for w in current_chunk) + len(word) + len(current_chunk) <= chunk_size:
+            current_chunk.append(word)
+        else:
+            chunks.append(" ".join(current_chunk))
+            current_chunk = [word]
+
+    if current_chunk:
+        chunks.append(" ".join(current_chunk))
+    return chunks
+
+
+def make_pages(n_words, words_per_page=500, seed=0):
+    """Generates synthetic pages of sentences and paragraphs."""
+    rng = random.Random(seed)
+    pages = []
+    for page_number in range(1, n_words // words_per_page + 1):
+        sentences = []
+        for _ in range(words_per_page // 20):
+            sentence = " ".join(rng.choice(VOCABULARY) for _ in range(20))
+            sentences.append(sentence.capitalize() + ".")
+            if rng.random() < 0.1:
+                sentences.append("\n\n")
+        pages.append((page_number, " ".join(sentences)))
+    return pages
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[50_000, 200_000, 1_000_000],
+                        help="document sizes in words")
+    parser.add_argument("--tokenizer", action="store_true",
+                        help=f"count tokens with the {EMBEDDING_MODEL_NAME} tokenizer instead of words")
+    args = parser.parse_args()
+
+    count_tokens = make_token_counter(EMBEDDING_MODEL_NAME) if args.tokenizer else count_words
+
+    print(f"{'words':>10} {'chunk_text (s)':>15} {'iter_chunks (s)':>16} {'speed-up':>9} {'chunks':>14}")
+    for size in args.sizes:
+        pages = make_pages(size)
+        text = "\n".join(page for _, page in pages)
+
+        legacy_time, legacy_chunks = timed(lambda: legacy_chunk_text(text))
+        new_time, new_chunks = timed(lambda: list(iter_chunks(pages, count_tokens=count_tokens)))
+
+        print(f"{size:>10} {legacy_time:>15.3f} {new_time:>16.3f} {legacy_time / new_time:>8.1f}x "
+              f"{len(legacy_chunks):>6}/{len(new_chunks):<7}")
+
+
+if __name__ == "__main__":
+    main()
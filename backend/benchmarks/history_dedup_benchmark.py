@@ -0,0 +1,132 @@
+"""
+Benchmark of near-duplicate detection on history inserts: the original linear
+SequenceMatcher scan against the MinHash LSH index of the history store.
+
+Short entries (chat-sized, under SHORT_TEXT_CHARS) and long entries go
+through different LSH indexes, so each history is measured with both. The
+linear scan takes seconds per insert on long histories, so it only replays
+the first --legacy-inserts inserts; duplicates are compared on those.
+
+Run from the backend directory:
+    python -m benchmarks.history_dedup_benchmark [--sizes 1000 5000 20000] [--inserts 50] [--legacy-inserts 10]
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+import string
+import tempfile
+import time
+from difflib import SequenceMatcher
+
+from history.history_manager import add_unique_entry
+from history.history_store import HistoryStore
+from history.near_duplicates import SHORT_TEXT_CHARS
+
+TOPIC_WORDS = [
+    "the", "of", "a", "we", "model", "retrieval", "thesis", "transformer", "gradient", "dataset",
+    "evaluation", "robot", "control", "language", "vision", "attention", "embedding", "corpus",
+    "results", "method", "baseline", "accuracy", "section", "related", "work", "propose",
+]
+# Topic words first, then a long tail of made-up words, drawn with Zipf
+# frequencies: texts share about as many shingles as unrelated English does
+_letters = random.Random(0)
+VOCABULARY = TOPIC_WORDS + [
+    "".join(_letters.choice(string.ascii_lowercase) for _ in range(_letters.randint(2, 9)))
+    for _ in range(5000)
+]
+ZIPF_WEIGHTS = list(itertools.accumulate(1 / rank for rank in range(1, len(VOCABULARY) + 1)))
+
+# Words per entry of the short and long workloads; about 7.5 characters per word
+WORKLOAD_WORDS = [8, 120]
+
+
+def make_texts(count, words=40, seed=0):
+    """Generates distinct synthetic history entries."""
+    rng = random.Random(seed)
+    return [f"{i}: " + " ".join(rng.choices(VOCABULARY, cum_weights=ZIPF_WEIGHTS, k=words)) for i in range(count)]
+
+
+def perturb(text, rng, edits=1):
+    """Returns a near-duplicate of text with a few words replaced."""
+    words = text.split()
+    for _ in range(edits):
+        words[rng.randrange(1, len(words))] = rng.choices(VOCABULARY, cum_weights=ZIPF_WEIGHTS)[0]
+    return " ".join(words)
+
+
+def legacy_find_duplicate(contents, new_content, threshold=0.9):
+    """The original check: compares the new text with every entry, oldest first."""
+    for index, content in enumerate(contents):
+        if SequenceMatcher(None, content, new_content).ratio() > threshold:
+            return index
+    return None
+
+
+def make_queries(texts, count, words, seed=1):
+    """Half near-duplicates of existing entries, half new texts."""
+    rng = random.Random(seed)
+    fresh = make_texts(count, words, seed=seed + 1)
+    queries = []
+    for i in range(count):
+        if i % 2:
+            queries.append(perturb(rng.choice(texts), rng))
+        else:
+            queries.append("new " + fresh[i])
+    return queries
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 5000, 20000],
+                        help="history sizes in entries")
+    parser.add_argument("--inserts", type=int, default=50, help="entries inserted per size")
+    parser.add_argument("--legacy-inserts", type=int, default=10, help="inserts replayed with the linear scan")
+    parser.add_argument("--threshold", type=float, default=0.9, help="SequenceMatcher duplicate threshold")
+    args = parser.parse_args()
+
+    print(f"{'index':>6} {'chars':>6} {'entries':>8} {'linear (ms/insert)':>19} {'LSH (ms/insert)':>16} "
+          f"{'speed-up':>9} {'duplicates':>12}")
+    for words, size in ((words, size) for words in WORKLOAD_WORDS for size in args.sizes):
+        texts = make_texts(size, words)
+        queries = make_queries(texts, args.inserts, words)
+        chars = sum(map(len, texts)) // len(texts)
+        index = "short" if chars < SHORT_TEXT_CHARS else "long"
+
+        start = time.perf_counter()
+        # Replays the inserts like the store does: a duplicate replaces its original
+        contents = list(texts)
+        legacy_duplicates = 0
+        for query in queries[:args.legacy_inserts]:
+            position = legacy_find_duplicate(contents, query, args.threshold)
+            if position is not None:
+                del contents[position]
+                legacy_duplicates += 1
+            contents.append(query)
+        legacy_ms = (time.perf_counter() - start) * 1000 / len(queries[:args.legacy_inserts])
+
+        with tempfile.TemporaryDirectory() as directory:
+            json_file = os.path.join(directory, "history.json")
+            with open(json_file, "w") as f:
+                json.dump({"completions": [
+                    {"timestamp": str(i), "type": "user", "content": text} for i, text in enumerate(texts)
+                ]}, f)
+            store = HistoryStore(os.path.join(directory, "history.sqlite"), args.threshold)
+            store.migrate_from_json(json_file)
+
+            start = time.perf_counter()
+            replaced = [
+                not add_unique_entry(store, {"timestamp": "now", "type": "user", "content": query}, args.threshold)
+                for query in queries
+            ]
+            lsh_duplicates = sum(replaced[:args.legacy_inserts])
+            lsh_ms = (time.perf_counter() - start) * 1000 / len(queries)
+            store._db.close()
+
+        print(f"{index:>6} {chars:>6} {size:>8} {legacy_ms:>19.2f} {lsh_ms:>16.2f} {legacy_ms / lsh_ms:>8.1f}x "
+              f"{legacy_duplicates:>5}/{lsh_duplicates:<6}")
+
+
+if __name__ == "__main__":
+    main()
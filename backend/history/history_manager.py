@@ -1,93 +1,86 @@
 
-import json
 import os
-from datetime import datetime
-from difflib import SequenceMatcher
+import threading
+from datetime import date, datetime, timedelta
 
+from history.history_store import HistoryStore
 from utils.constants import HISTORY_FILE
 from utils.user_settings import load_settings
 
 
-def initialize_history():
-    """Initializes the history file with an empty structure."""
-    history = {
-        "completions": [] # list of gpt completions
-        }
+# Number of entries shown per page of history
+HISTORY_PAGE_SIZE = 50
+# Recent time windows (in days) and days of per-day breakdown in the statistics
+STATS_WINDOWS_DAYS = (1, 7, 30)
+STATS_DAYS = 30
 
-    os.makedirs(os.path.dirname(HISTORY_FILE), exist_ok=True)
-    with open(HISTORY_FILE, "w") as f:
-        json.dump(history, f, indent=4)
-    return history
 
-def load_history():
-    """Load or initialize history"""
-    try:
-        if os.path.exists(HISTORY_FILE):
-            with open(HISTORY_FILE, "r") as f:
-                content = f.read()
-                if not content.strip():
-                    return initialize_history()
-                return json.loads(content)
-                # history = json.loads(content)
-                # if not all(k in history for k in ["user_input", "model_content"]):
-                #     return initialize_history()
-                # return history
-
-        return initialize_history()
-    except (json.JSONDecodeError, FileNotFoundError):
-        return initialize_history()
-
-def save_history(history):
+# Held while the shared store is opened, so concurrent first requests open
+# (and migrate) it only once
+_store_lock = threading.Lock()
+
+
+def get_history_store():
+    """Lazily opens the shared history store, migrating a legacy history.json on first use"""
+    if not hasattr(get_history_store, "_store"):
+        with _store_lock:
+            if not hasattr(get_history_store, "_store"):
+                store = HistoryStore(duplicate_threshold=load_settings().get("history_duplicate_threshold", 0.9))
+                store.migrate_from_json(HISTORY_FILE)
+                get_history_store._store = store
+    return get_history_store._store
+
+def load_history(limit=HISTORY_PAGE_SIZE, before_id=None):
     """
-    Saves conversation history to a file.
+    Loads one page of history, most recent first by default.
 
     Parameters:
-    - history (dict): History dictionary to save.
+    - limit (int): Maximum number of entries.
+    - before_id (int): Cursor; only entries older than this ID are returned.
+
+    Returns:
+    - dict: "completions" (entries in chronological order), "total" and
+      "next_before_id" (cursor for the previous page, or None if there is none).
     """
-    with open(HISTORY_FILE, "w") as f:
-        json.dump(history, f, indent=2)
+    store = get_history_store()
+    completions = store.page(limit, before_id)
+    has_more = bool(completions) and store.page(1, completions[0]["id"]) != []
+    return {
+        "completions": completions,
+        "total": store.count(),
+        "next_before_id": completions[0]["id"] if has_more else None
+    }
 
-def add_unique_sentence(content_list, new_entry):
+def add_unique_entry(store, new_entry, threshold=None):
     """
-    Manages content list by keeping only most recent duplicate entries.
+    Appends an entry to the history store, first deleting the oldest near-duplicate.
+
+    Only the near-duplicate candidates found by the store's LSH index are
+    compared, so texts are not checked against the whole history. The check,
+    delete and append run as one transaction, see `HistoryStore.append_unique`.
+
+    Parameters:
+    - store (HistoryStore): History store.
+    - new_entry (dict): Entry to append.
+    - threshold (float): SequenceMatcher ratio above which entries are duplicates;
+      defaults to the `history_duplicate_threshold` setting (0.9).
+
     Returns: (bool) True if added as new, False if replaced duplicate
     """
-    new_content = new_entry.get('content') if isinstance(new_entry, dict) else new_entry
-    duplicate_index = None
-
-    # Check for duplicates
-    for i, entry in enumerate(content_list):
-        existing_content = entry.get('content') if isinstance(entry, dict) else entry
-        similarity = SequenceMatcher(None, str(existing_content), str(new_content)).ratio()
-        if similarity > 0.9:
-            duplicate_index = i
-            break
-
-    # Handle duplicate found
-    if duplicate_index is not None:
-        content_list.pop(duplicate_index)  # Remove old duplicate
-        content_list.append(new_entry)     # Add new entry
-        return False
-
-    # No duplicate - add new entry
-    content_list.append(new_entry)
-    return True
+    if threshold is None:
+        threshold = load_settings().get("history_duplicate_threshold", 0.9)
+    return store.append_unique(new_entry, threshold) is None
 
 def add_user_input(input_text):
     """Add user input, replacing duplicates with most recent"""
     try:
-        history = load_history()
-        if "completions" not in history:
-            history["completions"] = []
-
         entry = {
             "timestamp": datetime.now().isoformat(),
             "content": input_text,
             "type": "user"
         }
 
-        add_unique_sentence(history["completions"], entry)
-        save_history(history)
+        add_unique_entry(get_history_store(), entry)
         return True
     except Exception as e:
         print(f"Error adding user input: {e}")
@@ -96,7 +89,6 @@ def add_user_input(input_text):
 def add_model_response(response_text):
     """Add model response, replacing duplicates with most recent"""
     try:
-        history = load_history()
         settings = load_settings()
 
         text = response_text.get('choices', [{}])[0].get('text', '') if isinstance(response_text, dict) else str(response_text)
@@ -112,27 +104,24 @@ def add_model_response(response_text):
             }
         }
 
-        add_unique_sentence(history.get("completions", []), entry)
-        save_history(history)
+        add_unique_entry(get_history_store(), entry)
         return True
     except Exception as e:
         print(f"Error adding model response: {e}")
         return False
 
-def calculate_content_statistics():
-    """
-    Calculates content statistics from completion history.
+def summarize_counters(counters):
     """
-    history = load_history()
-    completions = history.get("completions", [])
+    Summarizes history counter rows into the statistics shown in the UI.
 
-    # Filter messages by type
-    user_messages = [entry for entry in completions if entry["type"] == "user"]
-    model_messages = [entry for entry in completions if entry["type"] == "model"]
+    Parameters:
+    - counters (list): Rows returned by `HistoryStore.counters`.
 
-    # Calculate word counts using 'content' field
-    user_words = sum(len(entry["content"].split()) for entry in user_messages)
-    model_words = sum(len(entry["content"].split()) for entry in model_messages)
+    Returns:
+    - dict: User and model word counts and shares, and the number of exchanges.
+    """
+    user_words = sum(row["words"] for row in counters if row["type"] == "user")
+    model_words = sum(row["words"] for row in counters if row["type"] == "model")
     total = user_words + model_words
 
     return {
@@ -140,8 +129,55 @@ def calculate_content_statistics():
         "model_words": model_words,
         "user_percentage": round((user_words / total * 100) if total > 0 else 0, 2),
         "model_percentage": round((model_words / total * 100) if total > 0 else 0, 2),
-        "total_exchanges": len(completions) // 2
+        "total_exchanges": sum(row["entries"] for row in counters) // 2
     }
+
+def calculate_content_statistics(windows=STATS_WINDOWS_DAYS, days=STATS_DAYS):
+    """
+    Calculates content statistics from the history counters.
+
+    The counters are kept up to date on every append and delete, so this
+    reads a few rows per day instead of the whole history.
+
+    Parameters:
+    - windows (tuple): Sizes in days of the recent time windows to report.
+    - days (int): Number of recent days in the per-day breakdown.
+
+    Returns:
+    - dict: Overall statistics (see `summarize_counters`), plus "by_model"
+      (words and responses per model), "by_day" (user and model words of
+      recent days) and "windows" (statistics of the last N days).
+    """
+    counters = get_history_store().counters()
+    stats = summarize_counters(counters)
+
+    by_model = {}
+    for row in counters:
+        if row["type"] == "model":
+            model = by_model.setdefault(row["model"] or "unknown", {"words": 0, "responses": 0})
+            model["words"] += row["words"]
+            model["responses"] += row["entries"]
+
+    today = date.today()
+    first_day = (today - timedelta(days=days - 1)).isoformat()
+    by_day = {}
+    for row in counters:
+        if first_day <= row["day"] <= today.isoformat():
+            day = by_day.setdefault(row["day"], {"user_words": 0, "model_words": 0})
+            if row["type"] in ("user", "model"):
+                day[f"{row['type']}_words"] += row["words"]
+
+    stats["by_model"] = by_model
+    stats["by_day"] = dict(sorted(by_day.items()))
+    stats["windows"] = {
+        f"last_{window}_days": summarize_counters(
+            [row for row in counters
+             if (today - timedelta(days=window - 1)).isoformat() <= row["day"] <= today.isoformat()]
+        )
+        for window in windows
+    }
+    return stats
+
 # def calculate_content_statistics():
 #     """
 #     Calculates content statistics from completion history.
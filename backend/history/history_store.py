@@ -0,0 +1,367 @@
+import json
+import os
+import sqlite3
+import threading
+from difflib import SequenceMatcher
+
+from history.near_duplicates import SHORT_TEXT_CHARS, MinHashLSH, length_bounds
+from utils.constants import HISTORY_DB_FILE
+
+# SQLite limits the number of bound parameters per statement
+_SQL_BATCH = 500
+
+
+class HistoryStore:
+    def __init__(self, db_file=HISTORY_DB_FILE, duplicate_threshold=0.9):
+        """
+        Append-only SQLite store of conversation entries.
+
+        Each exchange is one INSERT in its own transaction, so adding an entry
+        costs the same however long the history is, and the UI reads pages of
+        it by ID instead of loading everything. The database runs in WAL mode
+        with full sync, so a committed entry survives a crash and a crash
+        mid-write never leaves a half-written file.
+
+        Every entry's MinHash LSH buckets, sized for the duplicate threshold,
+        are stored next to it, so near-duplicates of a new text are found with
+        an indexed lookup instead of comparing against the whole history.
+        There are two indexes: 4-character shingles for long texts and
+        3-character shingles for texts under SHORT_TEXT_CHARS, where longer
+        shingles would be broken by too few edits. An entry is indexed in each
+        one whose queries it can match by length.
+
+        Word and entry counters per day, entry type and model are updated in
+        the same transaction as each append or delete, so statistics are read
+        from a handful of counter rows instead of recounting every entry.
+
+        Parameters:
+        - db_file (str): Path to the SQLite database.
+        - duplicate_threshold (float): SequenceMatcher ratio above which entries
+          are near-duplicates; the LSH bands are derived from it.
+        """
+        self.db_file = db_file
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_file, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=FULL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT, timestamp TEXT NOT NULL, type TEXT NOT NULL,"
+            " content TEXT NOT NULL, model TEXT)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS entries_type ON entries (type)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS entries_length ON entries (length(content))")
+        self._db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS entry_buckets (bucket INTEGER NOT NULL, entry_id INTEGER NOT NULL)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS entry_buckets_bucket ON entry_buckets (bucket)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS entry_buckets_entry ON entry_buckets (entry_id)")
+        has_counters = self._db.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'content_stats'"
+        ).fetchone() is not None
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS content_stats ("
+            " day TEXT NOT NULL, type TEXT NOT NULL, model TEXT NOT NULL,"
+            " entries INTEGER NOT NULL, words INTEGER NOT NULL, PRIMARY KEY (day, type, model))"
+        )
+        self._db.commit()
+        self.duplicate_threshold = duplicate_threshold
+        self.lsh = MinHashLSH.for_threshold(duplicate_threshold)
+        self.short_lsh = MinHashLSH.for_threshold(duplicate_threshold, shingle_size=3, seed=2)
+        # Longest entry a short text can match, and shortest one a long text can match
+        self._short_max_length = length_bounds(SHORT_TEXT_CHARS - 1, duplicate_threshold)[1]
+        self._long_min_length = length_bounds(SHORT_TEXT_CHARS, duplicate_threshold)[0]
+        self._check_lsh_params()
+        self._index_missing_buckets()
+        if not has_counters:
+            self._rebuild_counters()
+
+    def _rebuild_counters(self):
+        """Counts the existing entries once, for databases created before the counters existed."""
+        with self._lock:
+            self._db.execute("DELETE FROM content_stats")
+            for row in self._db.execute("SELECT timestamp, type, content, model FROM entries").fetchall():
+                self._count(row, 1)
+            self._db.commit()
+
+    def _count(self, row, sign):
+        """Adds (sign=1) or removes (sign=-1) an entry row from the counters."""
+        timestamp, entry_type, content, model = row
+        model_name = json.loads(model).get("name", "") if model else ""
+        self._db.execute(
+            "INSERT INTO content_stats (day, type, model, entries, words) VALUES (?, ?, ?, ?, ?)"
+            " ON CONFLICT (day, type, model) DO UPDATE SET"
+            " entries = entries + excluded.entries, words = words + excluded.words",
+            (timestamp[:10], entry_type, model_name, sign, sign * len(content.split())),
+        )
+
+    def _check_lsh_params(self):
+        """Drops the stored buckets if they were computed with other LSH parameters."""
+        params = json.dumps({
+            "long": self.lsh.params, "short": self.short_lsh.params, "short_text_chars": SHORT_TEXT_CHARS,
+            "short_max_length": self._short_max_length, "long_min_length": self._long_min_length,
+        }, sort_keys=True)
+        with self._lock:
+            row = self._db.execute("SELECT value FROM meta WHERE key = 'lsh'").fetchone()
+            if row is None or row[0] != params:
+                self._db.execute("DELETE FROM entry_buckets")
+                self._db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('lsh', ?)", (params,))
+                self._db.commit()
+
+    def _index_missing_buckets(self):
+        """Computes LSH buckets for entries stored before the near-duplicate index existed."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, content FROM entries WHERE id NOT IN (SELECT DISTINCT entry_id FROM entry_buckets)"
+            ).fetchall()
+            for entry_id, content in rows:
+                self._insert_buckets(entry_id, content)
+            self._db.commit()
+        if rows:
+            print(f"Indexed {len(rows)} history entries for near-duplicate detection")
+
+    def _lsh_for(self, text):
+        """The index a text is looked up in."""
+        return self.short_lsh if len(text) < SHORT_TEXT_CHARS else self.lsh
+
+    def _insert_buckets(self, entry_id, content):
+        buckets = []
+        if len(content) <= self._short_max_length:
+            buckets.extend(self.short_lsh.band_buckets(content))
+        if len(content) >= self._long_min_length:
+            buckets.extend(self.lsh.band_buckets(content))
+        self._db.executemany(
+            "INSERT INTO entry_buckets (bucket, entry_id) VALUES (?, ?)", [(bucket, entry_id) for bucket in buckets]
+        )
+
+    def migrate_from_json(self, json_file):
+        """
+        One-time import of a legacy history.json. The JSON file is renamed to
+        `<name>.migrated` afterwards so it is never imported twice.
+
+        Parameters:
+        - json_file (str): Path to the legacy history file.
+
+        Returns:
+        - int: Number of entries imported.
+        """
+        if not json_file or not os.path.exists(json_file):
+            return 0
+
+        try:
+            with open(json_file, "r") as f:
+                content = f.read()
+            completions = json.loads(content).get("completions", []) if content.strip() else []
+        except json.JSONDecodeError:
+            print(f"Could not read {json_file}, skipping migration")
+            return 0
+
+        with self._lock:
+            for entry in completions:
+                self._insert(entry)
+            self._db.commit()
+        os.replace(json_file, f"{json_file}.migrated")
+        print(f"Migrated {len(completions)} history entries from {json_file} to {self.db_file}")
+        return len(completions)
+
+    @staticmethod
+    def _row(entry):
+        model = entry.get("model")
+        return entry["timestamp"], entry["type"], str(entry["content"]), json.dumps(model) if model else None
+
+    @staticmethod
+    def _entry(row):
+        entry_id, timestamp, entry_type, content, model = row
+        entry = {"id": entry_id, "timestamp": timestamp, "type": entry_type, "content": content}
+        if model:
+            entry["model"] = json.loads(model)
+        return entry
+
+    def _insert(self, entry):
+        row = self._row(entry)
+        cursor = self._db.execute("INSERT INTO entries (timestamp, type, content, model) VALUES (?, ?, ?, ?)", row)
+        self._insert_buckets(cursor.lastrowid, row[2])
+        self._count(row, 1)
+        return cursor.lastrowid
+
+    def append(self, entry):
+        """
+        Appends an entry.
+
+        Parameters:
+        - entry (dict): "timestamp", "type", "content" and optionally "model".
+
+        Returns:
+        - int: ID of the new entry.
+        """
+        with self._lock:
+            # The entry, its buckets and the counters are committed together
+            entry_id = self._insert(entry)
+            self._db.commit()
+            return entry_id
+
+    def append_unique(self, entry, threshold=None):
+        """
+        Appends an entry, first deleting the oldest near-duplicate of it.
+
+        Looking up the duplicate, deleting it and appending the entry happen
+        under the lock in one transaction, so two near-duplicates added at the
+        same time cannot both be kept, and a crash never loses the duplicate
+        without its replacement.
+
+        Parameters:
+        - entry (dict): "timestamp", "type", "content" and optionally "model".
+        - threshold (float): SequenceMatcher ratio above which entries are
+          duplicates; defaults to the store's.
+
+        Returns:
+        - int: ID of the deleted duplicate, or None if there was none.
+        """
+        threshold = self.duplicate_threshold if threshold is None else threshold
+        content = str(entry["content"])
+        matcher = SequenceMatcher(None)
+        matcher.set_seq2(content)  # analysed once, compared with every candidate
+        with self._lock:
+            duplicate_id = None
+            for row in self._candidate_rows(content, threshold):
+                matcher.set_seq1(row[3])
+                # The quick ratios are upper bounds of ratio() and rule out most candidates cheaply
+                if matcher.real_quick_ratio() > threshold and matcher.quick_ratio() > threshold \
+                        and matcher.ratio() > threshold:
+                    duplicate_id = row[0]
+                    self._delete(duplicate_id)
+                    break
+            self._insert(entry)
+            self._db.commit()
+        return duplicate_id
+
+    def delete(self, entry_id):
+        """Deletes an entry by ID."""
+        with self._lock:
+            if self._delete(entry_id):
+                self._db.commit()
+
+    def _delete(self, entry_id):
+        """Deletes an entry, its buckets and its counts without committing; call with the lock held."""
+        row = self._db.execute(
+            "SELECT timestamp, type, content, model FROM entries WHERE id = ?", (entry_id,)
+        ).fetchone()
+        if row is None:
+            return False
+        self._db.execute("DELETE FROM entries WHERE id = ?", (entry_id,))
+        self._db.execute("DELETE FROM entry_buckets WHERE entry_id = ?", (entry_id,))
+        self._count(row, -1)
+        return True
+
+    def get(self, entry_id):
+        """Returns an entry by ID, or None."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT id, timestamp, type, content, model FROM entries WHERE id = ?", (entry_id,)
+            ).fetchone()
+        return self._entry(row) if row else None
+
+    def get_many(self, entry_ids):
+        """Returns entries by ID, in chronological order."""
+        entry_ids = [int(entry_id) for entry_id in entry_ids]
+        rows = []
+        with self._lock:
+            for start in range(0, len(entry_ids), _SQL_BATCH):
+                batch = entry_ids[start:start + _SQL_BATCH]
+                placeholders = ",".join("?" * len(batch))
+                rows.extend(self._db.execute(
+                    f"SELECT id, timestamp, type, content, model FROM entries WHERE id IN ({placeholders})", batch
+                ))
+        return [self._entry(row) for row in sorted(rows)]
+
+    def near_duplicate_candidates(self, text, threshold=None):
+        """
+        Returns the entries that may be near-duplicates of the text, in chronological order.
+
+        These are the entries sharing at least `min_matches` LSH buckets with
+        the text whose length allows a ratio above the threshold. Candidates
+        still have to be confirmed with an exact similarity check.
+
+        Parameters:
+        - text (str): The new text.
+        - threshold (float): Duplicate threshold; defaults to the store's. The
+          bands are sized for the store's threshold, so a lower one loses recall.
+        """
+        with self._lock:
+            return [self._entry(row) for row in self._candidate_rows(text, threshold)]
+
+    def _candidate_rows(self, text, threshold=None):
+        """Entry rows of the near-duplicate candidates, in chronological order. Call with the lock held."""
+        threshold = self.duplicate_threshold if threshold is None else threshold
+        min_length, max_length = length_bounds(len(text), threshold)
+        lsh = self._lsh_for(text)
+        buckets = lsh.band_buckets(text)  # fewer than _SQL_BATCH: bands are capped well below it
+        placeholders = ",".join("?" * len(buckets))
+        return self._db.execute(
+            "SELECT id, timestamp, type, content, model FROM entries WHERE id IN ("
+            f" SELECT entry_id FROM entry_buckets WHERE bucket IN ({placeholders})"
+            " GROUP BY entry_id HAVING COUNT(*) >= ?)"
+            " AND length(content) BETWEEN ? AND ? ORDER BY id",
+            [*buckets, lsh.min_matches, min_length, max_length],
+        ).fetchall()
+
+    def page(self, limit=50, before_id=None):
+        """
+        Returns the most recent entries, optionally older than a given ID.
+
+        Parameters:
+        - limit (int): Maximum number of entries.
+        - before_id (int): Only entries with a smaller ID (the cursor for the next page).
+
+        Returns:
+        - list: Entries in chronological order.
+        """
+        query = "SELECT id, timestamp, type, content, model FROM entries"
+        params = []
+        if before_id is not None:
+            query += " WHERE id < ?"
+            params.append(int(before_id))
+        query += " ORDER BY id DESC LIMIT ?"
+        params.append(int(limit))
+        with self._lock:
+            rows = self._db.execute(query, params).fetchall()
+        return [self._entry(row) for row in reversed(rows)]
+
+    def iter_entries(self, batch_size=1000):
+        """Yields all entries in chronological order, reading them in batches."""
+        last_id = 0
+        while True:
+            with self._lock:
+                rows = self._db.execute(
+                    "SELECT id, timestamp, type, content, model FROM entries WHERE id > ? ORDER BY id LIMIT ?",
+                    (last_id, batch_size),
+                ).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield self._entry(row)
+            last_id = rows[-1][0]
+
+    def counters(self, since_day=None):
+        """
+        Returns the word and entry counters, optionally from a given day on.
+
+        Parameters:
+        - since_day (str): ISO date (YYYY-MM-DD); earlier days are left out.
+
+        Returns:
+        - list: Dicts with "day", "type", "model" (model name, "" for user
+          entries), "entries" and "words".
+        """
+        query = "SELECT day, type, model, entries, words FROM content_stats WHERE entries > 0"
+        params = []
+        if since_day is not None:
+            query += " AND day >= ?"
+            params.append(since_day)
+        with self._lock:
+            rows = self._db.execute(query, params).fetchall()
+        return [dict(zip(("day", "type", "model", "entries", "words"), row)) for row in rows]
+
+    def count(self):
+        """Returns the number of entries."""
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
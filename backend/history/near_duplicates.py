@@ -0,0 +1,156 @@
+import hashlib
+import math
+import re
+
+import numpy as np
+
+# Mersenne prime for the universal hash family; inputs are reduced below it so
+# products stay within 64 bits
+_PRIME = (1 << 31) - 1
+
+# Below this length a text has few shingles and each edit breaks a large share
+# of them, so shorter texts are indexed with shorter shingles in separate bands
+SHORT_TEXT_CHARS = 400
+
+
+def _hash64(data):
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "little")
+
+
+def length_bounds(length, threshold):
+    """
+    Lengths a text can have and still reach a SequenceMatcher ratio above
+    `threshold` with a text of `length` characters. The ratio 2M / (a + b) is
+    at most 2 min(a, b) / (a + b), so this bound is exact: no match is lost.
+
+    Returns:
+    - tuple: (min_length, max_length), inclusive.
+    """
+    return math.floor(length * threshold / (2 - threshold)), math.ceil(length * (2 - threshold) / threshold)
+
+
+def min_jaccard(threshold, shingle_size):
+    """
+    Approximate lowest shingle Jaccard similarity of two texts whose
+    SequenceMatcher ratio is just above `threshold`: at most a (1 - threshold)
+    share of each text is unmatched and every unmatched character breaks up to
+    `shingle_size` shingles.
+    """
+    broken = shingle_size * (1 - threshold)
+    return max((1 - broken) / (1 + broken), 0.05)
+
+
+def _binomial_tail(trials, p, at_least):
+    """Probability of at least `at_least` successes in `trials` independent trials of probability p."""
+    below = sum(math.comb(trials, k) * p ** k * (1 - p) ** (trials - k) for k in range(min(at_least, trials + 1)))
+    return 1 - below
+
+
+class MinHashLSH:
+    def __init__(self, num_perm=128, bands=16, shingle_size=5, seed=1, min_matches=1):
+        """
+        MinHash signatures of character shingles, split into LSH bands.
+
+        Two texts are candidates when they share the bucket of at least
+        `min_matches` bands. With one band this happens with high probability
+        when the Jaccard similarity of their shingle sets is above roughly
+        (1 / bands) ** (1 / rows); requiring several bands makes the cut-off
+        sharper, so unrelated texts on the same topic are rarely candidates.
+        Band buckets are used to find candidates only; callers confirm them
+        with the exact similarity measure. Use `for_threshold` to size the
+        bands for a duplicate threshold.
+
+        Parameters:
+        - num_perm (int): Number of hash permutations in a signature.
+        - bands (int): Number of LSH bands; must divide num_perm.
+        - shingle_size (int): Characters per shingle.
+        - seed (int): Seed of the hash permutations; bucket values depend on it,
+          so indexes with different seeds can share a bucket table.
+        - min_matches (int): Bands two texts must share to be candidates.
+        """
+        if num_perm % bands:
+            raise ValueError("bands must divide num_perm")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        self.seed = seed
+        self.min_matches = min_matches
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, _PRIME, size=(num_perm, 1), dtype=np.uint64)
+        self._b = rng.integers(0, _PRIME, size=(num_perm, 1), dtype=np.uint64)
+
+    @classmethod
+    def for_threshold(cls, threshold, shingle_size=4, max_rows=3, min_matches=3, max_bands=128,
+                      target_recall=0.99, seed=1):
+        """
+        Sizes the bands so that texts with a SequenceMatcher ratio above
+        `threshold` share at least `min_matches` band buckets with probability
+        `target_recall`.
+
+        Uses the most rows per band and matches (fewest false candidates) that
+        need no more than `max_bands` bands; low thresholds fall back to fewer.
+
+        Parameters:
+        - threshold (float): SequenceMatcher ratio above which texts are duplicates.
+        - shingle_size (int): Characters per shingle.
+        - max_rows (int): Most rows per band to use.
+        - min_matches (int): Most shared bands to require.
+        - max_bands (int): Most bands to use, unless even the loosest setting needs more.
+        - target_recall (float): Wanted probability of a duplicate becoming a candidate.
+        - seed (int): Seed of the hash permutations.
+
+        Returns:
+        - MinHashLSH: Instance with num_perm = bands * rows.
+        """
+        similarity = min_jaccard(threshold, shingle_size)
+        for rows in range(max_rows, 0, -1):
+            for matches in range(min_matches, 0, -1):
+                p = similarity ** rows
+                if matches == 1:
+                    bands = max(1, math.ceil(math.log(1 - target_recall) / math.log(1 - p)))
+                else:
+                    bands = matches
+                    while bands <= max_bands and _binomial_tail(bands, p, matches) < target_recall:
+                        bands += 1
+                if bands <= max_bands:
+                    return cls(num_perm=bands * rows, bands=bands, shingle_size=shingle_size, seed=seed,
+                               min_matches=matches)
+        return cls(num_perm=bands, bands=bands, shingle_size=shingle_size, seed=seed)
+
+    @property
+    def params(self):
+        """Parameters that determine the bucket values and candidates, for storing next to them."""
+        return {"num_perm": self.num_perm, "bands": self.bands, "shingle_size": self.shingle_size,
+                "seed": self.seed, "min_matches": self.min_matches}
+
+    def shingles(self, text):
+        """Returns the set of character shingles of the normalised text."""
+        text = re.sub(r"\s+", " ", str(text).lower()).strip()
+        if len(text) <= self.shingle_size:
+            return {text}
+        return {text[i:i + self.shingle_size] for i in range(len(text) - self.shingle_size + 1)}
+
+    def signature(self, text):
+        """Returns the MinHash signature of a text as a uint64 array of length num_perm."""
+        hashes = np.fromiter(
+            (_hash64(shingle.encode("utf-8")) % _PRIME for shingle in self.shingles(text)), dtype=np.uint64
+        )
+        return ((self._a * hashes + self._b) % _PRIME).min(axis=1)
+
+    def band_buckets(self, text):
+        """
+        Returns one bucket key per band. The seed and band number are part of
+        the key, so keys of different bands or indexes never collide.
+
+        Returns:
+        - list: 63-bit ints (they fit an SQLite INTEGER).
+        """
+        signature = self.signature(text)
+        return [
+            _hash64(
+                self.seed.to_bytes(4, "little") + band.to_bytes(2, "little")
+                + signature[band * self.rows:(band + 1) * self.rows].tobytes()
+            ) >> 1
+            for band in range(self.bands)
+        ]
@@ -1,3 +1,5 @@
+import threading
+
 from utils.model_loader import load_model
 from utils.user_settings import load_settings
 
@@ -9,23 +11,172 @@ def get_model():
         get_model._model = load_model(settings["model_path"])
     return get_model._model
 
+def build_prompt_prefix(system_prompt="", project_title=None, section=None):
+    """
+    Builds the part of every prompt that only changes with the settings or the project.
+
+    Parameters:
+    - system_prompt (str): System prompt from the user settings.
+    - project_title (str): Title of the current project.
+    - section (str): Section of the paper being written.
+
+    Returns:
+    - str: The shared prompt prefix, ending with a newline.
+    """
+    lines = [system_prompt.strip()] if system_prompt and system_prompt.strip() else []
+    if project_title is not None:
+        lines.append(f"Project: {project_title}")
+    if section is not None:
+        lines.append(f"Section: {section}")
+    return "\n".join(lines) + "\n" if lines else ""
+
+
+class GenerationEngine:
+    def __init__(self, model, prefix=""):
+        """
+        Runs completions on a llama.cpp model whose prompts all start with the
+        same prefix (system prompt and project header).
+
+        The prefix is evaluated once and the model state after it (KV cache
+        included) is saved. Each completion restores that state if another
+        prompt has replaced it and only evaluates its own suffix, which is most
+        of the time to first token. Changing the prefix or the model drops the
+        saved state.
+
+        Parameters:
+        - model (Llama): Loaded llama.cpp model, or None.
+        - prefix (str): Shared prompt prefix, see `build_prompt_prefix`.
+        """
+        self.model = model
+        self.prefix = prefix
+        self._prefix_tokens = None
+        self._prefix_state = None
+        self._lock = threading.Lock()
+        self.last_stats = {}
+
+    def set_model(self, model):
+        """Switches to another model, invalidating the cached prefix state."""
+        with self._lock:
+            self.model = model
+            self._invalidate()
+
+    def set_prefix(self, prefix):
+        """Changes the shared prompt prefix; the cached state is dropped if it differs."""
+        with self._lock:
+            if prefix != self.prefix:
+                self.prefix = prefix
+                self._invalidate()
+
+    def _invalidate(self):
+        self._prefix_tokens = None
+        self._prefix_state = None
+
+    def _evaluated_tokens(self):
+        """Tokens currently held in the model's KV cache."""
+        return list(self.model.input_ids[:self.model.n_tokens])
+
+    def _restore_prefix(self):
+        """
+        Makes sure the model's KV cache starts with the prefix.
+
+        Returns:
+        - bool: True if the saved or still-loaded prefix state was reused.
+        """
+        if self._prefix_tokens is None:
+            self._prefix_tokens = self.model.tokenize(self.prefix.encode("utf-8"), add_bos=True)
+
+        n_prefix = len(self._prefix_tokens)
+        if self._evaluated_tokens()[:n_prefix] == self._prefix_tokens:
+            return self._prefix_state is not None
+        if self._prefix_state is not None:
+            self.model.load_state(self._prefix_state)
+            return True
+
+        self.model.reset()
+        self.model.eval(self._prefix_tokens)
+        self._prefix_state = self.model.save_state()
+        return False
+
+    def _prompt_tokens(self, suffix):
+        """Restores the prefix state and returns the full prompt as tokens; call with the lock held."""
+        if self.model is None:
+            raise RuntimeError("Model not loaded. Please select a model.")
+
+        reused = self._restore_prefix()
+        suffix_tokens = self.model.tokenize(suffix.encode("utf-8"), add_bos=False)
+        self.last_stats = {
+            "prefix_tokens": len(self._prefix_tokens),
+            "suffix_tokens": len(suffix_tokens),
+            "prefix_reused": reused,
+        }
+        # llama.cpp skips the tokens already in its KV cache, i.e. the prefix
+        return self._prefix_tokens + suffix_tokens
+
+    def generate(self, suffix, max_tokens=500, temperature=0.3, **kwargs):
+        """
+        Completes `prefix + suffix`, evaluating only the suffix when the prefix state is cached.
+
+        Parameters:
+        - suffix (str): The request-specific part of the prompt.
+        - max_tokens (int): Maximum number of tokens to generate.
+        - temperature (float): Sampling temperature.
+        - kwargs: Further options for `Llama.create_completion`.
+
+        Returns:
+        - str: The generated text.
+        """
+        with self._lock:
+            prompt_tokens = self._prompt_tokens(suffix)
+            response = self.model.create_completion(
+                prompt_tokens,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                echo=False,
+                stream=False,
+                **kwargs
+            )
+            return response['choices'][0]['text'].strip()
+
+    def stream(self, suffix, max_tokens=500, temperature=0.3, **kwargs):
+        """
+        Like `generate`, but yields text pieces as llama.cpp produces them.
+
+        Closing the generator (e.g. when the client disconnects) stops
+        generation at the next token and frees the engine for other requests.
+
+        Yields:
+        - str: Generated text pieces.
+        """
+        with self._lock:
+            prompt_tokens = self._prompt_tokens(suffix)
+            chunks = self.model.create_completion(
+                prompt_tokens,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                echo=False,
+                stream=True,
+                **kwargs
+            )
+            try:
+                for chunk in chunks:
+                    yield chunk['choices'][0]['text']
+            finally:
+                chunks.close()
+
+
+def get_engine():
+    """Lazily creates the shared generation engine with the system prompt as its prefix"""
+    if not hasattr(get_engine, "_engine"):
+        settings = load_settings()
+        get_engine._engine = GenerationEngine(get_model(), build_prompt_prefix(settings.get("system_prompt", "")))
+    return get_engine._engine
+
 def generate_response(prompt):
-    # settings = load_settings()
-    # model = load_model(settings["model_path"])
     try:
-        model = get_model()
-        if model is None:
+        engine = get_engine()
+        if engine.model is None:
             return "Model not loaded. Please select a model."
-        settings = load_settings()
-        system_prompt = settings.get("system_prompt", "")
-        full_prompt = f"{system_prompt}\n\n{prompt}"
-
-
-        response = model(full_prompt,
-                         max_tokens=500,
-                         temperature=0.3,
-                         echo=False,
-                         stream=False)
-        return response['choices'][0]['text'].strip()
+        engine.set_prefix(build_prompt_prefix(load_settings().get("system_prompt", "")))
+        return engine.generate(prompt, max_tokens=500, temperature=0.3)
     except Exception as e:
         return f"Error generating response: {str(e)}"
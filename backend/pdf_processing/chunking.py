@@ -1,26 +1,182 @@
+import re
+from collections import deque
 
-def chunk_text(text, chunk_size=500):
+PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+_token_counters = {}
+
+
+def count_words(text):
+    """Fallback token counter: whitespace-separated words."""
+    return len(text.split())
+
+
+def make_token_counter(model_name):
     """
-    Splits the input text into chunks of a given size.
+    Builds a token counter backed by the tokenizer of an embedding model, so
+    chunk limits match what the embedder will actually see.
+
+    Counters are cached per process. If `transformers` or the tokenizer are
+    unavailable, whitespace word counting is used instead.
 
     Parameters:
-    - text (str): Text to be chunked.
-    - chunk_size (int): Maximum number of characters per chunk.
+    - model_name (str): SentenceTransformer model name (e.g. "all-MiniLM-L6-v2").
 
     Returns:
-    - list: List of text chunks.
+    - callable: Function mapping a string to its token count.
+    """
+    if model_name in _token_counters:
+        return _token_counters[model_name]
+
+    try:
+        from transformers import AutoTokenizer
+
+        repo_id = model_name if "/" in model_name else f"sentence-transformers/{model_name}"
+        tokenizer = AutoTokenizer.from_pretrained(repo_id)
+
+        def count_tokens(text):
+            return len(tokenizer(text, add_special_tokens=False)["input_ids"])
+    except Exception as e:
+        print(f"Could not load tokenizer for {model_name}, counting words instead: {e}")
+        count_tokens = count_words
+
+    _token_counters[model_name] = count_tokens
+    return count_tokens
+
+
+def split_units(text, boundary="sentence"):
+    """
+    Splits text into the smallest units a chunk may not break.
+
+    Parameters:
+    - text (str): Text to split.
+    - boundary (str): "paragraph", "sentence" or "word".
+
+    Returns:
+    - list: Non-empty units with whitespace normalised.
+    """
+    if boundary == "word":
+        return text.split()
+
+    units = []
+    for paragraph in PARAGRAPH_BREAK.split(text):
+        if boundary == "paragraph":
+            pieces = [paragraph]
+        else:
+            pieces = SENTENCE_END.split(paragraph)
+        for piece in pieces:
+            piece = " ".join(piece.split())
+            if piece:
+                units.append(piece)
+    return units
+
+
+def iter_chunks(pages, max_tokens=256, overlap=32, boundary="sentence", count_tokens=None):
+    """
+    Streams boundary-aware, token-limited chunks with overlap from a stream of pages.
+
+    Every unit (sentence, paragraph or word) is tokenized exactly once and
+    enters and leaves the sliding window once, so the cost is linear in the
+    input. Units longer than `max_tokens` are split on words.
+
+    Parameters:
+    - pages (iterable): (page_number, text) pairs, e.g. from `iter_pdf_pages`.
+    - max_tokens (int): Maximum number of tokens per chunk.
+    - overlap (int): Number of tokens carried over from the end of the previous chunk.
+    - boundary (str): "paragraph", "sentence" or "word".
+    - count_tokens (callable): Token counter, e.g. from `make_token_counter`;
+      defaults to counting words.
+
+    Yields:
+    - dict: {"text": str, "page_start": int, "page_end": int, "tokens": int}
+    """
+    count_tokens = count_tokens or count_words
+    overlap = max(0, min(overlap, max_tokens - 1))
+    window = deque()  # (unit, page_number, tokens)
+    window_tokens = 0
+    emitted_new = False  # whether the window holds anything not yet emitted
+
+    def emit():
+        return {
+            "text": " ".join(unit for unit, _, _ in window),
+            "page_start": window[0][1],
+            "page_end": window[-1][1],
+            "tokens": window_tokens,
+        }
+
+    def units_of(text, page_number):
+        for unit in split_units(text, boundary):
+            tokens = count_tokens(unit)
+            if tokens <= max_tokens or boundary == "word":
+                yield unit, page_number, tokens
+            else:
+                for word in unit.split():
+                    yield word, page_number, count_tokens(word)
+
+    for page_number, text in pages:
+        for unit, page, tokens in units_of(text, page_number):
+            if window and window_tokens + tokens > max_tokens:
+                if emitted_new:
+                    yield emit()
+                    emitted_new = False
+                # Keep only the tail that fits in the overlap and leaves room for the new unit
+                while window and (window_tokens > overlap or window_tokens + tokens > max_tokens):
+                    window_tokens -= window.popleft()[2]
+
+            window.append((unit, page, tokens))
+            window_tokens += tokens
+            emitted_new = True
+
+    if window and emitted_new:
+        yield emit()
+
+
+def iter_page_chunks(pages, chunk_size=500):
+    """
+    Splits a stream of pages into chunks of a given size, keeping track of the
+    pages each chunk spans.
+
+    Pages are consumed lazily, so only the page being split is held in memory.
+
+    Parameters:
+    - pages (iterable): (page_number, text) pairs, e.g. from `iter_pdf_pages`.
+    - chunk_size (int): Maximum number of characters per chunk.
+
+    Yields:
+    - dict: {"text": str, "page_start": int, "page_end": int}
     """
-    words = text.split()
-    chunks = []
     current_chunk = []
+    current_length = 0
+    page_start = page_end = None
 
-    for word in words:
-        if sum(len(w) for w in current_chunk) + len(word) + len(current_chunk) <= chunk_size:
+    for page_number, text in pages:
+        for word in text.split():
+            # Running length plus one separating space per word already in the chunk
+            if current_chunk and current_length + len(current_chunk) + len(word) > chunk_size:
+                yield {"text": " ".join(current_chunk), "page_start": page_start, "page_end": page_end}
+                current_chunk = []
+                current_length = 0
+
+            if not current_chunk:
+                page_start = page_number
             current_chunk.append(word)
-        else:
-            chunks.append(" ".join(current_chunk))
-            current_chunk = [word]
+            current_length += len(word)
+            page_end = page_number
 
     if current_chunk:
-        chunks.append(" ".join(current_chunk))
-    return chunks
+        yield {"text": " ".join(current_chunk), "page_start": page_start, "page_end": page_end}
+
+
+def chunk_text(text, chunk_size=500):
+    """
+    Splits the input text into chunks of a given size.
+
+    Parameters:
+    - text (str): Text to be chunked.
+    - chunk_size (int): Maximum number of characters per chunk.
+
+    Returns:
+    - list: List of text chunks.
+    """
+    return [chunk["text"] for chunk in iter_page_chunks([(1, text)], chunk_size)]
@@ -0,0 +1,340 @@
+import hashlib
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from rag.chunk_store import ChunkStore
+from utils.constants import EMBEDDING_MODEL_NAME, INGESTION_MANIFEST_FILE, KNOWLEDGE_BASE_FILE
+
+from .chunking import iter_chunks, make_token_counter
+from .metadata import get_pdf_info, get_pdf_title
+from .pdf_extractor import iter_pdf_pages
+
+MANIFEST_VERSION = 1
+
+DEFAULT_CHUNK_OPTIONS = {
+    "max_tokens": 256,
+    "overlap": 32,
+    "boundary": "sentence",
+    "model_name": EMBEDDING_MODEL_NAME,
+}
+
+
+def chunk_options_from_settings(settings):
+    """
+    Builds chunking options from user settings, falling back to the defaults.
+
+    Parameters:
+    - settings (dict): User settings.
+
+    Returns:
+    - dict: Options accepted by `process_pdf`.
+    """
+    return {
+        "max_tokens": settings.get("chunk_max_tokens") or DEFAULT_CHUNK_OPTIONS["max_tokens"],
+        "overlap": settings.get("chunk_overlap", DEFAULT_CHUNK_OPTIONS["overlap"]),
+        "boundary": settings.get("chunk_boundary") or DEFAULT_CHUNK_OPTIONS["boundary"],
+        "model_name": DEFAULT_CHUNK_OPTIONS["model_name"],
+    }
+
+
+def load_manifest(manifest_file=INGESTION_MANIFEST_FILE):
+    """
+    Loads the ingestion manifest, returning an empty one if it is missing or unreadable.
+
+    Parameters:
+    - manifest_file (str): Path to the manifest JSON file.
+
+    Returns:
+    - dict: Manifest with a "files" mapping of PDF path -> fingerprint.
+    """
+    try:
+        with open(manifest_file, "r") as f:
+            manifest = json.load(f)
+        if manifest.get("version") == MANIFEST_VERSION:
+            return manifest
+    except (json.JSONDecodeError, FileNotFoundError):
+        pass
+    return {"version": MANIFEST_VERSION, "files": {}}
+
+
+def save_manifest(manifest, manifest_file=INGESTION_MANIFEST_FILE):
+    """
+    Saves the ingestion manifest.
+
+    Parameters:
+    - manifest (dict): Manifest to save.
+    - manifest_file (str): Path to the manifest JSON file.
+    """
+    with open(manifest_file, "w") as f:
+        json.dump(manifest, f, indent=4)
+
+
+def hash_file(file_path, block_size=1 << 20):
+    """
+    Computes the SHA-256 of a file's contents.
+
+    Parameters:
+    - file_path (str): Path to the file.
+    - block_size (int): Number of bytes read per iteration.
+
+    Returns:
+    - str: Hex digest of the file contents.
+    """
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def list_pdfs(directory):
+    """
+    Lists the PDF files directly inside a directory.
+
+    Parameters:
+    - directory (str): Directory to scan.
+
+    Returns:
+    - list: Absolute paths of the PDF files, sorted.
+    """
+    directory = os.path.abspath(directory)
+    return sorted(
+        os.path.join(directory, f)
+        for f in os.listdir(directory)
+        if f.endswith(".pdf")
+    )
+
+
+def plan_ingestion(pdf_paths, manifest):
+    """
+    Compares PDFs on disk with the manifest.
+
+    Size and mtime are checked first; the content hash is only computed when
+    they differ, so touching a file without changing it does not trigger
+    re-processing.
+
+    Parameters:
+    - pdf_paths (list): PDF paths currently on disk.
+    - manifest (dict): Previously saved manifest.
+
+    Returns:
+    - tuple: (to_process, unchanged, removed) where to_process maps path ->
+      fresh fingerprint, unchanged is a list of paths and removed a list of
+      paths that are in the manifest but no longer on disk.
+    """
+    known = manifest["files"]
+    to_process = {}
+    unchanged = []
+
+    for path in pdf_paths:
+        stat = os.stat(path)
+        entry = known.get(path)
+        if entry and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime:
+            unchanged.append(path)
+            continue
+
+        content_hash = hash_file(path)
+        if entry and entry["sha256"] == content_hash:
+            # Only the timestamp moved; refresh it so the hash is skipped next time
+            entry["mtime"] = stat.st_mtime
+            unchanged.append(path)
+            continue
+
+        to_process[path] = {
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+            "sha256": content_hash,
+        }
+
+    on_disk = set(pdf_paths)
+    removed = [path for path in known if path not in on_disk]
+    return to_process, unchanged, removed
+
+
+def process_pdf(pdf_path, chunk_options=None):
+    """
+    Extracts, chunks and titles a single PDF, timing each stage.
+
+    This runs inside pool workers, so it must stay a picklable module-level
+    function that only returns plain data.
+
+    Parameters:
+    - pdf_path (str): Path to the PDF file.
+    - chunk_options (dict): max_tokens, overlap, boundary and model_name for
+      `iter_chunks`; defaults to DEFAULT_CHUNK_OPTIONS.
+
+    Returns:
+    - dict: "path", "title", "info" (authors and year from the document
+      info), "chunks" ({"text", "pages"} dicts with the first and last page
+      of each chunk) and per-stage "timings" in seconds.
+    """
+    options = dict(DEFAULT_CHUNK_OPTIONS, **(chunk_options or {}))
+    count_tokens = make_token_counter(options.pop("model_name"))
+
+    start = time.perf_counter()
+    # Pages are extracted and chunked as one stream, so the two stages are timed together
+    chunks = [
+        {"text": chunk["text"], "pages": [chunk["page_start"], chunk["page_end"]]}
+        for chunk in iter_chunks(iter_pdf_pages(pdf_path), count_tokens=count_tokens, **options)
+    ]
+    chunked = time.perf_counter()
+    title = get_pdf_title(pdf_path)
+    info = get_pdf_info(pdf_path)
+    done = time.perf_counter()
+
+    return {
+        "path": pdf_path,
+        "title": title,
+        "info": info,
+        "chunks": chunks,
+        "timings": {
+            "extract_and_chunk": round(chunked - start, 3),
+            "title": round(done - chunked, 3),
+            "total": round(done - start, 3),
+        },
+    }
+
+
+def resolve_worker_count(workers=None):
+    """
+    Resolves the number of ingestion workers.
+
+    Parameters:
+    - workers (int): Requested worker count; None or 0 means one per CPU core.
+
+    Returns:
+    - int: Number of worker processes to use.
+    """
+    if not workers:
+        workers = os.cpu_count() or 1
+    return max(1, int(workers))
+
+
+def iter_processed_pdfs(pdf_paths, workers=None, chunk_options=None):
+    """
+    Processes PDFs concurrently in a process pool, yielding each result as soon
+    as it is finished (not in submission order).
+
+    PDFs that fail to process are reported and skipped.
+
+    Parameters:
+    - pdf_paths (list): PDF paths to process.
+    - workers (int): Number of worker processes; None means one per CPU core.
+    - chunk_options (dict): Options forwarded to `process_pdf`.
+
+    Yields:
+    - dict: Result of `process_pdf` for each PDF.
+    """
+    pdf_paths = list(pdf_paths)
+    workers = min(resolve_worker_count(workers), len(pdf_paths) or 1)
+
+    if workers == 1:
+        # Not worth the process start-up cost
+        for path in pdf_paths:
+            try:
+                yield process_pdf(path, chunk_options)
+            except Exception as e:
+                print(f"Error processing {path}: {e}")
+        return
+
+    # Workers are spawned rather than forked: ingestion runs on a request thread
+    # of a process that already holds torch, tokenizer and llama.cpp threads,
+    # and forking it can deadlock on locks held by those threads
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+        futures = {executor.submit(process_pdf, path, chunk_options): path for path in pdf_paths}
+        for future in as_completed(futures):
+            try:
+                yield future.result()
+            except Exception as e:
+                print(f"Error processing {futures[future]}: {e}")
+
+
+def ingest_directory(directory, store=None, manifest_file=INGESTION_MANIFEST_FILE,
+                     workers=None, on_document=None, chunk_options=None):
+    """
+    Incrementally ingests the PDFs of a directory into the knowledge base.
+
+    Unchanged PDFs are skipped, new and modified ones are re-processed in a
+    process pool and PDFs that disappeared since the last run are dropped from
+    the chunk store. Only the affected documents' rows are written; entries
+    that did not come from a PDF (e.g. online sources) are kept.
+
+    Parameters:
+    - directory (str): Directory containing the PDFs.
+    - store (ChunkStore): Chunk store to write to; defaults to the shared one,
+      with the legacy knowledge base JSON migrated into it.
+    - manifest_file (str): Path to the ingestion manifest.
+    - workers (int): Number of worker processes; None means one per CPU core.
+    - on_document (callable): Called as on_document(title, chunks, previous_title)
+      for every processed PDF as soon as it is ready, so it can be indexed while
+      the rest are still being extracted. A truthy return marks it as indexed
+      and means the callback has written it to the store itself.
+    - chunk_options (dict): Options forwarded to `process_pdf`.
+
+    Returns:
+    - dict: Summary with "added", "updated", "removed", "unchanged" and
+      "indexed" title lists, "removed_ids" (ids of chunks deleted from the
+      store), "documents" (title -> chunks for processed PDFs), per-file
+      "timings", "pdf_info" and the "batch" label given to this run's chunks.
+    """
+    started = time.perf_counter()
+    # Chunks carry the batch they were ingested in so searches can filter on it
+    batch = time.strftime("%Y%m%d-%H%M%S")
+    manifest = load_manifest(manifest_file)
+    if store is None:
+        store = ChunkStore()
+        store.migrate_from_json(KNOWLEDGE_BASE_FILE)
+    to_process, unchanged, removed_paths = plan_ingestion(list_pdfs(directory), manifest)
+
+    changes = {
+        "added": [], "updated": [], "removed": [], "unchanged": [], "indexed": [], "removed_ids": [],
+        "documents": {}, "timings": {}, "batch": batch,
+    }
+
+    for path in removed_paths:
+        title = manifest["files"].pop(path)["title"]
+        changes["removed_ids"].extend(store.remove_documents([title]))
+        changes["removed"].append(title)
+
+    for result in iter_processed_pdfs(to_process, workers, chunk_options):
+        path, title, chunks = result["path"], result["title"], result["chunks"]
+        document_metadata = dict(result["info"], source="pdf", batch=batch)
+        for chunk in chunks:
+            chunk["metadata"] = document_metadata
+        previous = manifest["files"].get(path)
+        previous_title = previous["title"] if previous else None
+
+        changes["documents"][title] = chunks
+        changes["timings"][title] = result["timings"]
+        changes["updated" if previous else "added"].append(title)
+        if previous and previous_title != title:
+            changes["removed"].append(previous_title)
+
+        fingerprint = to_process[path]
+        fingerprint.update({"title": title, "chunks": len(chunks)})
+        manifest["files"][path] = fingerprint
+        print(f"Processed {os.path.basename(path)} in {result['timings']['total']}s {result['timings']}")
+
+        if on_document and on_document(title, chunks, previous_title):
+            changes["indexed"].append(title)
+        else:
+            changes["removed_ids"].extend(store.remove_documents({title, previous_title} - {None}))
+            store.add_document(title, chunks)
+
+    changes["unchanged"] = [manifest["files"][path]["title"] for path in unchanged]
+    changes["pdf_info"] = {
+        entry["title"]: {"chunks": entry["chunks"], "file_path": path}
+        for path, entry in manifest["files"].items()
+    }
+
+    save_manifest(manifest, manifest_file)
+
+    print(
+        f"Ingestion: {len(changes['added'])} added, {len(changes['updated'])} updated, "
+        f"{len(changes['removed'])} removed, {len(unchanged)} unchanged "
+        f"in {time.perf_counter() - started:.2f}s"
+    )
+    return changes
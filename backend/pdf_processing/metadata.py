@@ -1,6 +1,8 @@
 import json
 import os
+import re
 
+import pdfplumber
 from pdftitle import get_title_from_file
 from utils.constants import KNOWLEDGE_BASE_FILE
 
@@ -20,6 +22,32 @@ def get_pdf_title(file_path):
     except Exception:
         return os.path.basename(file_path)
 
+def get_pdf_info(file_path):
+    """
+    Reads the author(s) and publication year from a PDF's document info.
+
+    Parameters:
+    - file_path (str): Path to the PDF file.
+
+    Returns:
+    - dict: "authors" (list of names) and "year" (str), each only if present.
+    """
+    try:
+        with pdfplumber.open(file_path) as pdf:
+            info = pdf.metadata or {}
+    except Exception:
+        return {}
+
+    details = {}
+    author = str(info.get("Author") or "").strip()
+    if author:
+        details["authors"] = [name.strip() for name in re.split(r";|,| and ", author) if name.strip()]
+    # PDF dates look like "D:20210314120000+01'00'"
+    year = re.search(r"(19|20)\d{2}", str(info.get("CreationDate") or ""))
+    if year:
+        details["year"] = year.group()
+    return details
+
 def save_knowledge_base(data, output_file=KNOWLEDGE_BASE_FILE):
     """
     Saves extracted and chunked PDF data to a JSON file.
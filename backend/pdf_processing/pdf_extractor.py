@@ -2,8 +2,6 @@ import os
 
 import pdfplumber
 
-from .chunking import chunk_text
-
 
 def extract_pdfs_from_directory(directory):
     """
@@ -27,6 +25,27 @@ def extract_pdfs_from_directory(directory):
     return pdf_files
 
 
+def iter_pdf_pages(file_path):
+    """
+    Yields the text of a PDF one page at a time.
+
+    Each page's parsed objects are released as soon as its text has been
+    extracted, so memory stays bounded on very long documents.
+
+    Parameters:
+    - file_path (str): Path to the PDF file.
+
+    Yields:
+    - tuple: (page_number, text) with 1-based page numbers.
+    """
+    with pdfplumber.open(file_path) as pdf:
+        for page in pdf.pages:
+            text = page.extract_text() or ""
+            page_number = page.page_number
+            page.close()
+            yield page_number, text
+
+
 def extract_text_from_pdf(file_path):
     """
     Extracts text from a PDF file.
@@ -37,8 +56,4 @@ def extract_text_from_pdf(file_path):
     Returns:
     - str: Extracted text from the PDF.
     """
-    with pdfplumber.open(file_path) as pdf:
-        text = ""
-        for page in pdf.pages:
-            text += page.extract_text()
-        return text
+    return "\n".join(text for _, text in iter_pdf_pages(file_path))
@@ -0,0 +1,302 @@
+import os
+import threading
+
+import numpy as np
+import scipy.sparse as sp
+from sklearn.feature_extraction.text import HashingVectorizer
+
+# Dead rows above this fraction are compacted away by the next merge
+MAX_DEAD_RATIO = 0.3
+# Blocks added since the last merge are scored one by one; they are merged
+# into the main matrix once there are this many of them...
+MAX_PENDING_BLOCKS = 16
+# ...or once they hold this fraction of the main matrix's rows
+MAX_PENDING_RATIO = 0.1
+
+
+def reciprocal_rank_fusion(result_lists, k=60):
+    """
+    Fuses ranked lists of chunk ids with reciprocal-rank fusion.
+
+    Parameters:
+    - result_lists (list): Lists of chunk ids, each ordered best first.
+    - k (int): RRF damping constant.
+
+    Returns:
+    - list: (chunk_id, fused_score) pairs, best first.
+    """
+    scores = {}
+    for results in result_lists:
+        for rank, chunk_id in enumerate(results):
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+class BM25Index:
+    def __init__(self, k1=1.5, b=0.75, n_features=2 ** 20):
+        """
+        Incremental BM25 inverted index over chunk texts.
+
+        Texts are tokenized with a stateless HashingVectorizer, so new chunks
+        can be appended without refitting a vocabulary. Term frequencies are
+        kept as sparse docs x terms matrices; queries read only the columns
+        (posting lists) of their own terms. Each `add` appends a small block
+        that is scored on its own until a background merge folds the blocks
+        into the main matrix and compacts removed chunks away. Document
+        frequencies and lengths are updated by every add and remove, so
+        writes never make a query rebuild the index.
+
+        The index is shared by request threads: mutations run under a lock,
+        searches score against a snapshot taken under that lock, and merges
+        build the new matrices outside it.
+
+        Parameters:
+        - k1 (float): BM25 term-frequency saturation.
+        - b (float): BM25 length normalisation.
+        - n_features (int): Size of the hashed vocabulary.
+        """
+        self.k1 = k1
+        self.b = b
+        self.vectorizer = HashingVectorizer(
+            n_features=n_features,
+            alternate_sign=False,
+            norm=None,
+            stop_words="english",
+            # Keep short tokens such as acronyms and variable names
+            token_pattern=r"(?u)\b\w+\b",
+        )
+        self._matrix = sp.csr_matrix((0, n_features), dtype="float32")
+        self._postings = self._matrix.tocsc()  # CSC copy of the matrix for column access
+        self._pending = []  # (first row, CSR block, CSC block) per add since the last merge
+        self._df = np.zeros(n_features, dtype="int64")  # live chunks per term
+        self._doc_len = np.empty(0, dtype="float32")
+        self._total_len = 0.0  # summed length of the live chunks
+        self._ids = np.empty(0, dtype="int64")
+        self._alive = np.empty(0, dtype=bool)
+        self._rows = {}  # chunk id -> row
+        self._merging = False
+        self._lock = threading.RLock()
+        self._save_lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return int(self._alive.sum())
+
+    def ids(self):
+        """Returns the chunk ids currently indexed."""
+        with self._lock:
+            return self._ids[self._alive]
+
+    def add(self, chunk_ids, texts):
+        """
+        Indexes chunks; chunks that are already indexed are replaced.
+
+        Parameters:
+        - chunk_ids (list): Chunk ids.
+        - texts (list): Chunk texts, in the same order.
+        """
+        if len(chunk_ids) == 0:
+            return
+        block = self.vectorizer.transform(texts).astype("float32").tocsr()
+        lengths = np.asarray(block.sum(axis=1), dtype="float32").ravel()
+        # A row lists each of its terms once, so this counts chunks per term
+        df = np.bincount(block.indices, minlength=block.shape[1])
+
+        with self._lock:
+            self.remove(chunk_ids)
+            start = len(self._ids)
+            self._pending.append((start, block, block.tocsc()))
+            self._ids = np.concatenate([self._ids, np.asarray(chunk_ids, dtype="int64")])
+            self._alive = np.concatenate([self._alive, np.ones(len(chunk_ids), dtype=bool)])
+            self._doc_len = np.concatenate([self._doc_len, lengths])
+            self._df += df
+            self._total_len += float(lengths.sum())
+            for offset, chunk_id in enumerate(chunk_ids):
+                self._rows[int(chunk_id)] = start + offset
+            self._schedule_merge()
+
+    def remove(self, chunk_ids):
+        """Removes chunks by id; unknown ids are ignored."""
+        with self._lock:
+            rows = [self._rows.pop(int(chunk_id)) for chunk_id in chunk_ids if int(chunk_id) in self._rows]
+            if not rows:
+                return
+            rows = np.array(rows, dtype="int64")
+            self._alive[rows] = False
+            self._df -= np.bincount(self._row_terms(rows), minlength=len(self._df))
+            self._total_len -= float(self._doc_len[rows].sum())
+            self._schedule_merge()
+
+    def _row_terms(self, rows):
+        """Returns the terms of the given rows, once per row they occur in; call with the lock held."""
+        parts = [self._matrix[rows[rows < self._matrix.shape[0]]].indices]
+        for start, block, _ in self._pending:
+            local = rows[(rows >= start) & (rows < start + block.shape[0])] - start
+            if len(local):
+                parts.append(block[local].indices)
+        return np.concatenate(parts)
+
+    def _needs_merge(self):
+        """Whether there are enough pending blocks or dead rows to merge; call with the lock held."""
+        merged_rows = self._matrix.shape[0]
+        return (
+            len(self._pending) >= MAX_PENDING_BLOCKS
+            or len(self._ids) - merged_rows > MAX_PENDING_RATIO * merged_rows
+            or (~self._alive).sum() > MAX_DEAD_RATIO * len(self._alive)
+        )
+
+    def _schedule_merge(self):
+        """Starts a background merge if one is due and none is running; call with the lock held."""
+        if not self._merging and self._needs_merge():
+            self._merging = True
+            threading.Thread(target=self._merge_in_background, name="bm25-merge", daemon=True).start()
+
+    def _merge_in_background(self):
+        try:
+            while True:
+                self.merge()
+                with self._lock:
+                    if not self._needs_merge():
+                        self._merging = False
+                        return
+        except Exception as e:
+            print(f"Error merging the BM25 index: {e}")
+            with self._lock:
+                self._merging = False
+
+    def merge(self):
+        """
+        Merges the pending blocks into the main matrix and, if enough chunks
+        were removed, compacts their rows away.
+
+        The new matrices are built from a snapshot outside the lock, so
+        searches and writes go on meanwhile; writes made during the merge are
+        carried over when the result is swapped in.
+        """
+        with self._lock:
+            base, pending = self._matrix, list(self._pending)
+            ids, alive, doc_len = self._ids, self._alive.copy(), self._doc_len
+        rows = len(ids)
+        compact = (~alive).sum() > MAX_DEAD_RATIO * len(alive)
+        if not pending and not compact:
+            return
+        matrix = sp.vstack([base, *(block for _, block, _ in pending)], format="csr")
+
+        keep = None
+        if compact:
+            keep = np.flatnonzero(alive)
+            matrix, ids, doc_len = matrix[keep], ids[keep], doc_len[keep]
+            row_of = {int(chunk_id): row for row, chunk_id in enumerate(ids)}
+        postings = matrix.tocsc()
+
+        with self._lock:
+            if self._matrix is not base:
+                return  # replaced by load() or another merge meanwhile
+            self._pending = self._pending[len(pending):]
+            if keep is not None:
+                # Chunks removed during the merge are dead in the compacted rows too
+                alive = self._alive[keep]
+                for row in np.flatnonzero(~alive):
+                    del row_of[int(ids[row])]
+                # Chunks added during the merge move up by the removed rows
+                added_ids, added_alive = self._ids[rows:], self._alive[rows:]
+                for offset in np.flatnonzero(added_alive):
+                    row_of[int(added_ids[offset])] = len(keep) + offset
+                shift = rows - len(keep)
+                self._pending = [(start - shift, block, columns) for start, block, columns in self._pending]
+                self._ids = np.concatenate([ids, added_ids])
+                self._alive = np.concatenate([alive, added_alive])
+                self._doc_len = np.concatenate([doc_len, self._doc_len[rows:]])
+                self._rows = row_of
+            self._matrix, self._postings = matrix, postings
+
+    def search(self, query, top_k=10, allowed_ids=None):
+        """
+        Scores indexed chunks against a query with BM25.
+
+        Parameters:
+        - query (str): Query text.
+        - top_k (int): Number of results.
+        - allowed_ids (np.ndarray): Only these chunk ids may be returned; None for all.
+
+        Returns:
+        - list: (chunk_id, score) pairs, best first; chunks without any query term are omitted.
+        """
+        terms = np.unique(self.vectorizer.transform([query]).indices)
+        with self._lock:
+            # Later writes replace these arrays rather than modify them, except
+            # for the alive mask, which is copied
+            ids, doc_len, alive = self._ids, self._doc_len, self._alive.copy()
+            postings = [(0, self._postings)] + [(start, columns) for start, _, columns in self._pending]
+            df = self._df[terms]
+            n_docs = max(len(self._rows), 1)
+            avg_len = self._total_len / n_docs or 1.0
+        if not len(ids):
+            return []
+
+        scores = np.zeros(len(ids), dtype="float32")
+        norm = self.k1 * (1 - self.b + self.b * doc_len / avg_len)
+        idf = np.log(1.0 + (n_docs - df + 0.5) / (df + 0.5))
+
+        for term, term_idf in zip(terms, idf):
+            for first_row, columns in postings:
+                start, end = columns.indptr[term], columns.indptr[term + 1]
+                if start == end:
+                    continue
+                rows = columns.indices[start:end] + first_row
+                tf = columns.data[start:end]
+                scores[rows] += term_idf * tf * (self.k1 + 1) / (tf + norm[rows])
+
+        scores[~alive] = 0
+        if allowed_ids is not None:
+            scores[~np.isin(ids, allowed_ids)] = 0
+        candidates = np.flatnonzero(scores > 0)
+        if len(candidates) > top_k:
+            candidates = candidates[np.argpartition(-scores[candidates], top_k - 1)[:top_k]]
+        candidates = candidates[np.argsort(-scores[candidates])]
+        return [(int(ids[row]), float(scores[row])) for row in candidates]
+
+    def save(self, path):
+        """Saves the index to `path` (an .npz file), replacing it atomically."""
+        with self._lock:
+            matrix, blocks = self._matrix, [block for _, block, _ in self._pending]
+            ids, alive = self._ids, self._alive.copy()
+        if blocks:
+            matrix = sp.vstack([matrix, *blocks], format="csr")
+        with self._save_lock:
+            tmp_path = f"{path}.tmp.npz"
+            np.savez(
+                tmp_path,
+                data=matrix.data, indices=matrix.indices, indptr=matrix.indptr,
+                shape=np.array(matrix.shape), ids=ids, alive=alive,
+            )
+            os.replace(tmp_path, path)
+
+    def load(self, path):
+        """
+        Loads an index saved with `save`.
+
+        Returns:
+        - bool: False if the file is missing or unreadable.
+        """
+        try:
+            with np.load(path) as saved:
+                matrix = sp.csr_matrix(
+                    (saved["data"], saved["indices"], saved["indptr"]), shape=tuple(saved["shape"])
+                )
+                ids = saved["ids"]
+                alive = saved["alive"]
+        except (OSError, KeyError, ValueError):
+            return False
+
+        doc_len = np.asarray(matrix.sum(axis=1), dtype="float32").ravel()
+        df = np.bincount(matrix[np.flatnonzero(alive)].indices, minlength=matrix.shape[1])
+        postings = matrix.tocsc()
+        with self._lock:
+            self._matrix, self._postings, self._ids, self._alive = matrix, postings, ids, alive
+            self._pending = []
+            self._doc_len, self._df = doc_len, df
+            self._total_len = float(doc_len[alive].sum())
+            self._rows = {int(chunk_id): row for row, chunk_id in enumerate(ids) if alive[row]}
+            self._schedule_merge()
+        return True
@@ -0,0 +1,381 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+
+import numpy as np
+from utils.constants import CHUNK_STORE_FILE
+
+# SQLite limits the number of bound parameters per statement
+_SQL_BATCH = 500
+
+# Metadata copied into indexed columns so searches can be filtered in SQL
+FILTER_COLUMNS = {
+    "source": "TEXT",
+    "title": "TEXT",
+    "author": "TEXT",
+    "year": "INTEGER",
+    "batch": "TEXT",
+    "page_start": "INTEGER",
+    "page_end": "INTEGER",
+}
+
+
+def make_chunk_id(document, text):
+    """
+    Returns the stable ID of a chunk: a 63-bit hash of its document key and
+    text, so the same chunk gets the same ID across rebuilds and restarts.
+    """
+    digest = hashlib.sha1(f"{document}\0{text}".encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "little") & 0x7FFFFFFFFFFFFFFF
+
+
+def iter_knowledge_base_chunks(data):
+    """
+    Yields every chunk of a knowledge base dict with its metadata.
+
+    Handles the formats the knowledge base can hold: plain string chunks,
+    {"text", "pages", "metadata"} chunks from page-aware ingestion and single
+    {"text", "metadata"} entries added from online sources.
+
+    Parameters:
+    - data (dict): Mapping of document key (usually the title) -> chunks, or a single online entry.
+
+    Yields:
+    - tuple: (document, text, metadata)
+    """
+    for document, chunks in data.items():
+        if isinstance(chunks, dict):
+            yield document, chunks["text"], dict(chunks.get("metadata", {"title": document}))
+            continue
+
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                yield document, chunk, {"title": document}
+                continue
+
+            metadata = {"title": document, **chunk.get("metadata", {})}
+            if chunk.get("pages"):
+                metadata["page_start"], metadata["page_end"] = chunk["pages"]
+            yield document, chunk["text"], metadata
+
+
+# Keys accepted by `ChunkStore.ids_matching`
+VALUE_FILTERS = ("source", "title", "document", "batch")
+RANGE_FILTERS = ("year", "year_min", "year_max", "page_min", "page_max")
+
+
+def validate_filters(filters):
+    """
+    Checks search filters before they reach SQL.
+
+    Parameters:
+    - filters (dict): Filters as accepted by `ChunkStore.ids_matching`.
+
+    Returns:
+    - dict: The filters, with range bounds converted to int.
+
+    Raises:
+    - ValueError: If a key is unknown or a value has the wrong type (e.g. a
+      nested list or object, or a non-numeric year).
+    """
+    if not isinstance(filters, dict):
+        raise ValueError("filters must be an object")
+    unknown = set(filters) - set(VALUE_FILTERS) - set(RANGE_FILTERS) - {"author"}
+    if unknown:
+        raise ValueError(f"unknown filter(s): {', '.join(sorted(unknown))}")
+
+    scalar = (str, int, float)
+    validated = {}
+    for key, value in filters.items():
+        if value is None:
+            continue
+        if key in VALUE_FILTERS:
+            values = value if isinstance(value, list) else [value]
+            if not all(isinstance(v, scalar) and not isinstance(v, bool) for v in values):
+                raise ValueError(f"{key} must be a string or number, or a list of them")
+        elif key == "author":
+            if not isinstance(value, str):
+                raise ValueError("author must be a string")
+        else:
+            if isinstance(value, bool) or not isinstance(value, scalar):
+                raise ValueError(f"{key} must be an integer")
+            try:
+                value = int(value)
+            except ValueError:
+                raise ValueError(f"{key} must be an integer") from None
+        validated[key] = value
+    return validated
+
+
+def filter_values(metadata):
+    """
+    Derives the filterable column values of a chunk from its metadata.
+
+    Parameters:
+    - metadata (dict): Chunk metadata.
+
+    Returns:
+    - tuple: Values in FILTER_COLUMNS order.
+    """
+    authors = metadata.get("authors") or metadata.get("author") or ""
+    if isinstance(authors, (list, tuple)):
+        authors = ", ".join(str(author) for author in authors)
+    year = re.search(r"\d{4}", str(metadata.get("year") or ""))
+    return (
+        metadata.get("source", "pdf"),
+        metadata.get("title"),
+        authors or None,
+        int(year.group()) if year else None,
+        metadata.get("batch"),
+        metadata.get("page_start"),
+        metadata.get("page_end"),
+    )
+
+
+class ChunkStore:
+    def __init__(self, db_file=CHUNK_STORE_FILE):
+        """
+        SQLite-backed store of knowledge base chunks.
+
+        Chunks are rows keyed by their stable chunk ID, so lookups are a
+        primary-key read and adding a document only appends its rows. The
+        database runs in WAL mode and is safe to share between request threads.
+        Source, title, author, year, ingestion batch and page range are kept in
+        indexed columns so filtered searches can resolve their chunk IDs in SQL.
+
+        Parameters:
+        - db_file (str): Path to the SQLite database.
+        """
+        self.db_file = db_file
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_file, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS chunks ("
+            " id INTEGER PRIMARY KEY, document TEXT NOT NULL, text TEXT NOT NULL, metadata TEXT NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS chunks_document ON chunks (document)")
+        self._add_filter_columns()
+        self._db.commit()
+        # Bumped on every write so callers can cache filter results
+        self.version = 0
+
+    def _add_filter_columns(self):
+        """Adds the filter columns to stores created before they existed and backfills them."""
+        existing = {row[1] for row in self._db.execute("PRAGMA table_info(chunks)")}
+        missing = [column for column in FILTER_COLUMNS if column not in existing]
+        for column in missing:
+            self._db.execute(f"ALTER TABLE chunks ADD COLUMN {column} {FILTER_COLUMNS[column]}")
+        for column in ("source", "title", "author", "year", "batch"):
+            self._db.execute(f"CREATE INDEX IF NOT EXISTS chunks_{column} ON chunks ({column})")
+
+        if missing:
+            rows = self._db.execute("SELECT id, metadata FROM chunks").fetchall()
+            self._db.executemany(
+                f"UPDATE chunks SET {', '.join(f'{column} = ?' for column in FILTER_COLUMNS)} WHERE id = ?",
+                [(*filter_values(json.loads(metadata)), chunk_id) for chunk_id, metadata in rows],
+            )
+
+    def migrate_from_json(self, json_file):
+        """
+        One-time import of a legacy knowledge_base.json. The JSON file is renamed
+        to `<name>.migrated` afterwards so it is never imported twice.
+
+        Parameters:
+        - json_file (str): Path to the legacy knowledge base JSON file.
+
+        Returns:
+        - int: Number of chunks imported.
+        """
+        if not json_file or not os.path.exists(json_file):
+            return 0
+
+        try:
+            with open(json_file, "r") as f:
+                data = json.load(f)
+        except json.JSONDecodeError:
+            print(f"Could not read {json_file}, skipping migration")
+            return 0
+
+        added = self.add(iter_knowledge_base_chunks(data))
+        os.replace(json_file, f"{json_file}.migrated")
+        print(f"Migrated {len(added)} chunks from {json_file} to {self.db_file}")
+        return len(added)
+
+    def add(self, entries):
+        """
+        Appends chunks; chunks that are already stored are skipped.
+
+        Parameters:
+        - entries (iterable): (document, text, metadata) triples.
+
+        Returns:
+        - list: (chunk_id, text) pairs of the chunks that were added.
+        """
+        rows = {}
+        for document, text, metadata in entries:
+            chunk_id = make_chunk_id(document, text)
+            rows.setdefault(chunk_id, (chunk_id, document, text, json.dumps(metadata), *filter_values(metadata)))
+
+        columns = ", ".join(["id", "document", "text", "metadata", *FILTER_COLUMNS])
+        placeholders = ", ".join("?" * (4 + len(FILTER_COLUMNS)))
+        with self._lock:
+            existing = self._existing_ids(list(rows))
+            new_rows = [row for chunk_id, row in rows.items() if chunk_id not in existing]
+            self._db.executemany(f"INSERT INTO chunks ({columns}) VALUES ({placeholders})", new_rows)
+            self._db.commit()
+            self.version += 1
+        return [(row[0], row[2]) for row in new_rows]
+
+    def add_document(self, document, chunks):
+        """
+        Appends the chunks of one document.
+
+        Parameters:
+        - document (str): Document key, usually the PDF title.
+        - chunks (list): Chunks as strings or {"text", "pages"} dicts.
+
+        Returns:
+        - list: (chunk_id, text) pairs of the chunks that were added.
+        """
+        return self.add(iter_knowledge_base_chunks({document: chunks}))
+
+    def _existing_ids(self, chunk_ids):
+        found = set()
+        for start in range(0, len(chunk_ids), _SQL_BATCH):
+            batch = chunk_ids[start:start + _SQL_BATCH]
+            placeholders = ",".join("?" * len(batch))
+            found.update(r[0] for r in self._db.execute(f"SELECT id FROM chunks WHERE id IN ({placeholders})", batch))
+        return found
+
+    def get(self, chunk_id):
+        """Returns {"text", "metadata"} for a chunk, or None if it is not stored."""
+        return self.get_many([chunk_id]).get(chunk_id)
+
+    def get_many(self, chunk_ids):
+        """
+        Looks up several chunks by ID.
+
+        Parameters:
+        - chunk_ids (list): Chunk IDs.
+
+        Returns:
+        - dict: chunk id -> {"text": str, "metadata": dict} for the IDs that are stored.
+        """
+        chunk_ids = [int(chunk_id) for chunk_id in chunk_ids]
+        found = {}
+        with self._lock:
+            for start in range(0, len(chunk_ids), _SQL_BATCH):
+                batch = chunk_ids[start:start + _SQL_BATCH]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._db.execute(
+                    f"SELECT id, document, text, metadata FROM chunks WHERE id IN ({placeholders})", batch
+                )
+                for chunk_id, document, text, metadata in rows:
+                    metadata = dict(json.loads(metadata), chunk_id=chunk_id, document=document)
+                    found[chunk_id] = {"text": text, "metadata": metadata}
+        return found
+
+    def ids(self):
+        """Returns all chunk IDs as a sorted int64 array."""
+        with self._lock:
+            rows = self._db.execute("SELECT id FROM chunks ORDER BY id")
+            return np.fromiter((r[0] for r in rows), dtype="int64")
+
+    def ids_for_documents(self, documents):
+        """Returns the chunk IDs belonging to the given document keys."""
+        documents = list(documents)
+        chunk_ids = []
+        with self._lock:
+            for start in range(0, len(documents), _SQL_BATCH):
+                batch = documents[start:start + _SQL_BATCH]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._db.execute(f"SELECT id FROM chunks WHERE document IN ({placeholders})", batch)
+                chunk_ids.extend(r[0] for r in rows)
+        return chunk_ids
+
+    def has_document(self, document):
+        """Returns True if any chunk of the document is stored."""
+        with self._lock:
+            return self._db.execute("SELECT 1 FROM chunks WHERE document = ? LIMIT 1", (document,)).fetchone() is not None
+
+    def remove(self, chunk_ids):
+        """
+        Deletes chunks by ID.
+
+        Parameters:
+        - chunk_ids (list): Chunk IDs.
+
+        Returns:
+        - list: IDs that were actually stored and have been deleted.
+        """
+        chunk_ids = [int(chunk_id) for chunk_id in chunk_ids]
+        with self._lock:
+            existing = self._existing_ids(chunk_ids)
+            self._db.executemany("DELETE FROM chunks WHERE id = ?", [(chunk_id,) for chunk_id in existing])
+            self._db.commit()
+            self.version += 1
+        return list(existing)
+
+    def remove_documents(self, documents):
+        """
+        Deletes every chunk of the given document keys.
+
+        Returns:
+        - list: IDs of the deleted chunks.
+        """
+        return self.remove(self.ids_for_documents(documents))
+
+    def ids_matching(self, filters):
+        """
+        Resolves metadata filters to the IDs of the matching chunks.
+
+        Parameters:
+        - filters (dict): Any of "source", "title", "document", "batch" (a value
+          or list of values), "author" (substring, case-insensitive), "year",
+          "year_min", "year_max", "page_min" and "page_max" (chunks overlapping
+          the page range).
+
+        Returns:
+        - np.ndarray: Sorted int64 array of matching chunk IDs.
+
+        Raises:
+        - ValueError: If the filters are invalid, see `validate_filters`.
+        """
+        filters = validate_filters(filters)
+        clauses = []
+        params = []
+        for column in VALUE_FILTERS:
+            values = filters.get(column)
+            if values is None:
+                continue
+            values = values if isinstance(values, list) else [values]
+            clauses.append(f"{column} IN ({','.join('?' * len(values))})")
+            params.extend(values)
+
+        if filters.get("author"):
+            clauses.append("author LIKE ?")
+            params.append(f"%{filters['author']}%")
+
+        bounds = (
+            ("year = ?", "year"), ("year >= ?", "year_min"), ("year <= ?", "year_max"),
+            ("page_end >= ?", "page_min"), ("page_start <= ?", "page_max"),
+        )
+        for clause, key in bounds:
+            if filters.get(key) is not None:
+                clauses.append(clause)
+                params.append(filters[key])
+
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        with self._lock:
+            rows = self._db.execute(f"SELECT id FROM chunks{where} ORDER BY id", params)
+            return np.fromiter((r[0] for r in rows), dtype="int64")
+
+    def count(self):
+        """Returns the number of stored chunks."""
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
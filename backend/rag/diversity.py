@@ -0,0 +1,61 @@
+import numpy as np
+
+
+def _normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def mmr_select(query_embedding, embeddings, k, lambda_mult=0.7, relevance=None, groups=None, max_per_group=None):
+    """
+    Picks k candidates with maximal marginal relevance.
+
+    Each step takes the candidate maximising
+    `lambda_mult * relevance - (1 - lambda_mult) * max similarity to the picks so far`,
+    so near-duplicates of chunks already selected (typically the neighbouring
+    chunks of the same PDF) lose out to new information. Similarities are
+    computed once as a matrix; each step is a vectorized update.
+
+    Parameters:
+    - query_embedding (np.ndarray): Query embedding, shape (dimension,) or (1, dimension).
+    - embeddings (np.ndarray): Candidate embeddings, shape (n, dimension).
+    - k (int): Number of candidates to pick.
+    - lambda_mult (float): 1.0 ranks by relevance only, 0.0 by diversity only.
+    - relevance (np.ndarray): Relevance per candidate; cosine similarity to the query if None.
+    - groups (list): Group key per candidate (e.g. source title), used with max_per_group.
+    - max_per_group (int): Maximum picks per group; None for no cap.
+
+    Returns:
+    - list: Indices of the picked candidates, in pick order.
+    """
+    n = len(embeddings)
+    if n == 0 or k <= 0:
+        return []
+
+    vectors = _normalize(np.asarray(embeddings, dtype="float32"))
+    if relevance is None:
+        query = _normalize(np.asarray(query_embedding, dtype="float32").ravel())
+        relevance = vectors @ query
+    relevance = np.asarray(relevance, dtype="float32")
+    similarity = vectors @ vectors.T
+
+    groups = np.asarray(groups, dtype=object) if groups is not None else None
+    group_counts = {}
+    available = np.ones(n, dtype=bool)
+    redundancy = np.zeros(n, dtype="float32")
+    selected = []
+
+    while len(selected) < k and available.any():
+        scores = lambda_mult * relevance - (1 - lambda_mult) * redundancy
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        redundancy = similarity[best] if len(selected) == 1 else np.maximum(redundancy, similarity[best])
+
+        if groups is not None and max_per_group:
+            group = groups[best]
+            group_counts[group] = group_counts.get(group, 0) + 1
+            if group_counts[group] >= max_per_group:
+                available &= groups != group
+    return selected
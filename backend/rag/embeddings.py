@@ -0,0 +1,158 @@
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from sentence_transformers import SentenceTransformer
+from utils.constants import EMBEDDING_CACHE_FILE, EMBEDDING_MODEL_NAME
+
+# SQLite limits the number of bound parameters per statement
+_SQL_BATCH = 500
+
+
+def text_hash(text):
+    """Returns the cache key of a chunk of text."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingService:
+    def __init__(self, model_name=EMBEDDING_MODEL_NAME, batch_size=64, cache_file=EMBEDDING_CACHE_FILE,
+                 query_cache_size=256):
+        """
+        Batched SentenceTransformer embeddings with a persistent document cache
+        and an in-memory LRU for queries.
+
+        Document embeddings are stored in SQLite keyed by model name and
+        SHA-256 of the text, so re-indexing only runs the model on text it has
+        never seen.
+
+        Parameters:
+        - model_name (str): Name of the SentenceTransformer model.
+        - batch_size (int): Number of texts per forward pass.
+        - cache_file (str): Path to the SQLite embedding cache; None disables it.
+        - query_cache_size (int): Number of recent query embeddings kept in memory.
+        """
+        self.model_name = model_name
+        self.model = SentenceTransformer(model_name)
+        self.dimension = self.model.get_sentence_embedding_dimension()
+        self.batch_size = batch_size
+        self.query_cache_size = query_cache_size
+        self._query_cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+
+        if cache_file:
+            self._db = sqlite3.connect(cache_file, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                " model TEXT NOT NULL, text_hash TEXT NOT NULL, vector BLOB NOT NULL,"
+                " PRIMARY KEY (model, text_hash))"
+            )
+            self._db.commit()
+
+    def _encode(self, texts):
+        """Runs the model on texts in batches of `batch_size`."""
+        if not texts:
+            return np.empty((0, self.dimension), dtype="float32")
+        embeddings = self.model.encode(texts, batch_size=self.batch_size, convert_to_numpy=True)
+        return np.asarray(embeddings, dtype="float32")
+
+    def get_cached(self, hashes):
+        """
+        Looks up document embeddings in the persistent cache.
+
+        Parameters:
+        - hashes (list): Text hashes as returned by `text_hash`.
+
+        Returns:
+        - dict: text hash -> embedding for the hashes that are cached.
+        """
+        found = {}
+        if self._db is None:
+            return found
+
+        with self._lock:
+            for start in range(0, len(hashes), _SQL_BATCH):
+                batch = hashes[start:start + _SQL_BATCH]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._db.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({placeholders})",
+                    [self.model_name, *batch],
+                )
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype="float32")
+        return found
+
+    def _store(self, hashes, embeddings):
+        if self._db is None or not hashes:
+            return
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, text_hash, vector) VALUES (?, ?, ?)",
+                [(self.model_name, key, vector.tobytes()) for key, vector in zip(hashes, embeddings)],
+            )
+            self._db.commit()
+
+    def encode_documents(self, texts):
+        """
+        Embeds document chunks, only running the model on uncached text.
+
+        Parameters:
+        - texts (list): Chunks of text.
+
+        Returns:
+        - np.ndarray: float32 array of shape (len(texts), dimension).
+        """
+        hashes = [text_hash(text) for text in texts]
+        cached = self.get_cached(list(set(hashes)))
+
+        missing = {}
+        for key, text in zip(hashes, texts):
+            if key not in cached:
+                missing.setdefault(key, text)
+
+        if missing:
+            new_embeddings = self._encode(list(missing.values()))
+            self._store(list(missing), new_embeddings)
+            cached.update(zip(missing, new_embeddings))
+            print(f"Embedded {len(missing)} new chunks ({len(texts) - len(missing)} from cache)")
+
+        if not texts:
+            return np.empty((0, self.dimension), dtype="float32")
+        return np.vstack([cached[key] for key in hashes])
+
+    def encode_queries(self, queries):
+        """
+        Embeds queries, serving repeated ones from the LRU cache.
+
+        Parameters:
+        - queries (list): Query strings.
+
+        Returns:
+        - np.ndarray: float32 array of shape (len(queries), dimension).
+        """
+        results = {}
+        with self._lock:
+            for query in queries:
+                if query in self._query_cache:
+                    self._query_cache.move_to_end(query)
+                    results[query] = self._query_cache[query]
+
+        missing = list(dict.fromkeys(q for q in queries if q not in results))
+        if missing:
+            for query, embedding in zip(missing, self._encode(missing)):
+                results[query] = embedding
+            with self._lock:
+                for query in missing:
+                    self._query_cache[query] = results[query]
+                while len(self._query_cache) > self.query_cache_size:
+                    self._query_cache.popitem(last=False)
+
+        if not queries:
+            return np.empty((0, self.dimension), dtype="float32")
+        return np.vstack([results[query] for query in queries])
+
+    def encode_query(self, query):
+        """Embeds a single query; returns an array of shape (1, dimension)."""
+        return self.encode_queries([query])
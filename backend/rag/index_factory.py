@@ -0,0 +1,235 @@
+import math
+
+import faiss
+import numpy as np
+
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+
+# Below this many vectors brute force is fast enough and exact
+FLAT_MAX_VECTORS = 50_000
+# Above this many vectors HNSW graph construction and memory get expensive
+HNSW_MAX_VECTORS = 1_000_000
+HNSW_M = 32
+# Upper bound on the efSearch of filtered HNSW searches
+MAX_FILTERED_EF_SEARCH = 4096
+
+
+def default_nlist(n_vectors):
+    """Number of IVF clusters: ~4*sqrt(n), kept within faiss' training guidelines."""
+    return int(min(max(4 * math.sqrt(n_vectors), 16), 65536, max(n_vectors // 39, 1)))
+
+
+def default_pq_m(dimension):
+    """Number of PQ sub-quantizers: the divisor of the dimension closest to dimension / 8."""
+    target = max(dimension // 8, 1)
+    divisors = [m for m in range(1, dimension + 1) if dimension % m == 0]
+    return min(divisors, key=lambda m: abs(m - target))
+
+
+def estimate_memory_mb(index_type, n_vectors, dimension):
+    """
+    Rough memory footprint of an index.
+
+    Parameters:
+    - index_type (str): One of INDEX_TYPES.
+    - n_vectors (int): Number of vectors.
+    - dimension (int): Embedding dimension.
+
+    Returns:
+    - float: Estimated size in MiB.
+    """
+    if index_type == "ivf_pq":
+        per_vector = default_pq_m(dimension) + 8
+    elif index_type == "hnsw":
+        per_vector = dimension * 4 + HNSW_M * 2 * 4
+    elif index_type == "ivf_flat":
+        per_vector = dimension * 4 + 8
+    else:
+        per_vector = dimension * 4
+    return n_vectors * per_vector / 2 ** 20
+
+
+def choose_index_type(n_vectors, dimension, memory_budget_mb=None):
+    """
+    Picks an index type from the corpus size and an optional memory budget.
+
+    Small corpora stay on exact brute-force search, medium ones use HNSW and
+    large ones IVF-Flat; IVF-PQ is used whenever the uncompressed vectors would
+    not fit in the budget.
+
+    Parameters:
+    - n_vectors (int): Number of chunks to index.
+    - dimension (int): Embedding dimension.
+    - memory_budget_mb (float): Memory available to the index, or None for no limit.
+
+    Returns:
+    - str: One of INDEX_TYPES.
+    """
+    def fits(index_type):
+        return memory_budget_mb is None or estimate_memory_mb(index_type, n_vectors, dimension) <= memory_budget_mb
+
+    if n_vectors < FLAT_MAX_VECTORS and fits("flat"):
+        return "flat"
+    if n_vectors < HNSW_MAX_VECTORS and fits("hnsw"):
+        return "hnsw"
+    if fits("ivf_flat"):
+        return "ivf_flat"
+    return "ivf_pq"
+
+
+def build_index(index_type, dimension, n_vectors):
+    """
+    Creates an empty (untrained) L2 index of the requested type.
+
+    Parameters:
+    - index_type (str): One of INDEX_TYPES.
+    - dimension (int): Embedding dimension.
+    - n_vectors (int): Expected number of vectors, used to size IVF lists.
+
+    Returns:
+    - faiss.Index: The new index.
+    """
+    if index_type == "flat":
+        return faiss.IndexFlatL2(dimension)
+    if index_type == "hnsw":
+        return faiss.IndexHNSWFlat(dimension, HNSW_M)
+
+    nlist = default_nlist(n_vectors)
+    quantizer = faiss.IndexFlatL2(dimension)
+    if index_type == "ivf_flat":
+        return faiss.IndexIVFFlat(quantizer, dimension, nlist)
+    if index_type == "ivf_pq":
+        return faiss.IndexIVFPQ(quantizer, dimension, nlist, default_pq_m(dimension), 8)
+    raise ValueError(f"Unknown index type: {index_type}")
+
+
+def min_training_size(index):
+    """Smallest number of vectors an index can be trained on."""
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is None:
+        return 0
+    needed = ivf.nlist
+    if isinstance(ivf, faiss.IndexIVFPQ):
+        needed = max(needed, 2 ** ivf.pq.nbits)
+    return needed
+
+
+def train_index(index, embeddings, sample_size=100_000, seed=0):
+    """
+    Trains an index on a random sample of the embeddings if it needs training.
+
+    Parameters:
+    - index (faiss.Index): Index to train.
+    - embeddings (np.ndarray): float32 embeddings of the corpus.
+    - sample_size (int): Maximum number of vectors used for training.
+    - seed (int): Seed for the sample.
+    """
+    if index.is_trained:
+        return
+    if len(embeddings) > sample_size:
+        rng = np.random.default_rng(seed)
+        embeddings = embeddings[rng.choice(len(embeddings), sample_size, replace=False)]
+    index.train(np.ascontiguousarray(embeddings, dtype="float32"))
+
+
+def configure_search(index, nprobe=None, ef_search=None):
+    """
+    Applies query-time parameters to an index (wrapped or not).
+
+    Parameters:
+    - index (faiss.Index): Index to configure.
+    - nprobe (int): IVF lists visited per query.
+    - ef_search (int): HNSW candidate list size per query.
+    """
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None and nprobe:
+        ivf.nprobe = min(nprobe, ivf.nlist)
+
+    hnsw = faiss.downcast_index(index)
+    if hasattr(hnsw, "index"):
+        # Unwrap ID maps
+        hnsw = faiss.downcast_index(hnsw.index)
+    if isinstance(hnsw, faiss.IndexHNSW) and ef_search:
+        hnsw.hnsw.efSearch = ef_search
+
+
+def search_parameters(index, selector, nprobe=None, ef_search=None, selectivity=1.0):
+    """
+    Builds per-query search parameters that restrict a search to `selector`.
+
+    Parameters passed to a search replace the index's own query-time settings,
+    so nprobe and efSearch are carried over explicitly. Both are divided by
+    the selectivity: when only 5% of the vectors are allowed, a search has to
+    visit about 20 times as many to reach the same number of allowed ones.
+
+    Parameters:
+    - index (faiss.Index): Index to search (wrapped or not).
+    - selector (faiss.IDSelector): IDs the search may return.
+    - nprobe (int): IVF lists visited per query.
+    - ef_search (int): HNSW candidate list size per query.
+    - selectivity (float): Fraction of the indexed vectors the selector allows.
+
+    Returns:
+    - faiss.SearchParameters: Parameters for `index.search(..., params=...)`.
+    """
+    scale = 1 / min(max(selectivity, 1e-6), 1.0)
+    index_type = index_type_of(index)
+    if index_type in ("ivf_flat", "ivf_pq"):
+        ivf = faiss.try_extract_index_ivf(index)
+        nprobe = math.ceil((nprobe or ivf.nprobe) * scale)
+        return faiss.SearchParametersIVF(sel=selector, nprobe=min(nprobe, ivf.nlist))
+    if index_type == "hnsw":
+        ef_search = ef_search or 16
+        return faiss.SearchParametersHNSW(
+            sel=selector, efSearch=max(ef_search, min(math.ceil(ef_search * scale), MAX_FILTERED_EF_SEARCH))
+        )
+    return faiss.SearchParameters(sel=selector)
+
+
+def index_type_of(index):
+    """Returns the INDEX_TYPES name of an index (unwrapping ID maps)."""
+    index = faiss.downcast_index(index)
+    if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        index = faiss.downcast_index(index.index)
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(index, faiss.IndexIVFPQ):
+        return "ivf_pq"
+    if isinstance(index, faiss.IndexIVF):
+        return "ivf_flat"
+    return "flat"
+
+
+def measure_recall(index, embeddings, k=10, n_queries=200, seed=0, ids=None):
+    """
+    Measures recall@k of an approximate index against exact brute-force search,
+    using a sample of the corpus itself as queries.
+
+    Parameters:
+    - index (faiss.Index): Approximate index containing `embeddings`.
+    - embeddings (np.ndarray): float32 embeddings of the corpus, in index order.
+    - k (int): Number of neighbours compared.
+    - n_queries (int): Number of sampled queries.
+    - seed (int): Seed for the query sample.
+    - ids (np.ndarray): IDs the embeddings were added under, if the index is an ID map.
+
+    Returns:
+    - float: Average fraction of the exact top-k found by the index.
+    """
+    n = len(embeddings)
+    if n == 0:
+        return 1.0
+    k = min(k, n)
+    rng = np.random.default_rng(seed)
+    queries = embeddings[rng.choice(n, min(n_queries, n), replace=False)]
+
+    # Brute-force search of the sampled queries straight over the corpus array,
+    # so the corpus is not copied into a second (flat) index
+    embeddings = np.ascontiguousarray(embeddings, dtype="float32")
+    _, expected = faiss.knn(queries, embeddings, k, metric=faiss.METRIC_L2)
+    if ids is not None:
+        expected = ids[expected]
+    _, found = index.search(queries, k)
+
+    hits = sum(len(set(e) & set(f)) for e, f in zip(expected, found))
+    return hits / (len(queries) * k)
@@ -0,0 +1,69 @@
+import time
+
+import numpy as np
+from sentence_transformers import CrossEncoder
+from utils.constants import RERANKER_MODEL_NAME
+
+
+class CrossEncoderReranker:
+    def __init__(self, model_name=RERANKER_MODEL_NAME, batch_size=16, time_budget_ms=150):
+        """
+        Second-stage re-ranker that scores (query, chunk) pairs with a small
+        cross-encoder.
+
+        Candidates are scored in first-stage order, one batch at a time. Before
+        each batch the time it would take is estimated from the batches so far;
+        once the per-query budget would be exceeded, the remaining candidates
+        keep their first-stage order after the re-ranked ones.
+
+        Parameters:
+        - model_name (str): Name of the cross-encoder model.
+        - batch_size (int): Pairs scored per forward pass.
+        - time_budget_ms (float): Time allowed for re-ranking one query; None for no limit.
+        """
+        self.model_name = model_name
+        self.model = CrossEncoder(model_name)
+        self.batch_size = batch_size
+        self.time_budget_ms = time_budget_ms
+
+    def rerank(self, query, candidates, time_budget_ms=None):
+        """
+        Re-orders candidates by cross-encoder score within the time budget.
+
+        Parameters:
+        - query (str): The user's query.
+        - candidates (list): Candidate dicts with a "text" key, in first-stage order.
+        - time_budget_ms (float): Overrides the default budget for this call.
+
+        Returns:
+        - tuple: (candidates, stats) where the re-ranked candidates carry a
+          "rerank_score" and stats holds "rerank_ms", "reranked" and "budget_exhausted".
+        """
+        budget = self.time_budget_ms if time_budget_ms is None else time_budget_ms
+        start = time.perf_counter()
+        scores = []
+        batch_times = []
+
+        for offset in range(0, len(candidates), self.batch_size):
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            expected_ms = max(batch_times) if batch_times else 0.0
+            if budget is not None and elapsed_ms + expected_ms > budget:
+                break
+
+            batch_start = time.perf_counter()
+            batch = candidates[offset:offset + self.batch_size]
+            batch_scores = self.model.predict(
+                [(query, candidate["text"]) for candidate in batch], batch_size=self.batch_size
+            )
+            scores.extend(np.asarray(batch_scores, dtype="float32").tolist())
+            batch_times.append((time.perf_counter() - batch_start) * 1000)
+
+        scored = [dict(candidate, rerank_score=score) for candidate, score in zip(candidates, scores)]
+        scored.sort(key=lambda candidate: candidate["rerank_score"], reverse=True)
+
+        stats = {
+            "rerank_ms": (time.perf_counter() - start) * 1000,
+            "reranked": len(scored),
+            "budget_exhausted": len(scored) < len(candidates),
+        }
+        return scored + candidates[len(scored):], stats
@@ -1,102 +1,547 @@
+import hashlib
 import json
 import os
+import time
+from collections import OrderedDict
 
 import faiss
 import numpy as np
+from rag.bm25 import BM25Index, reciprocal_rank_fusion
+from rag.chunk_store import ChunkStore, iter_knowledge_base_chunks, make_chunk_id
+from rag.diversity import mmr_select
+from rag.embeddings import EmbeddingService
+from rag.index_factory import (
+    build_index,
+    choose_index_type,
+    configure_search,
+    index_type_of,
+    measure_recall,
+    min_training_size,
+    search_parameters,
+    train_index,
+)
 from rag.search_online import search_arxiv, search_springer
-from sentence_transformers import SentenceTransformer
-from utils.constants import KNOWLEDGE_BASE_FILE
+from utils.constants import CHUNK_STORE_FILE, EMBEDDING_MODEL_NAME, KNOWLEDGE_BASE_FILE
+
+# Bump when the on-disk index layout changes so old indexes are rebuilt
+INDEX_FORMAT_VERSION = 1
+
+# Number of resolved metadata filters kept with their FAISS ID selectors
+FILTER_CACHE_SIZE = 32
+
+# Filters matching at most this many chunks are searched exactly over just
+# their vectors: an HNSW or IVF search rarely reaches so few allowed ids
+EXACT_FILTER_MAX_IDS = 10_000
+
+# Fraction of tombstoned vectors after which an index that cannot remove
+# vectors (HNSW) is rebuilt
+MAX_TOMBSTONE_RATIO = 0.2
 
 
 class OptimizedRetriever:
-    def __init__(self, model_name="all-MiniLM-L6-v2", knowledge_base=KNOWLEDGE_BASE_FILE, index_file="index.faiss"):
+    def __init__(self, model_name=EMBEDDING_MODEL_NAME, knowledge_base=KNOWLEDGE_BASE_FILE, index_file="index.faiss",
+                 batch_size=64, index_type="auto", nprobe=16, ef_search=64, memory_budget_mb=None,
+                 chunk_store=CHUNK_STORE_FILE, use_mmap=False, retrieval_mode="hybrid", reranker=None,
+                 rerank_candidates=20, diversify=False, mmr_lambda=0.7, max_per_source=None):
         """
         Initializes the optimized retriever with FAISS for fast similarity search.
 
+        Chunks live in a SQLite `ChunkStore`; a legacy knowledge base JSON file
+        is migrated into it on first use. The FAISS index is wrapped in an ID
+        map: every vector is stored under the stable ID of its chunk (see
+        `make_chunk_id`), so chunks can be added, replaced and removed without
+        rebuilding and search results always resolve to the right text and
+        metadata.
+
         Parameters:
         - model_name (str): Name of the SentenceTransformer model for embeddings.
-        - knowledge_base (str): Path to the knowledge base JSON file.
+        - knowledge_base (str): Path to a legacy knowledge base JSON file to migrate.
         - index_file (str): Path to the FAISS index file.
+        - batch_size (int): Number of chunks embedded per forward pass.
+        - index_type (str): "flat", "ivf_flat", "ivf_pq", "hnsw" or "auto" to choose by corpus size.
+        - nprobe (int): IVF lists visited per query.
+        - ef_search (int): HNSW candidate list size per query.
+        - memory_budget_mb (float): Memory budget used by the "auto" policy; None for no limit.
+        - chunk_store (str): Path to the SQLite chunk store.
+        - use_mmap (bool): Memory-map the saved index read-only instead of copying it
+          into process memory, so several workers share one copy in the page cache.
+          Updates then go through the file: a private copy is synced, saved and
+          mapped again.
+        - retrieval_mode (str): "hybrid" to fuse dense and BM25 results, or "dense".
+        - reranker (CrossEncoderReranker): Optional second stage that re-orders candidates.
+        - rerank_candidates (int): First-stage candidates passed to the re-ranker per query.
+        - diversify (bool): Pick results with maximal marginal relevance instead of by score alone.
+        - mmr_lambda (float): Relevance/diversity trade-off of MMR (1.0 = relevance only).
+        - max_per_source (int): Maximum results per source title when diversifying; None for no cap.
         """
-        self.model = SentenceTransformer(model_name)
+        self.embedder = EmbeddingService(model_name, batch_size=batch_size)
+        self.model = self.embedder.model
         self.knowledge_base = knowledge_base
         self.index_file = index_file
-        self.text_chunks = []
-        self.metadata = []
+        self.index_type = index_type
+        self.nprobe = nprobe
+        self.ef_search = ef_search
+        self.memory_budget_mb = memory_budget_mb
+        self.use_mmap = use_mmap
+        self.retrieval_mode = retrieval_mode
+        self.reranker = reranker
+        self.rerank_candidates = rerank_candidates
+        self.diversify = diversify
+        self.mmr_lambda = mmr_lambda
+        self.max_per_source = max_per_source
+        self.last_search_stats = {}
+        self._filter_cache = OrderedDict()
+        self.index_stats = {}
+        self.lexical = BM25Index()
+        self.store = ChunkStore(chunk_store)
+        self.deleted_ids = set()  # ids still in an index that cannot remove vectors
+        self._needs_rebuild = False  # too many tombstones; rebuilt once the current update is done
         self.index = None
 
-        #  # Create empty knowledge base if not exists
-        if not os.path.exists(self.knowledge_base):
-            with open(self.knowledge_base, 'w') as f:
-                json.dump({}, f)
-            print(f"Created empty knowledge base at {self.knowledge_base}")
+        self.store.migrate_from_json(self.knowledge_base)
 
-        # self.load_knowledge_base()
-        # self.load_or_create_index()
     def load_or_initialize_knowledge_base(self):
         """Initialize or load existing knowledge base"""
-        try:
-            with open(self.knowledge_base, "r") as f:
-                data = json.load(f)
+        if self.store.count() == 0:  # Empty knowledge base
+            return False
 
-            if not data:  # Empty knowledge base
-                return False
+        self.ensure_index()
+        return True
 
+    def ensure_index(self):
+        """Loads the index if that has not happened yet."""
+        if self.index is None:
             self.load_knowledge_base()
             self.load_or_create_index()
-            return True
 
+    def load_knowledge_base(self):
+        """
+        Reports the size of the chunk store. Chunks are read from the store on
+        demand, so nothing has to be parsed up front.
+        """
+        print(f"Knowledge base holds {self.store.count()} chunks")
+
+    def load_or_create_index(self):
+        """
+        Loads or creates a FAISS index for efficient similarity search.
+
+        The index header is checked first: an index built with another
+        embedding model or format version is rebuilt, one whose checksum
+        matches the knowledge base is used as is, and any other is synced so
+        only the chunks that changed since it was saved are embedded.
+        """
+        # The lexical index only depends on the chunk store
+        self._load_lexical()
+
+        status = self.verify_index()
+
+        # If index file exists, load it
+        if status != "incompatible":
+            # A stale index is about to be modified, so it needs a private copy
+            index = self._read_index(mmap=self.use_mmap and status == "current")
+            header = self.read_index_header()
+            if isinstance(index, faiss.IndexIDMap2) and index.ntotal == header.get("ntotal"):
+                self.index = index
+                self.deleted_ids = set(header.get("deleted_ids", []))
+                configure_search(self.index, self.nprobe, self.ef_search)
+                self.index_stats = dict(header.get("stats", {}))
+                print(f"Loaded {index_type_of(self.index)} FAISS index from {self.index_file} ({status})")
+                if status == "stale":
+                    # Targeted rebuild: only chunks added or removed since the save are touched
+                    self.sync_index()
+                    self.save_index()
+                    self._remap_index()
+                return
+            print(f"{self.index_file} does not match its header, rebuilding it")
+
+        self.rebuild_index()
+
+        # Save the index for future use
+        self.save_index()
+        print(f"Saved FAISS index to {self.index_file}")
+        self._remap_index()
+
+    def _read_index(self, mmap=False):
+        """
+        Reads `index_file`, memory-mapped read-only if requested. Falls back to
+        a private copy when this faiss build cannot map the index type.
+
+        IO_FLAG_MMAP_IFC maps the vector storage of flat and IVF indexes in
+        place; plain IO_FLAG_MMAP still copies it into process memory.
+        """
+        if mmap:
+            try:
+                return faiss.read_index(self.index_file, faiss.IO_FLAG_MMAP_IFC)
+            except RuntimeError as e:
+                print(f"Could not memory-map {self.index_file}, loading a private copy: {e}")
+        return faiss.read_index(self.index_file)
+
+    def _remap_index(self):
+        """Swaps an in-memory index for a memory-mapped view of the saved file."""
+        if not self.use_mmap:
+            return
+        self.index = self._read_index(mmap=True)
+        configure_search(self.index, self.nprobe, self.ef_search)
+
+    def _sync_mapped_index(self):
+        """
+        Applies chunk store changes to a memory-mapped index: a private copy is
+        synced with the store, saved and mapped again.
+        """
+        self.index = self._read_index()
+        configure_search(self.index, self.nprobe, self.ef_search)
+        self.sync_index()
+        self.save_index()
+        self._remap_index()
+
+    @property
+    def lexical_file(self):
+        """Path of the BM25 index saved next to the FAISS index."""
+        return f"{self.index_file}.bm25.npz"
+
+    def _load_lexical(self):
+        """Loads the saved BM25 index and brings it in line with the chunk store."""
+        if os.path.exists(self.lexical_file) and self.lexical.load(self.lexical_file):
+            print(f"Loaded BM25 index from {self.lexical_file}")
+
+        indexed = self.lexical.ids()
+        stored = self.store.ids()
+        stale = np.setdiff1d(indexed, stored)
+        missing = np.setdiff1d(stored, indexed)
+        self.lexical.remove(stale.tolist())
+        for batch_ids, texts in self._iter_stored_texts(missing):
+            self.lexical.add(batch_ids, texts)
+        if len(stale) or len(missing):
+            print(f"Synced BM25 index: {len(stale)} stale chunks removed, {len(missing)} missing chunks added")
+
+    @property
+    def header_file(self):
+        """Path of the JSON header saved next to the index."""
+        return f"{self.index_file}.meta.json"
+
+    def corpus_checksum(self, ids=None):
+        """Checksum of the stored corpus: SHA-256 of the sorted chunk ids."""
+        ids = self.store.ids() if ids is None else ids
+        return hashlib.sha256(ids.tobytes()).hexdigest()
+
+    def read_index_header(self):
+        """Returns the saved index header, or an empty dict if there is none."""
+        try:
+            with open(self.header_file, "r") as f:
+                return json.load(f)
         except (json.JSONDecodeError, FileNotFoundError):
-            with open(self.knowledge_base, "w") as f:
-                json.dump({}, f)
-            return False
+            return {}
 
-    def load_knowledge_base(self):
+    def verify_index(self):
         """
-        Loads the knowledge base and extracts text chunks and metadata.
+        Cheaply checks the saved index against the chunk store using only its
+        header, without reading the index or embedding anything.
+
+        Returns:
+        - str: "current" if it matches the corpus, "stale" if it was built with
+          the same model but the corpus changed, "incompatible" if it is
+          missing, from another format version or another embedding model.
         """
+        header = self.read_index_header()
+        if (
+            not os.path.exists(self.index_file)
+            or header.get("version") != INDEX_FORMAT_VERSION
+            or header.get("model_name") != self.embedder.model_name
+            or header.get("dimension") != self.embedder.dimension
+        ):
+            return "incompatible"
+
+        ids = self.store.ids()
+        if header.get("chunk_count") == len(ids) and header.get("corpus_checksum") == self.corpus_checksum(ids):
+            return "current"
+        return "stale"
+
+    def save_index(self):
+        """
+        Writes the FAISS index to `index_file` along with its header.
 
+        Both files are written next to their targets and renamed into place, so
+        processes that have the old index memory-mapped keep a consistent view.
+        """
+        faiss.write_index(self.index, f"{self.index_file}.tmp")
+        os.replace(f"{self.index_file}.tmp", self.index_file)
+        self.lexical.save(self.lexical_file)
+        ids = self.store.ids()
+        header = {
+            "version": INDEX_FORMAT_VERSION,
+            "model_name": self.embedder.model_name,
+            "dimension": self.embedder.dimension,
+            "index_type": index_type_of(self.index),
+            "ntotal": self.index.ntotal,
+            "chunk_count": len(ids),
+            "corpus_checksum": self.corpus_checksum(ids),
+            "deleted_ids": sorted(self.deleted_ids),
+            "stats": self.index_stats,
+        }
+        with open(f"{self.header_file}.tmp", "w") as f:
+            json.dump(header, f, indent=4)
+        os.replace(f"{self.header_file}.tmp", self.header_file)
+
+    def indexed_ids(self):
+        """Returns the chunk ids currently stored in the FAISS index."""
+        return faiss.vector_to_array(self.index.id_map)
+
+    def rebuild_index(self):
+        """
+        Builds a new FAISS index over all stored chunks.
+
+        With index_type "auto" the type is chosen from the chunk count and the
+        memory budget. Approximate indexes are trained on a sample of the
+        embeddings and their recall@10 against exact search is recorded in
+        `index_stats`.
+        """
+        ids = self.store.ids()
+        embeddings = self._embed_stored(ids)
+        dimension = self.embedder.dimension
+
+        index_type = self.index_type
+        if index_type == "auto":
+            index_type = choose_index_type(len(embeddings), dimension, self.memory_budget_mb)
+
+        index = build_index(index_type, dimension, len(embeddings))
+        if len(embeddings) < min_training_size(index):
+            print(f"Too few chunks to train a {index_type} index, using a flat index")
+            index_type = "flat"
+            index = build_index(index_type, dimension, len(embeddings))
+
+        train_index(index, embeddings)
+        index = faiss.IndexIDMap2(index)
+        index.add_with_ids(embeddings, ids)
+        configure_search(index, self.nprobe, self.ef_search)
+        self.index = index
+        self.deleted_ids = set()
+        self._needs_rebuild = False
+
+        self.index_stats = {"type": index_type, "chunks": len(embeddings)}
+        if index_type != "flat" and len(embeddings):
+            self.index_stats["recall@10"] = round(measure_recall(index, embeddings, k=10, ids=ids), 4)
+        print(f"Created a new {index_type} FAISS index over {len(embeddings)} chunks {self.index_stats}")
+
+    def _iter_stored_texts(self, chunk_ids, batch_size=10_000):
+        """Yields (ids, texts) batches of stored chunks, read from the store in batches."""
+        for start in range(0, len(chunk_ids), batch_size):
+            batch = [int(chunk_id) for chunk_id in chunk_ids[start:start + batch_size]]
+            chunks = self.store.get_many(batch)
+            yield batch, [chunks[chunk_id]["text"] for chunk_id in batch]
+
+    def _embed_stored(self, chunk_ids):
+        """Embeds stored chunks by id."""
+        parts = [np.empty((0, self.embedder.dimension), dtype="float32")]
+        for _, texts in self._iter_stored_texts(chunk_ids):
+            parts.append(self.embedder.encode_documents(texts))
+        return np.vstack(parts)
+
+    def _add_vectors(self, registered):
+        """Embeds (chunk_id, text) pairs and adds them to both indexes under their ids."""
+        if not registered:
+            return
+        ids = np.array([chunk_id for chunk_id, _ in registered], dtype="int64")
+        texts = [text for _, text in registered]
+        embeddings = self.embedder.encode_documents(texts)
+        self.deleted_ids.difference_update(ids.tolist())
+        self.index.add_with_ids(embeddings, ids)
+        self.lexical.add(ids.tolist(), texts)
+
+    def _add_stored(self, chunk_ids):
+        """Adds stored chunks to both indexes by id."""
+        for batch_ids, texts in self._iter_stored_texts(chunk_ids):
+            self._add_vectors(list(zip(batch_ids, texts)))
+
+    def _remove_vectors(self, chunk_ids):
+        """Removes vectors by id, tombstoning them if the index type cannot remove."""
+        if not chunk_ids:
+            return
+        self.lexical.remove(chunk_ids)
         try:
-            with open(self.knowledge_base, "r") as f:
-                data = json.load(f)
+            self.index.remove_ids(np.array(chunk_ids, dtype="int64"))
+        except RuntimeError:
+            # HNSW does not support removal: hide the ids at search time and
+            # rebuild once too much of the index is dead weight. The rebuild is
+            # left to the caller, after the rest of its changes are in the store.
+            self.deleted_ids.update(chunk_ids)
+            if len(self.deleted_ids) > MAX_TOMBSTONE_RATIO * max(self.index.ntotal, 1):
+                self._needs_rebuild = True
+
+    def _rebuild_if_needed(self):
+        """
+        Rebuilds the index over the stored chunks if removals left too many tombstones.
 
-            self.text_chunks = []
-            self.metadata = []
+        Returns:
+        - bool: True if the index was rebuilt (it then holds every stored chunk).
+        """
+        if not self._needs_rebuild:
+            return False
+        print(f"{len(self.deleted_ids)} of {self.index.ntotal} vectors are tombstoned, rebuilding the index")
+        self.rebuild_index()
+        return True
 
-            for title, chunks in data.items():
-                for chunk in chunks:
-                    self.text_chunks.append(chunk)
-                    self.metadata.append({"title": title})
+    def sync_index(self):
+        """
+        Makes the index contain exactly the stored chunks: vectors of chunks
+        that no longer exist are removed and missing chunks are embedded.
 
-            print(f"Loaded {len(self.text_chunks)} chunks from knowledge base")
+        Returns:
+        - tuple: (removed, added) counts.
+        """
+        in_index = self.indexed_ids()
+        if self.deleted_ids:
+            in_index = np.setdiff1d(in_index, np.fromiter(self.deleted_ids, dtype="int64"))
+        stored = self.store.ids()
+        stale = np.setdiff1d(in_index, stored).tolist()
+        missing = np.setdiff1d(stored, in_index)
+
+        self._remove_vectors(stale)
+        # A rebuild embeds every stored chunk, the missing ones included
+        if not self._rebuild_if_needed():
+            self._add_stored(missing)
+        if stale or len(missing):
+            print(f"Synced FAISS index: {len(stale)} stale chunks removed, {len(missing)} missing chunks added")
+        return len(stale), len(missing)
+
+    def add_chunks(self, entries):
+        """
+        Adds chunks to the store and the FAISS index; chunks already present are skipped.
 
-        except json.JSONDecodeError:
-            print("Error reading knowledge base, creating empty one")
-            with open(self.knowledge_base, 'w') as f:
-                json.dump({}, f)
+        Parameters:
+        - entries (iterable): (document, text, metadata) triples.
 
-    def load_or_create_index(self):
+        Returns:
+        - list: Ids of the chunks that were added.
         """
-        Loads or creates a FAISS index for efficient similarity search.
+        added = self.store.add(entries)
+        if self.use_mmap and added:
+            self._sync_mapped_index()
+        else:
+            self._add_vectors(added)
+        return [chunk_id for chunk_id, _ in added]
+
+    def remove_chunks(self, chunk_ids):
         """
-        dimension = self.model.get_sentence_embedding_dimension()
+        Removes chunks from the store and the FAISS index.
 
-        # If index file exists, load it
-        if os.path.exists(self.index_file):
-            self.index = faiss.read_index(self.index_file)
-            print(f"Loaded FAISS index from {self.index_file}")
+        Parameters:
+        - chunk_ids (iterable): Ids of the chunks to remove.
+
+        Returns:
+        - int: Number of chunks removed.
+        """
+        removed = self.store.remove(list(chunk_ids))
+        if self.use_mmap and removed:
+            self._sync_mapped_index()
         else:
-            # Create a new FAISS index
-            self.index = faiss.IndexFlatL2(dimension)
-            print("Created a new FAISS index.")
+            self._remove_vectors(removed)
+            self._rebuild_if_needed()
+        return len(removed)
+
+    def replace_chunk(self, chunk_id, text, metadata=None):
+        """
+        Replaces the text (and optionally metadata) of a chunk in place.
 
-            # Compute embeddings for all chunks and add to the index
-            embeddings = self.model.encode(self.text_chunks, convert_to_numpy=True)
-            self.index.add(embeddings)
+        Parameters:
+        - chunk_id (int): Id of the chunk to replace.
+        - text (str): New text.
+        - metadata (dict): New metadata; defaults to the old chunk's metadata.
+
+        Returns:
+        - int: Id of the new chunk (ids are derived from the content).
+        """
+        old = self.store.get(chunk_id)
+        if old is None:
+            raise KeyError(f"Unknown chunk id: {chunk_id}")
+        document = old["metadata"]["document"]
+        if metadata is None:
+            metadata = {k: v for k, v in old["metadata"].items() if k not in ("chunk_id", "document")}
+        self.remove_chunks([chunk_id])
+        self.add_chunks([(document, text, metadata)])
+        return make_chunk_id(document, text)
+
+    def remove_titles(self, titles):
+        """
+        Removes every chunk belonging to the given titles from the store and the FAISS index.
 
-            # Save the index for future use
-            faiss.write_index(self.index, self.index_file)
-            print(f"Saved FAISS index to {self.index_file}")
+        Parameters:
+        - titles (iterable): Titles whose chunks should be dropped.
+
+        Returns:
+        - int: Number of chunks removed.
+        """
+        return self.remove_chunks(self.store.ids_for_documents(set(titles)))
+
+    def add_documents(self, documents):
+        """
+        Stores and indexes the chunks of new documents.
+
+        Parameters:
+        - documents (dict): Mapping of title -> list of chunks (strings or {"text", "pages"} dicts).
+
+        Returns:
+        - int: Number of chunks added.
+        """
+        return len(self.add_chunks(iter_knowledge_base_chunks(documents)))
+
+    def index_document(self, title, chunks, previous_title=None):
+        """
+        Indexes a freshly processed document, replacing any older version of it.
+        Used as the `on_document` callback of `ingest_directory` so documents are
+        embedded while the remaining PDFs are still being extracted.
+
+        Parameters:
+        - title (str): Title of the document.
+        - chunks (list): Text chunks of the document.
+        - previous_title (str): Title the document was indexed under before, if any.
+
+        Returns:
+        - bool: True if the document was indexed, False if no index is loaded yet
+          or it is memory-mapped (it is then synced once in `apply_ingestion`).
+        """
+        if self.index is None or self.use_mmap:
+            return False
+
+        self.remove_titles({title, previous_title} - {None})
+        self.add_documents({title: chunks})
+        return True
+
+    def apply_ingestion(self, changes):
+        """
+        Brings the FAISS index in line with the result of `ingest_directory`.
+
+        Ingestion has already written the chunk store, so when the index is in
+        memory only the vectors of removed chunks are dropped and the chunks of
+        documents that were not streamed through `index_document` are embedded.
+        Otherwise the index is loaded and synced with the store by chunk id.
+
+        Parameters:
+        - changes (dict): Summary returned by `pdf_processing.ingestion.ingest_directory`.
+        """
+        if self.index is None:
+            self.ensure_index()
+            return
+        if self.use_mmap:
+            if changes["added"] or changes["updated"] or changes.get("removed_ids"):
+                self._sync_mapped_index()
+            return
+
+        # Documents streamed in through `index_document` are already up to date
+        indexed = set(changes.get("indexed", []))
+        pending = [title for title in changes["added"] + changes["updated"] if title not in indexed]
+        removed_ids = changes.get("removed_ids", [])
+        if not pending and not removed_ids and not indexed:
+            return
+
+        self._remove_vectors(removed_ids)
+        pending_ids = self.store.ids_for_documents(pending)
+        if not self._rebuild_if_needed():
+            self._add_stored(pending_ids)
+        # Saved even if everything was streamed in, otherwise the saved index
+        # no longer matches the store and is synced again on the next start
+        self.save_index()
+        print(f"Updated FAISS index: {len(removed_ids)} chunks removed, {len(pending_ids)} chunks added, "
+              f"{len(indexed)} documents indexed during ingestion")
 
     def update_knowledge_base(self, query: str) -> bool:
         """Update knowledge base with new information from online sources"""
@@ -105,77 +550,300 @@ class OptimizedRetriever:
             arxiv_chunks, arxiv_citations = search_arxiv(query, max_results=3)
             springer_chunks, springer_citations = search_springer(query, max_results=3)
 
-            # Load existing knowledge base
-            with open(self.knowledge_base, 'r') as f:
-                kb_data = json.load(f)
+            self.ensure_index()
 
             # Add new content
-            updated = False
-            for chunk, citation in zip(arxiv_chunks, arxiv_citations):
-                key = f"arxiv_{citation.title}"
-                if key not in kb_data:
-                    kb_data[key] = {
-                        "text": chunk,
-                        "metadata": {
-                            "source": "arxiv",
-                            "title": citation.title,
-                            "authors": citation.authors,
-                            "year": citation.year,
-                            "url": citation.url
-                        }
+            new_entries = []
+            for source, chunks, citations in (("arxiv", arxiv_chunks, arxiv_citations),
+                                              ("springer", springer_chunks, springer_citations)):
+                for chunk, citation in zip(chunks, citations):
+                    key = f"{source}_{citation.title}"
+                    if self.store.has_document(key):
+                        continue
+                    metadata = {
+                        "source": source,
+                        "title": citation.title,
+                        "authors": citation.authors,
+                        "year": citation.year,
+                        "url": citation.url
                     }
-                    self.text_chunks.append(chunk)
-                    self.metadata.append({"title": citation.title, "source": "arxiv"})
-                    updated = True
-
-            # Update FAISS index if new content was added
-            if updated:
-                new_embeddings = self.model.encode([chunk["text"] for chunk in kb_data.values()
-                                                  if chunk not in self.text_chunks],
-                                                  convert_to_numpy=True)
-                if len(new_embeddings) > 0:
-                    self.index.add(new_embeddings)
-                    faiss.write_index(self.index, self.index_file)
-
-                # Save updated knowledge base
-                with open(self.knowledge_base, 'w') as f:
-                    json.dump(kb_data, f, indent=2)
-
-            return updated
+                    new_entries.append((key, chunk, metadata))
+
+            if not new_entries:
+                return False
+
+            # Only the new chunks are embedded, under their own ids
+            self.add_chunks(new_entries)
+            self.save_index()
+            return True
         except Exception as e:
             print(f"Error updating knowledge base: {e}")
             return False
 
-    def retrieve_relevant_chunks(self, query, top_k=3):
+    def _resolve_filters(self, filters):
         """
-        Retrieves the top-k most relevant chunks for a query using FAISS.
+        Resolves metadata filters to the matching chunk IDs and a FAISS ID selector.
+
+        Results are cached per filter until the chunk store changes, so repeated
+        searches over the same papers skip the SQL lookup and selector build.
 
         Parameters:
-        - query (str): The user's query or input.
-        - top_k (int): Number of top chunks to return.
+        - filters (dict): Filters as accepted by `ChunkStore.ids_matching`.
+
+        Returns:
+        - tuple: (ids, selector) with ids a sorted int64 array.
+        """
+        key = (json.dumps(filters, sort_keys=True, default=str), self.store.version)
+        if key in self._filter_cache:
+            self._filter_cache.move_to_end(key)
+            return self._filter_cache[key]
+
+        ids = self.store.ids_matching(filters)
+        resolved = (ids, faiss.IDSelectorBatch(ids))
+        self._filter_cache[key] = resolved
+        while len(self._filter_cache) > FILTER_CACHE_SIZE:
+            self._filter_cache.popitem(last=False)
+        return resolved
+
+    def _dense_search(self, query_embeddings, k, allowed_ids=None, selector=None):
+        """
+        Searches the FAISS index for several query embeddings in one call.
+
+        With a filter only the allowed ids are considered. A few thousand of
+        them are searched exactly, straight over their vectors. Larger sets are
+        searched inside FAISS with the selector, visiting more of the graph or
+        more IVF lists the fewer ids are allowed, so nothing is over-fetched
+        to make up for the filter.
+
+        Parameters:
+        - query_embeddings (np.ndarray): float32 query embeddings.
+        - k (int): Results per query.
+        - allowed_ids (np.ndarray): Chunk IDs the filter allows, or None.
+        - selector (faiss.IDSelector): Selector of allowed_ids.
+
+        Returns:
+        - list: One list per query of (chunk_id, similarity) pairs, best first, without tombstoned ids.
+        """
+        if self.index is None or self.index.ntotal == 0:  # nothing ingested yet
+            return [[] for _ in range(len(query_embeddings))]
+
+        if selector is not None and len(allowed_ids) <= EXACT_FILTER_MAX_IDS:
+            ids = np.asarray(allowed_ids, dtype="int64")
+            distances, positions = faiss.knn(
+                np.ascontiguousarray(query_embeddings, dtype="float32"),
+                np.ascontiguousarray(self._stored_vectors(ids), dtype="float32"),
+                min(k, len(ids)), metric=faiss.METRIC_L2
+            )
+            ids = np.where(positions >= 0, ids[np.maximum(positions, 0)], -1)
+        elif selector is None:
+            # Over-fetch by the number of tombstones so removed chunks cannot crowd out results
+            fetch = min(k + len(self.deleted_ids), self.index.ntotal)
+            distances, ids = self.index.search(query_embeddings, fetch)
+        else:
+            fetch = min(k + len(self.deleted_ids), self.index.ntotal)
+            params = search_parameters(self.index, selector, self.nprobe, self.ef_search,
+                                       selectivity=len(allowed_ids) / self.index.ntotal)
+            distances, ids = self.index.search(query_embeddings, fetch, params=params)
+
+        results = []
+        for row_distances, row_ids in zip(distances, ids.tolist()):
+            hits = []
+            seen = set()
+            for distance, chunk_id in zip(row_distances, row_ids):
+                if chunk_id == -1 or chunk_id in self.deleted_ids or chunk_id in seen:
+                    continue
+                seen.add(chunk_id)
+                hits.append((chunk_id, float(1 / (1 + distance))))  # Convert L2 to similarity
+            results.append(hits[:k])
+        return results
+
+    def search_batch(self, queries, top_k=3, mode=None, min_similarity=0.3, rerank=None, diversify=None,
+                     filters=None):
+        """
+        Retrieves the top-k most relevant chunks for several queries at once.
+
+        All queries are embedded in one forward pass and searched with a single
+        multi-row FAISS call; the chunk texts of every hit are then read from the
+        store in one lookup.
+
+        In "hybrid" mode the FAISS results and BM25 results are fused with
+        reciprocal-rank fusion, so exact term matches (acronyms, equation
+        names) are found even when their embedding similarity is low. In
+        "dense" mode only FAISS is used and low-similarity results are dropped.
+
+        With a re-ranker, `rerank_candidates` first-stage results per query are
+        re-ordered by the cross-encoder before truncating to top_k. With
+        diversification, the final top_k are picked from the same candidate
+        pool by maximal marginal relevance, optionally capped per source title.
+        The cost of each stage is recorded in `last_search_stats`.
+
+        Filters restrict every query to chunks with matching metadata (for
+        example a handful of papers); both the FAISS and BM25 searches only
+        consider those chunks.
+
+        Parameters:
+        - queries (list): Query strings.
+        - top_k (int): Number of top chunks to return per query.
+        - mode (str): "hybrid" or "dense"; defaults to the retriever's retrieval_mode.
+        - min_similarity (float): Similarity cutoff applied in "dense" mode.
+        - rerank (bool): Whether to re-rank; defaults to True when a re-ranker is configured.
+        - diversify (bool): Whether to apply MMR; defaults to the retriever's diversify setting.
+        - filters (dict): Metadata filters as accepted by `ChunkStore.ids_matching`; None for all chunks.
 
         Returns:
-        - list: List of dictionaries containing text, metadata, and similarity scores.
+        - list: One list per query of dictionaries containing text, metadata, similarity and score.
         """
-        query_embedding = self.model.encode([query], convert_to_numpy=True)
-        distances, indices = self.index.search(query_embedding, top_k * 2)
+        if not queries:
+            return []
+        mode = mode or self.retrieval_mode
+        rerank = self.reranker is not None if rerank is None else rerank and self.reranker is not None
+        diversify = self.diversify if diversify is None else diversify
+        first_stage_k = max(top_k, self.rerank_candidates) if rerank or diversify else top_k
+        stats = {"queries": len(queries), "embed_ms": 0.0, "faiss_ms": 0.0, "lexical_ms": 0.0,
+                 "store_ms": 0.0, "rerank_ms": 0.0, "reranked": 0, "budget_exhausted": 0,
+                 "diversify_ms": 0.0, "filter_ms": 0.0}
+
+        allowed_ids, selector = None, None
+        if filters:
+            start = time.perf_counter()
+            allowed_ids, selector = self._resolve_filters(filters)
+            stats["filter_ms"] = (time.perf_counter() - start) * 1000
+            stats["filtered_chunks"] = len(allowed_ids)
+            if not len(allowed_ids):
+                self.last_search_stats = stats
+                return [[] for _ in queries]
+
+        start = time.perf_counter()
+        query_embeddings = self.embedder.encode_queries(queries)
+        stats["embed_ms"] = (time.perf_counter() - start) * 1000
+
+        if mode == "dense":
+            start = time.perf_counter()
+            dense_results = self._dense_search(query_embeddings, first_stage_k, allowed_ids, selector)
+            stats["faiss_ms"] = (time.perf_counter() - start) * 1000
+            rankings = [
+                [(chunk_id, similarity) for chunk_id, similarity in dense if similarity >= min_similarity]
+                for dense in dense_results
+            ]
+        else:
+            candidates = max(top_k * 4, first_stage_k)
+            start = time.perf_counter()
+            dense_results = self._dense_search(query_embeddings, candidates, allowed_ids, selector)
+            stats["faiss_ms"] = (time.perf_counter() - start) * 1000
+
+            start = time.perf_counter()
+            rankings = []
+            for query, dense in zip(queries, dense_results):
+                lexical = self.lexical.search(query, candidates, allowed_ids)
+                fused = reciprocal_rank_fusion([[i for i, _ in dense], [i for i, _ in lexical]])
+                rankings.append(fused[:first_stage_k])
+            stats["lexical_ms"] = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        chunks = self.store.get_many({chunk_id for ranked in rankings for chunk_id, _ in ranked})
+        stats["store_ms"] = (time.perf_counter() - start) * 1000
 
         results = []
-        for i, idx in enumerate(indices[0]):
-            if idx == -1 or i >= top_k:  # Take only top_k results
-                continue
+        for query, query_embedding, dense, ranked in zip(queries, query_embeddings, dense_results, rankings):
+            similarities = dict(dense)
+            query_results = []
+            for chunk_id, score in ranked:
+                chunk = chunks.get(chunk_id)
+                if chunk is None:
+                    continue
+                query_results.append({
+                    "id": chunk_id,
+                    "text": chunk["text"],
+                    "metadata": chunk["metadata"],
+                    "source": chunk["metadata"].get("title", ""),
+                    "similarity": similarities.get(chunk_id, 0.0),
+                    "score": score
+                })
+
+            if rerank and query_results:
+                query_results, rerank_stats = self.reranker.rerank(query, query_results)
+                stats["rerank_ms"] += rerank_stats["rerank_ms"]
+                stats["reranked"] += rerank_stats["reranked"]
+                stats["budget_exhausted"] += int(rerank_stats["budget_exhausted"])
+
+            if diversify and query_results:
+                start = time.perf_counter()
+                query_results = self._diversify(query_embedding, query_results, top_k)
+                stats["diversify_ms"] += (time.perf_counter() - start) * 1000
+            results.append(query_results[:top_k])
+
+        self.last_search_stats = stats
+        return results
+
+    def _stored_vectors(self, ids, texts=None):
+        """
+        Returns the stored embeddings of chunks, in the order of `ids`.
 
-            similarity = 1 / (1 + distances[0][i])
-            if similarity < 0.3:  # Filter out low similarity results
-                continue
+        They are reconstructed from the FAISS index by chunk id. Index types
+        that cannot reconstruct vectors (IVF without a direct map) fall back to
+        the embedding cache, which only runs the model on texts it has not seen.
+
+        Parameters:
+        - ids (np.ndarray): int64 chunk IDs.
+        - texts (list): Texts of the chunks, if at hand; otherwise read from the store.
+        """
+        try:
+            return self.index.reconstruct_batch(ids)
+        except RuntimeError:
+            if texts is None:
+                chunks = self.store.get_many(ids.tolist())
+                texts = [chunks[chunk_id]["text"] for chunk_id in ids.tolist()]
+            return self.embedder.encode_documents(texts)
+
+    def _candidate_embeddings(self, candidates):
+        """Returns the stored embeddings of search candidates, see `_stored_vectors`."""
+        ids = np.array([candidate["id"] for candidate in candidates], dtype="int64")
+        return self._stored_vectors(ids, [candidate["text"] for candidate in candidates])
+
+    def _diversify(self, query_embedding, candidates, top_k):
+        """
+        Re-selects top_k candidates by maximal marginal relevance.
 
-            results.append({
-                "text": self.text_chunks[idx],
-                "metadata": self.metadata[idx],
-                "similarity": similarity  # Convert L2 to similarity
-            })
+        Candidate embeddings are read back from the index (or the embedding
+        cache), so nothing is re-encoded. Relevance is the cross-encoder score
+        when the candidates were re-ranked, otherwise their first-stage score
+        (the fused rank in hybrid mode), so MMR keeps exact term matches that
+        BM25 ranked high even if their embeddings are far from the query.
+        """
+        embeddings = self._candidate_embeddings(candidates)
+
+        rerank_scores = [candidate.get("rerank_score") for candidate in candidates]
+        if not any(score is not None for score in rerank_scores):
+            rerank_scores = [candidate["score"] for candidate in candidates]
+        scores = np.array([np.nan if score is None else score for score in rerank_scores], dtype="float32")
+        low, high = np.nanmin(scores), np.nanmax(scores)
+        relevance = np.nan_to_num((scores - low) / ((high - low) or 1.0), nan=0.0)
+
+        picks = mmr_select(
+            query_embedding, embeddings, top_k,
+            lambda_mult=self.mmr_lambda,
+            relevance=relevance,
+            groups=[candidate["source"] for candidate in candidates],
+            max_per_group=self.max_per_source
+        )
+        return [candidates[i] for i in picks]
+
+    def retrieve_relevant_chunks(self, query, top_k=3, mode=None, min_similarity=0.3, filters=None):
+        """
+        Retrieves the top-k most relevant chunks for a query.
 
-        # return results
-        return sorted(results, key=lambda x: x['similarity'], reverse=True)[:top_k]
+        Parameters:
+        - query (str): The user's query or input.
+        - top_k (int): Number of top chunks to return.
+        - mode (str): "hybrid" or "dense"; defaults to the retriever's retrieval_mode.
+        - min_similarity (float): Similarity cutoff applied in "dense" mode.
+        - filters (dict): Metadata filters as accepted by `ChunkStore.ids_matching`.
 
+        Returns:
+        - list: List of dictionaries containing text, metadata, similarity and score.
+        """
+        return self.search_batch([query], top_k, mode, min_similarity, filters=filters)[0]
 
+    def search(self, query, top_k=3):
+        """Shorthand for `retrieve_relevant_chunks` with the default mode."""
+        return self.retrieve_relevant_chunks(query, top_k)
@@ -0,0 +1,231 @@
+import itertools
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+# Lower runs first: short autocomplete requests jump ahead of chat generations
+PRIORITY_AUTOCOMPLETE = 0
+PRIORITY_CHAT = 1
+
+PRIORITY_NAMES = {PRIORITY_AUTOCOMPLETE: "autocomplete", PRIORITY_CHAT: "chat"}
+
+# Number of recent queue waits kept per priority for percentiles
+WAIT_SAMPLES = 500
+
+_DONE = object()
+
+
+class QueueFull(Exception):
+    """Raised when the generation queue cannot take another request."""
+
+
+class StreamHandle:
+    def __init__(self, pieces, cancel):
+        """
+        Iterator over the text pieces of a queued stream.
+
+        Unlike a generator, closing it cancels the request even if iteration
+        never started, e.g. when a client disconnects before the first piece.
+
+        Parameters:
+        - pieces (queue.Queue): Pieces put by the worker, then an exception or the end marker.
+        - cancel (callable): Drops the request if queued, or stops it at the next piece.
+        """
+        self._pieces = pieces
+        self._cancel = cancel
+        self._closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._closed:
+            raise StopIteration
+        piece = self._pieces.get()
+        if piece is _DONE:
+            self.close()
+            raise StopIteration
+        if isinstance(piece, Exception):
+            self.close()
+            raise piece
+        return piece
+
+    def close(self):
+        """
+        Cancels the request; safe to call more than once and from another
+        thread, where an iteration waiting for the next piece then stops.
+        """
+        if not self._closed:
+            self._closed = True
+            self._cancel()
+            self._pieces.put(_DONE)  # wakes a reader; a dropped request never sends it
+
+
+class GenerationScheduler:
+    def __init__(self, engines, max_queue=16):
+        """
+        Serializes access to llama.cpp models behind a bounded priority queue.
+
+        Each engine (one model instance) is owned by a worker thread, so a
+        model is never used by two requests at once. Requests wait in a
+        priority queue; when it is full new requests are rejected with
+        `QueueFull` instead of piling up. The time each request spends queued
+        is recorded per priority.
+
+        Worker threads are started by `start` or the first `submit`, not here,
+        so creating a scheduler at import time has no side effects.
+
+        Parameters:
+        - engines (list): `GenerationEngine` instances, one per model instance.
+        - max_queue (int): Maximum number of waiting requests.
+        """
+        self.engines = list(engines)
+        self.max_queue = max_queue
+        self._queue = queue.PriorityQueue()
+        self._sequence = itertools.count()  # keeps FIFO order within a priority
+        self._lock = threading.Lock()
+        self._waits = {priority: deque(maxlen=WAIT_SAMPLES) for priority in PRIORITY_NAMES}
+        self._counts = {"submitted": 0, "rejected": 0, "completed": 0, "failed": 0, "cancelled": 0}
+        self._busy = 0
+        self._started = False
+
+    def start(self):
+        """Starts one worker thread per engine; later calls do nothing."""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        for number, engine in enumerate(self.engines):
+            threading.Thread(target=self._worker, args=(engine,), name=f"generation-{number}", daemon=True).start()
+
+    def _worker(self, engine):
+        while True:
+            _, _, job = self._queue.get()
+            fn, future, priority, enqueued = job
+            with self._lock:
+                self._waits[priority].append(time.perf_counter() - enqueued)
+                self._busy += 1
+            try:
+                if future.set_running_or_notify_cancel():
+                    future.set_result(fn(engine))
+                    self._count("completed")
+                else:
+                    self._count("cancelled")
+            except Exception as e:
+                future.set_exception(e)
+                self._count("failed")
+            finally:
+                with self._lock:
+                    self._busy -= 1
+                self._queue.task_done()
+
+    def _count(self, key):
+        with self._lock:
+            self._counts[key] += 1
+
+    def submit(self, fn, priority=PRIORITY_CHAT):
+        """
+        Queues `fn(engine)` to run on the next free engine.
+
+        Parameters:
+        - fn (callable): Called with a `GenerationEngine`; its return value is the result.
+        - priority (int): PRIORITY_AUTOCOMPLETE or PRIORITY_CHAT.
+
+        Returns:
+        - Future: Resolves to the return value of fn.
+
+        Raises:
+        - QueueFull: If max_queue requests are already waiting.
+        """
+        self.start()
+        future = Future()
+        with self._lock:
+            if self._queue.qsize() >= self.max_queue:
+                self._counts["rejected"] += 1
+                raise QueueFull(f"Generation queue is full ({self.max_queue} waiting)")
+            self._counts["submitted"] += 1
+            self._queue.put((priority, next(self._sequence), (fn, future, priority, time.perf_counter())))
+        return future
+
+    def generate(self, suffix, priority=PRIORITY_CHAT, timeout=None, **kwargs):
+        """Queues `GenerationEngine.generate` and waits for the generated text."""
+        return self.submit(lambda engine: engine.generate(suffix, **kwargs), priority).result(timeout)
+
+    def stream(self, suffix, priority=PRIORITY_CHAT, **kwargs):
+        """
+        Queues `GenerationEngine.stream` and returns a `StreamHandle` over its text pieces.
+
+        The request is queued immediately, so `QueueFull` is raised here rather
+        than when iteration starts. Closing the handle cancels the request,
+        whether or not it was iterated: it is dropped if still queued,
+        otherwise generation stops at the next piece.
+        """
+        pieces = queue.Queue()
+        cancelled = threading.Event()
+
+        def run(engine):
+            if cancelled.is_set():
+                pieces.put(_DONE)
+                return
+            generation = engine.stream(suffix, **kwargs)
+            try:
+                for piece in generation:
+                    if cancelled.is_set():
+                        break
+                    pieces.put(piece)
+            except Exception as e:
+                pieces.put(e)
+            finally:
+                generation.close()
+                pieces.put(_DONE)
+
+        future = self.submit(run, priority)
+
+        def cancel():
+            cancelled.set()
+            future.cancel()
+
+        return StreamHandle(pieces, cancel)
+
+    def set_prefix(self, prefix):
+        """Sets the shared prompt prefix on every engine."""
+        for engine in self.engines:
+            engine.set_prefix(prefix)
+
+    def set_models(self, models):
+        """Swaps the model of each engine, waiting for any running generation to finish."""
+        for engine, model in zip(self.engines, models):
+            engine.set_model(model)
+
+    def stats(self):
+        """
+        Returns queue metrics.
+
+        Returns:
+        - dict: Queue depth, busy workers, request counters and queue wait
+          (count, mean, p50, p95, max in milliseconds) per priority.
+        """
+        with self._lock:
+            waits = {}
+            for priority, samples in self._waits.items():
+                ordered = sorted(samples)
+                if not ordered:
+                    waits[PRIORITY_NAMES[priority]] = {"count": 0}
+                    continue
+                waits[PRIORITY_NAMES[priority]] = {
+                    "count": len(ordered),
+                    "mean_ms": round(sum(ordered) / len(ordered) * 1000, 1),
+                    "p50_ms": round(ordered[len(ordered) // 2] * 1000, 1),
+                    "p95_ms": round(ordered[min(int(len(ordered) * 0.95), len(ordered) - 1)] * 1000, 1),
+                    "max_ms": round(ordered[-1] * 1000, 1),
+                }
+            return {
+                "workers": len(self.engines),
+                "busy": self._busy,
+                "queued": self._queue.qsize(),
+                "max_queue": self.max_queue,
+                **self._counts,
+                "queue_wait": waits,
+            }
@@ -0,0 +1,51 @@
+import functools
+import hashlib
+import os
+import sys
+
+import numpy as np
+import pytest
+
+# Modules import each other from the backend directory, as when the app runs
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+EMBEDDING_DIMENSION = 16
+
+
+class FakeSentenceTransformer:
+    """Deterministic bag-of-words embeddings, so tests never download a model."""
+
+    def __init__(self, model_name):
+        self.model_name = model_name
+
+    def get_sentence_embedding_dimension(self):
+        return EMBEDDING_DIMENSION
+
+    def encode(self, texts, batch_size=32, convert_to_numpy=True, **kwargs):
+        embeddings = np.zeros((len(texts), EMBEDDING_DIMENSION), dtype="float32")
+        for row, text in enumerate(texts):
+            for word in text.lower().split():
+                embeddings[row, int(hashlib.md5(word.encode("utf-8")).hexdigest(), 16) % EMBEDDING_DIMENSION] += 1
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        return embeddings / np.where(norms == 0, 1, norms)
+
+
+@pytest.fixture
+def make_retriever(tmp_path, monkeypatch):
+    """Returns a factory of retrievers whose index, chunk store and embedding cache live in tmp_path."""
+    pytest.importorskip("sentence_transformers")
+    import rag.embeddings
+    import rag.retriever
+
+    monkeypatch.setattr(rag.embeddings, "SentenceTransformer", FakeSentenceTransformer)
+    monkeypatch.setattr(rag.retriever, "EmbeddingService", functools.partial(
+        rag.embeddings.EmbeddingService, cache_file=str(tmp_path / "embedding_cache.sqlite")
+    ))
+
+    def make(**options):
+        options.setdefault("knowledge_base", None)
+        options.setdefault("index_file", str(tmp_path / "index.faiss"))
+        options.setdefault("chunk_store", str(tmp_path / "chunk_store.sqlite"))
+        return rag.retriever.OptimizedRetriever(**options)
+
+    return make
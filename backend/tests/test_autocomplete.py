@@ -0,0 +1,88 @@
+import threading
+import time
+
+import autocomplete
+from autocomplete import MAX_PROMPT_CHARS, AutocompleteEngine
+from scheduler import GenerationScheduler
+
+
+class FakeStream:
+    def __init__(self, pieces):
+        self._pieces = iter(pieces)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._pieces)
+
+    def close(self):
+        pass
+
+
+class FakeScheduler:
+    def __init__(self):
+        self.prompts = []
+
+    def stream(self, prompt, **kwargs):
+        self.prompts.append(prompt)
+        return FakeStream([" and the", " results"])
+
+
+def test_cache_is_keyed_on_the_context_sent_to_the_model():
+    scheduler = FakeScheduler()
+    engine = AutocompleteEngine(scheduler, debounce_ms=0)
+    text = "x" * 2000 + " The method improves recall"
+
+    assert engine.complete("s", text)["suggestion"] == " and the results"
+    # An edit far outside the context tail does not invalidate the suggestion
+    edited = "y" + text[1:]
+    assert engine.complete("s", edited) == {"suggestion": " and the results", "cached": True, "superseded": False}
+    # Typing forward into the suggestion returns the rest of it
+    assert engine.complete("s", edited + " and")["suggestion"] == " the results"
+    assert len(scheduler.prompts) == 1
+    assert scheduler.prompts[0].endswith(text[-MAX_PROMPT_CHARS:])
+
+
+def test_sessions_are_bounded(monkeypatch):
+    monkeypatch.setattr(autocomplete, "MAX_SESSIONS", 10)
+    engine = AutocompleteEngine(FakeScheduler(), debounce_ms=0)
+    for number in range(50):
+        engine.complete(f"session {number}", f"text {number}")
+
+    assert len(engine._sessions) == 10
+    assert "session 49" in engine._sessions
+
+
+class CountingEngine:
+    def __init__(self):
+        self.started = 0
+
+    def stream(self, suffix, **kwargs):
+        self.started += 1
+        yield " suggestion"
+
+
+def test_superseded_requests_never_reach_the_model():
+    engine = CountingEngine()
+    scheduler = GenerationScheduler([engine])
+    release = threading.Event()
+    scheduler.submit(lambda engine: release.wait(5))  # keeps the only worker busy
+
+    autocompleter = AutocompleteEngine(scheduler, debounce_ms=0)
+    results = []
+    threads = []
+    for number in range(5):
+        thread = threading.Thread(target=lambda n=number: results.append((n, autocompleter.complete("s", f"text {n}"))))
+        thread.start()
+        threads.append(thread)
+        deadline = time.time() + 5
+        while scheduler.stats()["submitted"] < number + 2 and time.time() < deadline:
+            time.sleep(0.001)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert engine.started == 1
+    assert dict(results)[4]["suggestion"] == " suggestion"
+    assert all(result["superseded"] for number, result in results if number < 4)
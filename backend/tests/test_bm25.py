@@ -0,0 +1,77 @@
+import random
+import threading
+
+from rag.bm25 import BM25Index
+
+
+def test_concurrent_search_during_writes():
+    index = BM25Index()
+    index.add(list(range(100)), [f"paper {n} about retrieval and robots" for n in range(100)])
+    errors = []
+    stop = threading.Event()
+
+    def search():
+        try:
+            while not stop.is_set():
+                for chunk_id, _ in index.search("retrieval robots", top_k=5):
+                    assert 0 <= chunk_id < 400
+        except Exception as e:
+            errors.append(e)
+
+    readers = [threading.Thread(target=search) for _ in range(4)]
+    for reader in readers:
+        reader.start()
+    for start in range(100, 400, 20):
+        index.add(list(range(start, start + 20)), [f"new chunk {n} on retrieval" for n in range(20)])
+        index.remove(list(range(start - 100, start - 80)))
+    stop.set()
+    for reader in readers:
+        reader.join()
+
+    assert not errors
+    assert len(index) == 100
+    assert set(index.ids().tolist()) == set(range(300, 400))
+
+
+def test_scores_match_a_fresh_index_before_and_after_merging():
+    rng = random.Random(0)
+    words = ["retrieval", "robot", "thesis", "gradient", "vision", "corpus", "LSTMX", "attention", "model"]
+    texts = {}
+    index = BM25Index()
+    for start in range(0, 300, 30):
+        batch = {chunk_id: " ".join(rng.choices(words, k=rng.randint(3, 15))) for chunk_id in range(start, start + 30)}
+        index.add(list(batch), list(batch.values()))
+        texts.update(batch)
+        removed = rng.sample(sorted(texts), 10)
+        index.remove(removed)
+        for chunk_id in removed:
+            del texts[chunk_id]
+
+    def assert_matches_fresh():
+        fresh = BM25Index()
+        fresh.add(list(texts), list(texts.values()))
+        fresh.merge()
+        for query in ["retrieval robot", "LSTMX", "thesis vision model gradient"]:
+            expected = dict(fresh.search(query, top_k=500))
+            actual = dict(index.search(query, top_k=500))
+            assert actual.keys() == expected.keys()
+            assert all(abs(actual[chunk_id] - score) < 1e-4 for chunk_id, score in expected.items())
+
+    assert_matches_fresh()
+    index.merge()
+    assert not index._pending
+    assert_matches_fresh()
+
+
+def test_search_after_a_write_does_not_rebuild_the_index():
+    index = BM25Index()
+    index.add(list(range(1000)), [f"paper {n} about retrieval and robots" for n in range(1000)])
+    index.merge()
+    postings = index._postings
+
+    index.add([1000], ["LSTMX gating unit"])
+    index.remove([0])
+
+    assert [chunk_id for chunk_id, _ in index.search("LSTMX")] == [1000]
+    assert 0 not in {chunk_id for chunk_id, _ in index.search("paper retrieval", top_k=1000)}
+    assert index._postings is postings
@@ -0,0 +1,34 @@
+import pytest
+from rag.chunk_store import ChunkStore, validate_filters
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = ChunkStore(str(tmp_path / "chunk_store.sqlite"))
+    store.add([
+        ("Paper A", "first chunk", {"source": "pdf", "author": "Ada Lovelace", "year": 2021}),
+        ("Paper B", "second chunk", {"source": "arxiv", "author": "Alan Turing", "year": 2019}),
+    ])
+    return store
+
+
+def test_ids_matching_filters_by_scalars_and_lists(store):
+    assert len(store.ids_matching({"source": "pdf"})) == 1
+    assert len(store.ids_matching({"source": ["pdf", "arxiv"], "year_min": "2019"})) == 2
+    assert len(store.ids_matching({"author": "turing", "year_max": 2020})) == 1
+
+
+@pytest.mark.parametrize("filters", [
+    {"source": [["pdf"]]},
+    {"title": {"$ne": "Paper A"}},
+    {"year_min": [2020]},
+    {"year": "recent"},
+    {"author": ["Ada"]},
+    {"unknown": "x"},
+    ["source", "pdf"],
+])
+def test_non_scalar_filters_are_rejected(store, filters):
+    with pytest.raises(ValueError):
+        validate_filters(filters)
+    with pytest.raises(ValueError):
+        store.ids_matching(filters)
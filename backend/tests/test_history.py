@@ -0,0 +1,132 @@
+import random
+import string
+import threading
+import time
+from difflib import SequenceMatcher
+
+import history.history_manager
+import pytest
+from history.history_manager import add_unique_entry, get_history_store
+from history.history_store import HistoryStore
+
+THRESHOLD = 0.9
+
+
+def ratio(a, b):
+    # Without autojunk, which treats every letter of a 200+ character text as junk
+    return SequenceMatcher(None, a, b, autojunk=False).ratio()
+
+
+def make_text(rng, length):
+    return "".join(rng.choice(string.ascii_lowercase + "    ") for _ in range(length))
+
+
+def spread_edits(rng, text, edits):
+    """Replaces `edits` characters spread evenly over the text, the worst case for shingles."""
+    chars = list(text)
+    step = len(chars) / edits
+    for i in range(edits):
+        position = int(step * (i + 0.5))
+        chars[position] = rng.choice([c for c in string.ascii_lowercase if c != chars[position]])
+    return "".join(chars)
+
+
+def entry(content):
+    return {"timestamp": "now", "type": "user", "content": content}
+
+
+@pytest.mark.parametrize("length", [20, 40, 80, 160, 400, 800])
+def test_near_duplicates_are_found_at_every_length(tmp_path, length):
+    rng = random.Random(length)
+    store = HistoryStore(str(tmp_path / "history.sqlite"), duplicate_threshold=THRESHOLD)
+    originals = [make_text(rng, length) for _ in range(60)]
+    ids = [store.append(entry(text)) for text in originals]
+
+    found = total = 0
+    for entry_id, text in zip(ids, originals):
+        # Just enough edits to stay above the threshold
+        edits = max(1, round(length * (1 - THRESHOLD)) - 1)
+        duplicate = spread_edits(rng, text, edits)
+        if ratio(text, duplicate) <= THRESHOLD:
+            continue
+        total += 1
+        found += entry_id in {candidate["id"] for candidate in store.near_duplicate_candidates(duplicate)}
+    assert total
+    assert found / total >= 0.97
+
+
+@pytest.mark.parametrize("length", [40, 1000])
+def test_unrelated_entries_of_the_same_length_are_not_candidates(tmp_path, length):
+    rng = random.Random(length)
+    store = HistoryStore(str(tmp_path / "history.sqlite"), duplicate_threshold=THRESHOLD)
+    with store._lock:
+        for _ in range(500):
+            store._insert(entry(make_text(rng, length)))
+        store._db.commit()
+
+    candidates = [len(store.near_duplicate_candidates(make_text(rng, length))) for _ in range(20)]
+    assert sum(candidates) / len(candidates) < 5
+
+
+def test_short_duplicate_replaces_the_original(tmp_path):
+    store = HistoryStore(str(tmp_path / "history.sqlite"), duplicate_threshold=THRESHOLD)
+    add_unique_entry(store, entry("deep learning for thesis"), THRESHOLD)
+    add_unique_entry(store, entry("unrelated text"), THRESHOLD)
+    assert not add_unique_entry(store, entry("deep learning for theses"), THRESHOLD)
+    assert [e["content"] for e in store.iter_entries()] == ["unrelated text", "deep learning for theses"]
+
+
+def test_buckets_are_rebuilt_when_the_threshold_changes(tmp_path):
+    path = str(tmp_path / "history.sqlite")
+    text = make_text(random.Random(0), 600)
+    store = HistoryStore(path, duplicate_threshold=THRESHOLD)
+    entry_id = store.append(entry(text))
+    store._db.close()
+
+    store = HistoryStore(path, duplicate_threshold=0.8)
+    duplicate = spread_edits(random.Random(1), text, 50)
+    assert ratio(text, duplicate) > 0.8
+    assert entry_id in {candidate["id"] for candidate in store.near_duplicate_candidates(duplicate)}
+
+
+def test_concurrent_near_duplicates_keep_one_entry(tmp_path):
+    store = HistoryStore(str(tmp_path / "history.sqlite"), duplicate_threshold=THRESHOLD)
+    text = make_text(random.Random(0), 150)
+    start = threading.Barrier(8)
+
+    def add(number):
+        start.wait()
+        add_unique_entry(store, entry(spread_edits(random.Random(number), text, 3)), THRESHOLD)
+
+    threads = [threading.Thread(target=add, args=(number,)) for number in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert store.count() == 1
+    assert sum(row["entries"] for row in store.counters()) == 1
+
+
+def test_history_store_is_opened_once(tmp_path, monkeypatch):
+    opened = []
+
+    class SlowStore(HistoryStore):
+        def __init__(self, duplicate_threshold):
+            time.sleep(0.05)
+            opened.append(self)
+            super().__init__(str(tmp_path / "history.sqlite"), duplicate_threshold)
+
+    monkeypatch.setattr(history.history_manager, "HistoryStore", SlowStore)
+    monkeypatch.setattr(history.history_manager, "HISTORY_FILE", str(tmp_path / "history.json"))
+    monkeypatch.delattr(get_history_store, "_store", raising=False)
+
+    stores = []
+    threads = [threading.Thread(target=lambda: stores.append(get_history_store())) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(opened) == 1
+    assert all(store is opened[0] for store in stores)
@@ -0,0 +1,142 @@
+import os
+import random
+
+import numpy as np
+import pytest
+
+WORDS = ["model", "retrieval", "thesis", "transformer", "gradient", "dataset", "evaluation", "robot",
+         "control", "language", "vision", "attention", "embedding", "corpus", "baseline", "accuracy"]
+
+
+def make_documents(count, chunks_per_document=4, seed=0):
+    rng = random.Random(seed)
+    return {
+        f"Paper {number}": [
+            f"{number}-{chunk} " + " ".join(rng.choice(WORDS) for _ in range(12)) for chunk in range(chunks_per_document)
+        ]
+        for number in range(count)
+    }
+
+
+def assert_index_matches_store(retriever):
+    indexed = retriever.indexed_ids()
+    assert retriever.index.ntotal == len(retriever.store.ids())
+    assert len(np.unique(indexed)) == len(indexed)
+    assert set(indexed.tolist()) == set(retriever.store.ids().tolist())
+
+
+def test_sync_rebuilds_hnsw_once_without_duplicates(make_retriever):
+    retriever = make_retriever(index_type="hnsw")
+    for title, chunks in make_documents(10).items():
+        retriever.store.add_document(title, chunks)
+    retriever.ensure_index()
+    retriever.save_index()
+
+    # Change the store behind the index's back: enough removals to force a
+    # rebuild, plus new chunks that the sync has to pick up
+    retriever.store.remove(retriever.store.ids_for_documents({f"Paper {n}" for n in range(3)}))
+    for title, chunks in make_documents(2, seed=1).items():
+        retriever.store.add_document(f"New {title}", chunks)
+
+    retriever.sync_index()
+
+    assert not retriever.deleted_ids
+    assert_index_matches_store(retriever)
+
+
+def test_remove_chunks_rebuilds_hnsw_when_tombstones_pile_up(make_retriever):
+    retriever = make_retriever(index_type="hnsw")
+    retriever.store.add_document("Seed", ["seed chunk"])
+    retriever.ensure_index()
+    retriever.add_documents(make_documents(10))
+
+    retriever.remove_titles({f"Paper {n}" for n in range(4)})
+
+    assert not retriever.deleted_ids
+    assert_index_matches_store(retriever)
+
+
+def test_apply_ingestion_saves_streamed_documents(make_retriever):
+    retriever = make_retriever(index_type="flat")
+    retriever.store.add_document("Seed", ["seed chunk"])
+    retriever.ensure_index()
+    assert retriever.verify_index() == "current"
+
+    # Every document was indexed by the on_document callback during ingestion
+    documents = make_documents(3)
+    for title, chunks in documents.items():
+        assert retriever.index_document(title, chunks)
+    retriever.apply_ingestion({"added": list(documents), "updated": [], "indexed": list(documents), "removed_ids": []})
+
+    assert retriever.verify_index() == "current"
+    assert make_retriever(index_type="flat").verify_index() == "current"
+
+
+def is_mapped(path):
+    with open("/proc/self/maps") as f:
+        return any(line.rstrip().endswith(path) for line in f)
+
+
+@pytest.mark.skipif(not os.path.exists("/proc/self/maps"), reason="needs /proc to inspect mappings")
+def test_mmap_maps_flat_vectors_instead_of_copying(make_retriever):
+    retriever = make_retriever(index_type="flat")
+    for title, chunks in make_documents(5).items():
+        retriever.store.add_document(title, chunks)
+    retriever.ensure_index()
+    expected = retriever.retrieve_relevant_chunks("retrieval thesis model", min_similarity=0)
+
+    mapped = make_retriever(index_type="flat", use_mmap=True)
+    mapped.ensure_index()
+
+    assert is_mapped(os.path.realpath(mapped.index_file))
+    assert mapped.retrieve_relevant_chunks("retrieval thesis model", min_similarity=0) == expected
+
+
+def test_diversify_reads_candidate_vectors_from_the_index(make_retriever, monkeypatch):
+    retriever = make_retriever(index_type="flat", diversify=True, max_per_source=1)
+    for title, chunks in make_documents(6).items():
+        retriever.store.add_document(title, chunks)
+    retriever.ensure_index()
+
+    def fail(texts):
+        raise AssertionError("candidates were re-encoded")
+
+    monkeypatch.setattr(retriever.embedder, "encode_documents", fail)
+    results = retriever.search_batch(["retrieval thesis model"], top_k=3, min_similarity=0)[0]
+
+    assert len(results) == 3
+    assert len({result["source"] for result in results}) == 3
+
+
+@pytest.mark.parametrize("exact", [True, False])
+def test_selective_filter_on_hnsw_finds_the_allowed_chunks(make_retriever, monkeypatch, exact):
+    retriever = make_retriever(index_type="hnsw", diversify=False)
+    if not exact:
+        # Searches the graph with the selector and a scaled efSearch instead
+        import rag.retriever
+        monkeypatch.setattr(rag.retriever, "EXACT_FILTER_MAX_IDS", 0)
+    for title, chunks in make_documents(1500).items():
+        retriever.store.add_document(title, chunks)
+    retriever.ensure_index()
+
+    for query in ["retrieval thesis model", "robot control vision", "corpus baseline accuracy"]:
+        results = retriever.search_batch([query], top_k=3, mode="dense", min_similarity=0,
+                                         filters={"title": "Paper 7"})[0]
+        assert len(results) == 3
+        assert {result["source"] for result in results} == {"Paper 7"}
+
+
+def test_diversify_keeps_exact_term_matches_of_hybrid_search(make_retriever):
+    retriever = make_retriever(index_type="flat", retrieval_mode="hybrid", mmr_lambda=0.7, max_per_source=2)
+    for title, chunks in make_documents(3).items():
+        retriever.store.add_document(title, chunks)
+    # Ranked first by BM25 but last by the embeddings
+    retriever.store.add_document("Acronyms", ["LSTMX gating unit introduced in chapter two"])
+    retriever.ensure_index()
+
+    query = "LSTMX retrieval model results"
+    plain = retriever.search_batch([query], top_k=3, diversify=False)[0]
+    diverse = retriever.search_batch([query], top_k=3, diversify=True)[0]
+
+    assert diverse[0]["id"] == plain[0]["id"]
+    assert "Acronyms" in {result["source"] for result in diverse}
@@ -0,0 +1,73 @@
+import threading
+import time
+
+from scheduler import PRIORITY_CHAT, GenerationScheduler
+
+
+class FakeEngine:
+    """Streams numbered pieces slowly and records how far each generation got."""
+
+    def __init__(self, pieces=50, delay=0.01):
+        self.pieces = pieces
+        self.delay = delay
+        self.started = 0
+        self.produced = 0
+        self.closed = threading.Event()
+
+    def stream(self, suffix, **kwargs):
+        self.started += 1
+        try:
+            for number in range(self.pieces):
+                time.sleep(self.delay)
+                self.produced += 1
+                yield str(number)
+        finally:
+            self.closed.set()
+
+
+def test_closing_an_unstarted_stream_drops_the_queued_request():
+    engine = FakeEngine()
+    scheduler = GenerationScheduler([engine])
+    release = threading.Event()
+    busy = scheduler.submit(lambda engine: release.wait(5), PRIORITY_CHAT)
+
+    stream = scheduler.stream("prompt")
+    stream.close()  # client gone before the first piece, never iterated
+    release.set()
+    busy.result(5)
+    scheduler._queue.join()
+
+    assert engine.started == 0
+    assert scheduler.stats()["cancelled"] == 1
+
+
+def test_closing_a_running_stream_stops_generation():
+    engine = FakeEngine()
+    scheduler = GenerationScheduler([engine])
+
+    stream = scheduler.stream("prompt")
+    assert next(stream) == "0"
+    stream.close()
+
+    assert engine.closed.wait(5)
+    assert engine.produced < engine.pieces
+
+
+def test_stream_yields_every_piece():
+    engine = FakeEngine(pieces=5, delay=0)
+    scheduler = GenerationScheduler([engine])
+
+    assert list(scheduler.stream("prompt")) == ["0", "1", "2", "3", "4"]
+
+
+def generation_threads():
+    return sum(thread.name.startswith("generation-") for thread in threading.enumerate())
+
+
+def test_workers_start_on_first_submit():
+    before = generation_threads()
+    scheduler = GenerationScheduler([FakeEngine(), FakeEngine()])
+    assert generation_threads() == before
+
+    assert scheduler.submit(lambda engine: "done").result(5) == "done"
+    assert generation_threads() == before + 2
@@ -0,0 +1,18 @@
+from warmup import Component
+
+
+def test_on_ready_runs_without_the_lock():
+    seen = []
+    component = Component("value", lambda: 42, on_ready=lambda value: seen.append(component.status()))
+    assert component.wait(timeout=5) == 42
+    assert seen == [{"state": "loading", "load_seconds": None}]
+    assert component.status()["state"] == "ready"
+
+
+def test_failing_on_ready_marks_the_component_failed():
+    def on_ready(value):
+        raise RuntimeError("broken")
+
+    component = Component("value", lambda: 42, on_ready=on_ready)
+    assert component.wait(timeout=5) is None
+    assert component.status()["error"] == "broken"
@@ -0,0 +1,107 @@
+"""
+Benchmarks llama.cpp thread and batch settings on this machine and stores the
+fastest combination in the user settings.
+
+Run from the backend directory:
+    python -m utils.calibrate [--model PATH] [--dry-run]
+"""
+import argparse
+import itertools
+import time
+
+from .hardware import detect_hardware
+from .model_loader import load_model
+from .user_settings import load_settings, update_settings
+
+PROMPT_SENTENCE = "The thesis examines how retrieval improves the factual accuracy of language models. "
+
+# Shape of a typical request, used to weigh prompt evaluation against generation
+TYPICAL_PROMPT_TOKENS = 512
+TYPICAL_GENERATED_TOKENS = 128
+
+
+def candidate_configs(hardware, batch_sizes=(128, 512)):
+    """
+    Lists the (n_threads, n_batch) combinations to benchmark.
+
+    Parameters:
+    - hardware (dict): Result of `detect_hardware`.
+    - batch_sizes (tuple): Prompt batch sizes to try.
+
+    Returns:
+    - list: Dicts with "n_threads" and "n_batch".
+    """
+    physical, logical = hardware["physical_cores"], hardware["logical_cores"]
+    threads = sorted({max(1, physical // 2), physical, logical})
+    return [{"n_threads": t, "n_batch": b} for t, b in itertools.product(threads, batch_sizes)]
+
+
+def benchmark(model, prompt_tokens=256, generated_tokens=64):
+    """
+    Measures prompt evaluation and generation speed of a loaded model.
+
+    Parameters:
+    - model (Llama): Model to benchmark.
+    - prompt_tokens (int): Approximate prompt length in tokens.
+    - generated_tokens (int): Number of tokens to generate.
+
+    Returns:
+    - dict: "prompt_tps" and "generation_tps" in tokens per second.
+    """
+    tokens = model.tokenize(PROMPT_SENTENCE.encode("utf-8"), add_bos=False)
+    prompt = (tokens * (prompt_tokens // max(len(tokens), 1) + 1))[:prompt_tokens]
+    model.reset()  # don't let the KV cache of an earlier run skip the prompt
+
+    start = time.perf_counter()
+    first_token_at = None
+    generated = 0
+    for _ in model.create_completion(prompt, max_tokens=generated_tokens, temperature=0.0, stream=True):
+        if first_token_at is None:
+            first_token_at = time.perf_counter()
+        generated += 1
+    end = time.perf_counter()
+
+    first_token_at = first_token_at or end
+    return {
+        "prompt_tps": len(prompt) / max(first_token_at - start, 1e-9),
+        "generation_tps": max(generated - 1, 1) / max(end - first_token_at, 1e-9),
+    }
+
+
+def request_seconds(result):
+    """Estimated duration of a typical request for a benchmark result."""
+    return (TYPICAL_PROMPT_TOKENS / result["prompt_tps"]
+            + TYPICAL_GENERATED_TOKENS / result["generation_tps"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", help="GGUF model to benchmark (default: model_path from settings)")
+    parser.add_argument("--dry-run", action="store_true", help="print the results without updating settings")
+    args = parser.parse_args()
+
+    model_path = args.model or load_settings()["model_path"]
+    hardware = detect_hardware()
+    print(f"Hardware: {hardware}")
+
+    results = []
+    for config in candidate_configs(hardware):
+        # The weights are memory-mapped, so reloading per configuration is cheap
+        model = load_model(model_path, n_threads_batch=config["n_threads"], use_mlock=False, **config)
+        benchmark(model, prompt_tokens=32, generated_tokens=4)  # warm-up
+        result = dict(config, **benchmark(model))
+        results.append(result)
+        print(f"n_threads={config['n_threads']:>3} n_batch={config['n_batch']:>4} "
+              f"prompt {result['prompt_tps']:8.1f} tok/s  generation {result['generation_tps']:6.1f} tok/s")
+        del model
+
+    best = min(results, key=request_seconds)
+    print(f"Best: n_threads={best['n_threads']} n_batch={best['n_batch']} "
+          f"(~{request_seconds(best):.1f}s per {TYPICAL_PROMPT_TOKENS}+{TYPICAL_GENERATED_TOKENS} token request)")
+
+    if not args.dry_run:
+        update_settings(n_threads=best["n_threads"], n_threads_batch=best["n_threads"], n_batch=best["n_batch"])
+
+
+if __name__ == "__main__":
+    main()
@@ -12,7 +12,17 @@ os.makedirs(USER_PROFILE_DIR, exist_ok=True)
 SETTINGS_FILE = os.path.join(USER_PROFILE_DIR, "user_settings.json")
 DEFAULT_SETTINGS_FILE = os.path.join(USER_PROFILE_DIR, "default_settings.json")
 HISTORY_FILE = os.path.join(USER_PROFILE_DIR, "history.json")
+HISTORY_DB_FILE = os.path.join(USER_PROFILE_DIR, "history.sqlite")
 KNOWLEDGE_BASE_FILE = os.path.join(USER_PROFILE_DIR, "knowledge_base.json")
+CHUNK_STORE_FILE = os.path.join(USER_PROFILE_DIR, "chunk_store.sqlite")
+INGESTION_MANIFEST_FILE = os.path.join(USER_PROFILE_DIR, "ingestion_manifest.json")
+EMBEDDING_CACHE_FILE = os.path.join(USER_PROFILE_DIR, "embedding_cache.sqlite")
 
 # Default model path
-DEFAULT_MODEL_PATH = os.path.join(BASE_DIR, "models", "Nemotron-Mini-4B-Instruct-GGUF.gguf")
\ No newline at end of file
+DEFAULT_MODEL_PATH = os.path.join(BASE_DIR, "models", "Nemotron-Mini-4B-Instruct-GGUF.gguf")
+
+# SentenceTransformer used for retrieval embeddings (and chunk token counting)
+EMBEDDING_MODEL_NAME = "all-MiniLM-L6-v2"
+
+# Cross-encoder used to re-rank retrieval candidates
+RERANKER_MODEL_NAME = "cross-encoder/ms-marco-MiniLM-L-6-v2"
@@ -0,0 +1,78 @@
+import os
+
+
+def logical_core_count():
+    """Number of CPUs this process may run on."""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def physical_core_count():
+    """
+    Number of physical CPU cores, read from /proc/cpuinfo where available.
+
+    llama.cpp generation is memory-bound and gains nothing from SMT siblings,
+    so thread counts are derived from physical cores.
+
+    Returns:
+    - int: Physical core count, or the logical count if it cannot be determined.
+    """
+    logical = logical_core_count()
+    try:
+        cores = set()
+        physical_id = core_id = None
+        with open("/proc/cpuinfo") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                key = key.strip()
+                if key == "physical id":
+                    physical_id = value.strip()
+                elif key == "core id":
+                    core_id = value.strip()
+                elif not key and core_id is not None:
+                    cores.add((physical_id, core_id))
+                    physical_id = core_id = None
+        if core_id is not None:
+            cores.add((physical_id, core_id))
+        if cores:
+            # Affinity masks (e.g. containers) can allow fewer CPUs than the machine has
+            return max(1, min(len(cores), logical))
+    except OSError:
+        pass
+    return logical
+
+
+def total_memory_mb():
+    """Total physical memory in MiB, or None if it cannot be determined."""
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") / 2 ** 20
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def available_memory_mb():
+    """Memory available for new allocations in MiB (MemAvailable), falling back to the total."""
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) / 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return total_memory_mb()
+
+
+def detect_hardware():
+    """
+    Describes the host for sizing llama.cpp.
+
+    Returns:
+    - dict: "physical_cores", "logical_cores", "total_memory_mb" and "available_memory_mb".
+    """
+    return {
+        "physical_cores": physical_core_count(),
+        "logical_cores": logical_core_count(),
+        "total_memory_mb": total_memory_mb(),
+        "available_memory_mb": available_memory_mb(),
+    }
@@ -3,15 +3,89 @@ import os
 from llama_cpp import Llama
 
 from .constants import DEFAULT_MODEL_PATH
+from .hardware import detect_hardware
 from .user_settings import load_settings
 
+# Context sizes the "auto" n_ctx setting chooses from, largest first
+AUTO_CONTEXT_SIZES = (8192, 4096, 2048, 1024, 512)
+# Approximate KV-cache size per context token of the small (~4B) GGUF models
+# we ship: 2 (K and V) * 32 layers * 8 KV heads * 128 dims * 2 bytes (f16)
+KV_CACHE_MB_PER_TOKEN = 0.125
+# Share of the memory left after the weights that the KV caches may take
+KV_CACHE_MEMORY_SHARE = 0.5
 
-def load_model(model_path=DEFAULT_MODEL_PATH):
+
+def choose_context_size(model_path, available_memory_mb, instances=1):
+    """
+    Picks the largest context whose KV caches fit next to the model weights.
+
+    Parameters:
+    - model_path (str): Path to the GGUF model file.
+    - available_memory_mb (float): Memory available to the process, or None if unknown.
+    - instances (int): Number of model instances loaded side by side.
+
+    Returns:
+    - int: Context size in tokens.
+    """
+    if available_memory_mb is None:
+        return 2048
+    model_mb = os.path.getsize(model_path) / 2 ** 20 if os.path.exists(model_path) else 0
+    budget = (available_memory_mb - model_mb * instances) * KV_CACHE_MEMORY_SHARE
+    for n_ctx in AUTO_CONTEXT_SIZES:
+        if n_ctx * KV_CACHE_MB_PER_TOKEN * instances <= budget:
+            return n_ctx
+    return AUTO_CONTEXT_SIZES[-1]
+
+
+def resolve_model_options(model_path, settings=None, hardware=None):
+    """
+    Resolves llama.cpp options from user settings, filling in unset values from the host.
+
+    Settings: n_ctx (int or "auto"), n_batch, n_threads and n_threads_batch
+    (null = derived from the core count and split between `model_instances`),
+    use_mmap and use_mlock (only honoured if the weights fit in memory).
+
+    Parameters:
+    - model_path (str): Path to the GGUF model file.
+    - settings (dict): User settings; loaded if None.
+    - hardware (dict): Result of `detect_hardware`; detected if None.
+
+    Returns:
+    - dict: Keyword arguments for `Llama`.
+    """
+    settings = load_settings() if settings is None else settings
+    hardware = detect_hardware() if hardware is None else hardware
+    instances = max(1, int(settings.get("model_instances", 1)))
+
+    n_ctx = settings.get("n_ctx", "auto")
+    if n_ctx in (None, "auto"):
+        n_ctx = choose_context_size(model_path, hardware["available_memory_mb"], instances)
+
+    use_mlock = bool(settings.get("use_mlock", False))
+    if use_mlock and hardware["available_memory_mb"] is not None and os.path.exists(model_path):
+        if os.path.getsize(model_path) / 2 ** 20 * instances > hardware["available_memory_mb"] * 0.8:
+            print("Not locking the model in memory: it does not fit in available RAM")
+            use_mlock = False
+
+    return {
+        "n_ctx": int(n_ctx),
+        "n_batch": min(int(settings.get("n_batch") or 512), int(n_ctx)),
+        "n_threads": int(settings.get("n_threads") or max(1, hardware["physical_cores"] // instances)),
+        "n_threads_batch": int(settings.get("n_threads_batch") or max(1, hardware["logical_cores"] // instances)),
+        "use_mmap": bool(settings.get("use_mmap", True)),
+        "use_mlock": use_mlock,
+    }
+
+
+def load_model(model_path=DEFAULT_MODEL_PATH, **overrides):
     """
     Load the LLM model. If no path is provided, fallback to the default model from user settings.
 
+    Context, batch and thread sizes come from `resolve_model_options`.
+
     Parameters:
     - model_path (str): Path to the model file (e.g., ".gguf").
+    - overrides: llama.cpp options that take precedence over the settings.
 
     Returns:
     - Llama: Loaded model object.
@@ -19,8 +93,6 @@ def load_model(model_path=DEFAULT_MODEL_PATH):
     if not model_path or not os.path.exists(model_path):
         raise ValueError("Model path is invalid or missing.")
 
-    print(f"Loading model from: {model_path}")
-    return Llama(model_path=model_path,n_ctx=256,
-            n_batch=32,
-            n_threads=2,
-            verbose=False)
\ No newline at end of file
+    options = dict(resolve_model_options(model_path), **overrides)
+    print(f"Loading model from: {model_path} {options}")
+    return Llama(model_path=model_path, verbose=False, **options)
@@ -1,51 +1,98 @@
+import copy
 import json
 import os
+import tempfile
+import threading
 
-from genericpath import exists
 from utils.constants import DEFAULT_SETTINGS_FILE, SETTINGS_FILE
 
 # SETTINGS_FILE = "usersettings.json"
 
-def load_settings():
-    """Load user settings from JSON file"""
+# Parsed settings, shared by all request threads. Reloaded when the file's
+# modification time or size changes, e.g. after it was edited by hand.
+_lock = threading.RLock()
+_cache = {"signature": None, "settings": None}
+
+
+def _file_signature(path):
+    """Returns (mtime_ns, size) of a file, or None if it does not exist."""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _write_settings(settings):
+    """
+    Writes the settings atomically: to a temporary file in the same directory,
+    which then replaces the settings file, so readers never see a partial file.
+    Call with the lock held.
+    """
+    directory = os.path.dirname(SETTINGS_FILE)
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(prefix=".user_settings.", suffix=".tmp", dir=directory)
     try:
-        if not os.path.exists(SETTINGS_FILE):
-            # Copy default settings
-            with open(DEFAULT_SETTINGS_FILE, "r") as default_f:
-                settings = json.load(default_f)
-                os.makedirs(os.path.dirname(SETTINGS_FILE), exist_ok=True)
-                with open(SETTINGS_FILE, "w") as f:
-                    json.dump(settings, f, indent=4)
-                return settings
+        with os.fdopen(fd, "w") as f:
+            json.dump(settings, f, indent=4)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, SETTINGS_FILE)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    _cache["signature"] = _file_signature(SETTINGS_FILE)
+    _cache["settings"] = copy.deepcopy(settings)
 
+
+def _read_settings():
+    """Reads the settings file, resetting it to the defaults if missing or unreadable. Call with the lock held."""
+    try:
         with open(SETTINGS_FILE, "r") as f:
             content = f.read()
-            if not content.strip():
-                # File exists but empty
-                raise FileNotFoundError
-            return json.loads(content)
+        if not content.strip():
+            # File exists but empty
+            raise FileNotFoundError
+        return json.loads(content)
     except (json.JSONDecodeError, FileNotFoundError):
-         # On any error, reset to defaults
+        # On any error, reset to defaults
         with open(DEFAULT_SETTINGS_FILE, "r") as default_f:
             settings = json.load(default_f)
-            with open(SETTINGS_FILE, "w") as f:
-                json.dump(settings, f, indent=4)
-            return settings
+        _write_settings(settings)
+        return settings
+
+
+def load_settings():
+    """
+    Load user settings from JSON file.
+
+    The parsed settings are cached in memory; the file is only read again when
+    it changed on disk. Each call returns its own copy, so callers may modify it.
+    """
+    with _lock:
+        signature = _file_signature(SETTINGS_FILE)
+        if signature is None or signature != _cache["signature"]:
+            settings = _read_settings()
+            _cache["signature"] = _file_signature(SETTINGS_FILE)
+            _cache["settings"] = settings
+        return copy.deepcopy(_cache["settings"])
 
-def update_settings(model_path=None, system_prompt=None):
+def update_settings(model_path=None, system_prompt=None, **options):
     """
     Updates the settings in usersettings.json.
 
     Parameters:
     - model_path (str): Path to the selected model file.
     - system_prompt (str): System prompt to use.
+    - options: Any other settings to store, e.g. n_threads or n_batch.
     """
-    settings = load_settings()
-    if model_path is not None:
-        settings["model_path"] = model_path
-    if system_prompt is not None:
-        settings["system_prompt"] = system_prompt
-
-    with open(SETTINGS_FILE, "w") as f:
-        json.dump(settings, f, indent=4)
+    with _lock:
+        settings = load_settings()
+        if model_path is not None:
+            settings["model_path"] = model_path
+        if system_prompt is not None:
+            settings["system_prompt"] = system_prompt
+        settings.update(options)
+        _write_settings(settings)
     print("Settings updated.")
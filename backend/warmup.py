@@ -0,0 +1,112 @@
+import threading
+import time
+
+
+class ComponentNotReady(Exception):
+    """Raised when a component is still loading after the caller's timeout."""
+
+
+class Component:
+    def __init__(self, name, loader, on_ready=None):
+        """
+        Something slow to load (a model, the retriever) that is loaded in a
+        background thread, so the server can answer requests meanwhile.
+
+        Requests that need the component `wait` for it with a timeout. A
+        failed load does not raise there: `wait` returns None and the error is
+        reported by `status`, like a component that was never configured.
+
+        Parameters:
+        - name (str): Name reported in the status.
+        - loader (callable): Loads and returns the component; runs in the background thread.
+        - on_ready (callable): Called with the loaded value before waiting requests are released.
+        """
+        self.name = name
+        self.loader = loader
+        self.on_ready = on_ready
+        self.value = None
+        self.error = None
+        self.load_seconds = None
+        self._state = "pending"
+        self._generation = 0  # a newer load makes the result of an older one stale
+        self._ready = threading.Event()
+        self._lock = threading.Lock()
+
+    def start(self, reload=False):
+        """
+        Starts loading in a background thread; returns immediately.
+
+        Parameters:
+        - reload (bool): Load again even if already loaded or loading, e.g.
+          after the settings changed. Requests then wait for the new value.
+        """
+        with self._lock:
+            if self._state != "pending" and not reload:
+                return
+            self._generation += 1
+            self._state = "loading"
+            self._ready.clear()
+            generation = self._generation
+        threading.Thread(target=self._load, args=(generation,), name=f"warmup-{self.name}", daemon=True).start()
+
+    def _load(self, generation):
+        started = time.perf_counter()
+        try:
+            value, error = self.loader(), None
+        except Exception as e:
+            value, error = None, e
+        with self._lock:
+            if generation != self._generation:
+                return  # superseded by a newer load
+        # on_ready runs without the lock, so it may call status() or start()
+        if error is None and self.on_ready:
+            try:
+                self.on_ready(value)
+            except Exception as e:
+                value, error = None, e
+        with self._lock:
+            if generation != self._generation:
+                return
+            self.value, self.error = value, error
+            self.load_seconds = round(time.perf_counter() - started, 3)
+            self._state = "ready" if error is None else "failed"
+            self._ready.set()
+        if error is None:
+            print(f"{self.name} ready after {self.load_seconds:.1f}s")
+        else:
+            print(f"Error loading {self.name}: {error}")
+
+    def is_ready(self):
+        return self._ready.is_set()
+
+    def wait(self, timeout=None):
+        """
+        Returns the loaded value, starting the load if needed.
+
+        Parameters:
+        - timeout (float): Seconds to wait; None waits until loaded.
+
+        Returns:
+        - The loaded value, or None if loading failed.
+
+        Raises:
+        - ComponentNotReady: If still loading after the timeout.
+        """
+        self.start()
+        if not self._ready.wait(timeout):
+            raise ComponentNotReady(f"{self.name} is still loading, please retry shortly")
+        return self.value
+
+    def status(self):
+        """
+        Returns the load state of the component.
+
+        Returns:
+        - dict: "state" (pending, loading, ready or failed), "load_seconds"
+          of the last finished load, and "error" if it failed.
+        """
+        with self._lock:
+            status = {"state": self._state, "load_seconds": self.load_seconds}
+            if self.error is not None:
+                status["error"] = str(self.error)
+            return status